@@ -0,0 +1,282 @@
+'''
+Benchmarks of the stages on synthetic inputs (see synthetic.py)
+
+For every case the best time of --repeat runs is measured:
+- topsis: gnss_topsis_evaluation of the QC frame of n stations
+- fit: SphericalKMeansStationSelector.fit of n stations into k clusters (n_init 5)
+- xyz_to_llh: conversion of n positions
+- scan_rinexo_coord: coordinates from the RINEX headers of n stations
+- sinex_filter: delete_site_not_in_sinex of n stations against two weekly solutions
+- sinex_index: SinexPresenceIndex.filter_sites of n stations (index built beforehand)
+- startup: the import time of the command line tools (see bench_startup.py)
+
+usage: python benchmarks/bench_stages.py [--quick] [--repeat 5] [--json_file results.json]
+                                         [--baseline benchmarks/baseline.json] [--tolerance 0.5]
+                                         [--update_baseline] [--skip_startup]
+                                         [--src path/to/src --update_before]
+The results are compared with the baseline: the exit code is 1 if a case is slower than its
+baseline by more than the tolerance (and by more than 5 ms, tiny cases are noisy),
+or if an entry point breaks its start-up budget.
+
+The baseline also keeps the times of the tree before the optimizations ('before'), shown as
+the speed-up of every case. They are measured on a worktree of that commit, e.g.
+    git worktree add /tmp/before d9d2eb7
+    python benchmarks/bench_stages.py --src /tmp/before/src --update_before
+(the cases the older tree does not have are skipped).
+'''
+import subprocess
+import contextlib
+import io
+import json
+import platform
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BENCH_PATH = Path(__file__).resolve().parent
+SRC_PATH = BENCH_PATH.parent / 'src'
+sys.path.insert(0, str(SRC_PATH))
+sys.path.insert(0, str(BENCH_PATH))
+
+BASELINE_FILE = BENCH_PATH / 'baseline.json'
+# slower than the baseline by less than this is never a regression
+MIN_REGRESSION_SECONDS = 0.005
+
+SCALES = {
+    'topsis': [200, 1000, 5000],
+    'fit': [(500, 30), (2000, 100), (5000, 200)],
+    'xyz_to_llh': [1000, 100000, 1000000],
+    'scan_rinexo_coord': [100, 1000],
+    'sinex_filter': [500, 5000],
+    'sinex_index': [500, 5000],
+}
+QUICK_SCALES = {
+    'topsis': [200],
+    'fit': [(500, 30)],
+    'xyz_to_llh': [1000, 100000],
+    'scan_rinexo_coord': [100],
+    'sinex_filter': [500],
+    'sinex_index': [500],
+}
+
+YEAR = 2022
+DOY = 92
+
+
+def best_time(func, repeat: int) -> float:
+    """
+    Best wall time of repeat calls of func in seconds, with its output discarded
+    """
+    times = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            t_start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - t_start)
+    return min(times)
+
+
+def bench_topsis(n: int, repeat: int) -> float:
+    from synthetic import qc_frame, station_network
+    from station_eval import gnss_topsis_evaluation
+
+    qc = qc_frame(station_network(n)['site_name'], YEAR, DOY)
+    return best_time(lambda: gnss_topsis_evaluation(qc, show_details=False), repeat)
+
+def bench_fit(n: int, k: int, repeat: int) -> float:
+    from synthetic import station_network, station_scores
+    from choose_sta import SphericalKMeansStationSelector
+
+    network = station_network(n)
+    df = network.merge(station_scores(network['site_name']), on='site_name')
+
+    def fit():
+        selector = SphericalKMeansStationSelector(n_clusters=k, n_init=5, random_state=42)
+        selector.fit(df.copy(), quality_col='topsis_score')
+    return best_time(fit, repeat)
+
+def bench_xyz_to_llh(n: int, repeat: int) -> float:
+    from synthetic import station_network
+    from choose_sta import SphericalKMeansStationSelector
+
+    df = station_network(n)[['x', 'y', 'z']]
+    selector = SphericalKMeansStationSelector(n_clusters=1)
+    return best_time(lambda: selector.xyz_to_llh(df.copy()), repeat)
+
+def bench_scan_rinexo_coord(n: int, repeat: int) -> float:
+    from synthetic import station_network, write_rinex_headers
+    from site_list import scan_rinexo_coord
+
+    network = station_network(n)
+    with tempfile.TemporaryDirectory() as data_root_path:
+        write_rinex_headers(data_root_path, network, YEAR, DOY)
+        site_list = network['site_name'].tolist()
+        return best_time(lambda: scan_rinexo_coord(data_root_path, site_list, YEAR, DOY), repeat)
+
+def _write_weekly_solutions(sinex_root_path: str, n: int) -> list[Path]:
+    from synthetic import station_network, write_sinex
+
+    network = station_network(n)
+    sinex_files = []
+    # the two GPS weeks of 2022 doy 92..98; a station absent from the second week is filtered out
+    for gpsweek, week_network in ((2203, network), (2204, network.iloc[: n - n // 20])):
+        sinex_file = Path(sinex_root_path, f"igs22P{gpsweek}.snx")
+        write_sinex(sinex_file, week_network, matrix_lines=3 * n)
+        sinex_files.append(sinex_file)
+    return sinex_files
+
+def bench_sinex_filter(n: int, repeat: int) -> float:
+    from synthetic import station_network
+    from gene_initial_4sys_sitelist import delete_site_not_in_sinex
+
+    site_list = station_network(n)['site_name'].tolist()
+    with tempfile.TemporaryDirectory() as sinex_root_path:
+        sinex_files = _write_weekly_solutions(sinex_root_path, n)
+        return best_time(lambda: delete_site_not_in_sinex(site_list, sinex_files), repeat)
+
+def bench_sinex_index(n: int, repeat: int) -> float:
+    from synthetic import station_network
+    from sinex_index import SinexPresenceIndex
+
+    site_list = station_network(n)['site_name'].tolist()
+    with tempfile.TemporaryDirectory() as sinex_root_path:
+        _write_weekly_solutions(sinex_root_path, n)
+        sinex_index = SinexPresenceIndex(sinex_root_path)
+        sinex_index.update()
+        return best_time(lambda: sinex_index.filter_sites(site_list, YEAR, DOY, DOY + 6), repeat)
+
+
+# case: (benchmark function, name of its scale)
+BENCHMARKS = {
+    'topsis': (bench_topsis, 'n={}'),
+    'fit': (bench_fit, 'n={},k={}'),
+    'xyz_to_llh': (bench_xyz_to_llh, 'n={}'),
+    'scan_rinexo_coord': (bench_scan_rinexo_coord, 'n={}'),
+    'sinex_filter': (bench_sinex_filter, 'n={}'),
+    'sinex_index': (bench_sinex_index, 'n={}'),
+}
+
+def run_benchmarks(scales: dict, repeat: int = 3) -> dict:
+    """
+    Run every case of scales, except the ones whose module or function the source tree does not have
+
+    Returns:
+    - dict case name -> best time in seconds
+    """
+    cases = {}
+    for case, (bench, scale_name) in BENCHMARKS.items():
+        for scale in scales[case]:
+            scale = scale if isinstance(scale, tuple) else (scale,)
+            try:
+                cases[f"{case}/{scale_name.format(*scale)}"] = bench(*scale, repeat)
+            except ImportError as e:
+                print(f"{case}: skipped ({e})")
+                break
+    return cases
+
+def compare(cases: dict, baseline: dict, tolerance: float) -> dict:
+    """
+    Compare the cases with the baseline cases
+
+    Returns:
+    - dict case name -> {'seconds', 'baseline', 'ratio', 'regression'} (baseline and ratio None for new cases)
+    """
+    comparison = {}
+    for name, seconds in cases.items():
+        reference = baseline.get(name)
+        if reference is None:
+            comparison[name] = {'seconds': seconds, 'baseline': None, 'ratio': None, 'regression': False}
+            continue
+        regression = seconds > reference * (1 + tolerance) and seconds - reference > MIN_REGRESSION_SECONDS
+        comparison[name] = {'seconds': seconds, 'baseline': reference,
+                            'ratio': seconds / reference if reference > 0 else None,
+                            'regression': regression}
+    return comparison
+
+def source_commit(src_path: Path) -> str:
+    """
+    Abbreviated commit of the git checkout of src_path, None outside of a checkout
+    """
+    proc = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=src_path,
+                          capture_output=True, text=True)
+    return proc.stdout.strip() if proc.returncode == 0 else None
+
+def environment() -> dict:
+    import numpy as np
+    import pandas as pd
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+            'machine': platform.machine(), 'processor': platform.processor(),
+            'date': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--quick', action='store_true', help='Only the small scales')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of runs per case, the best one counts')
+    parser.add_argument('--json_file', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', default=str(BASELINE_FILE), help='Baseline JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='Relative slow-down reported as a regression')
+    parser.add_argument('--update_baseline', action='store_true', help='Store the results as the new baseline')
+    parser.add_argument('--skip_startup', action='store_true', help='Do not run the start-up guard')
+    parser.add_argument('--src', help='Source tree to measure, e.g. a worktree of an older commit '
+                        '(default: src of this repository)')
+    parser.add_argument('--update_before', action='store_true',
+                        help='Store the results as the times before the optimizations (with --src)')
+    args = parser.parse_args()
+
+    src_path = SRC_PATH
+    if args.src:
+        # the modules of the stages must come from that tree only
+        src_path = Path(args.src).resolve()
+        sys.path.remove(str(SRC_PATH))
+        sys.path.insert(0, str(src_path))
+    cases = run_benchmarks(QUICK_SCALES if args.quick else SCALES, args.repeat)
+
+    startup = {}
+    if not args.skip_startup:
+        from bench_startup import check_startup
+        startup = check_startup(args.repeat, src_path)
+        for module, result in startup.items():
+            cases[f"startup/{module}"] = result['import_ms'] / 1000.0
+
+    stored = {}
+    if Path(args.baseline).exists():
+        with open(args.baseline, 'r') as inp:
+            stored = json.load(inp)
+    # the tree before the optimizations is measured, not checked against the current times
+    comparison = compare(cases, {} if args.update_before else stored.get('cases', {}), args.tolerance)
+    before = stored.get('before', {}).get('cases', {})
+
+    for name, result in comparison.items():
+        if result['baseline'] is None:
+            versus = 'no baseline'
+        else:
+            versus = f"baseline {result['baseline'] * 1000:10.2f} ms  x{result['ratio']:.2f}"
+        status = 'REGRESSION' if result['regression'] else ''
+        speedup = ''
+        if not args.update_before and before.get(name):
+            speedup = f"  before {before[name] * 1000:10.2f} ms  {before[name] / result['seconds']:6.1f}x faster"
+        print(f"{name:36s} {result['seconds'] * 1000:10.2f} ms  {versus}{speedup} {status}")
+    startup_failed = [module for module, result in startup.items() if not result['ok']]
+    for module in startup_failed:
+        print(f"start-up guard failed: {module}")
+
+    results = {'environment': environment(), 'commit': source_commit(src_path), 'cases': cases,
+               'comparison': comparison, 'startup': startup}
+    if args.json_file:
+        with open(args.json_file, 'w') as outp:
+            json.dump(results, outp, indent=2)
+    if args.update_baseline or args.update_before:
+        if args.update_before:
+            stored['before'] = {'commit': results['commit'], 'environment': results['environment'],
+                                'cases': cases}
+        else:
+            stored.update(environment=results['environment'], cases=cases)
+        with open(args.baseline, 'w') as outp:
+            json.dump(stored, outp, indent=2)
+        print(f"The baseline has been saved to: {args.baseline}")
+
+    regressions = [name for name, result in comparison.items() if result['regression']]
+    sys.exit(1 if regressions or (startup_failed and not args.update_before) else 0)
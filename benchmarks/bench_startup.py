@@ -0,0 +1,108 @@
+'''
+Start-up time guard of the command line tools
+
+For every entry point, run `python -X importtime -c "import <module>"` and check
+- the cumulative import time of the module (best of --repeat runs) against its budget
+- that the heavy dependencies the module must not load at start-up are not imported
+
+usage: python benchmarks/bench_startup.py [--repeat 5] [--json_file startup.json]
+The exit code is 1 if an entry point is over budget or imports a forbidden package.
+'''
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+SRC_PATH = Path(__file__).resolve().parent.parent / 'src'
+
+HEAVY = ['numpy', 'pandas', 'scipy', 'sklearn', 'matplotlib']
+
+# module: (budget in ms, packages that must not be imported at start-up)
+ENTRY_POINTS = {
+    'anibus_ana': (100, HEAVY),
+    'api': (100, HEAVY),
+    'gene_initial_4sys_sitelist': (100, HEAVY),
+    'metrics': (100, HEAVY),
+    'extract_qc': (100, HEAVY),
+    'fetch_obs': (100, HEAVY),
+    'pipeline': (100, HEAVY),
+    'site_list': (100, HEAVY),
+    'time_convert': (50, HEAVY),
+    'station_eval': (400, ['pandas', 'scipy', 'sklearn', 'matplotlib']),
+    'choose_sta': (400, ['pandas', 'scipy', 'sklearn', 'matplotlib']),
+}
+
+
+def import_profile(module: str, src_path: Path = SRC_PATH) -> tuple[float, set[str]]:
+    """
+    Cumulative import time (ms) of module and the set of the imported top-level packages
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          cwd=src_path, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr}")
+
+    cumulative_ms = None
+    packages = set()
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or line.endswith('imported package'):
+            continue
+        _, cumulative, name = line.split('|')
+        name = name.strip()
+        packages.add(name.split('.')[0])
+        if name == module:
+            cumulative_ms = int(cumulative) / 1000.0
+    return cumulative_ms, packages
+
+
+def check_startup(repeat: int = 5, src_path: Path = SRC_PATH) -> dict:
+    """
+    Profile every entry point of the source tree src_path (the ones it does not have are skipped)
+
+    Returns:
+    - dict module -> {'import_ms', 'budget_ms', 'forbidden_imports', 'ok'}
+    """
+    import compileall
+    # the bytecode must be current, otherwise the import times include the compilation
+    # (e.g. with PYTHONDONTWRITEBYTECODE set, edited modules are compiled at every import)
+    compileall.compile_dir(str(src_path), quiet=1)
+
+    results = {}
+    for module, (budget_ms, forbidden) in ENTRY_POINTS.items():
+        if not Path(src_path, f"{module}.py").exists():
+            continue
+        times = []
+        packages = set()
+        for _ in range(repeat):
+            cumulative_ms, packages = import_profile(module, src_path)
+            times.append(cumulative_ms)
+        import_ms = min(times)
+        forbidden_imports = sorted(packages & set(forbidden))
+        results[module] = {
+            'import_ms': import_ms,
+            'budget_ms': budget_ms,
+            'forbidden_imports': forbidden_imports,
+            'ok': import_ms <= budget_ms and not forbidden_imports,
+        }
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5, help='Number of runs per entry point, the best one counts')
+    parser.add_argument('--json_file', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = check_startup(args.repeat)
+    for module, result in results.items():
+        status = 'ok' if result['ok'] else 'FAIL'
+        forbidden = f"  forbidden imports: {', '.join(result['forbidden_imports'])}" if result['forbidden_imports'] else ''
+        print(f"{module:28s} {result['import_ms']:8.1f} ms (budget {result['budget_ms']} ms) {status}{forbidden}")
+
+    if args.json_file:
+        with open(args.json_file, 'w') as outp:
+            json.dump(results, outp, indent=2)
+
+    sys.exit(0 if all(result['ok'] for result in results.values()) else 1)
@@ -0,0 +1,163 @@
+'''
+Synthetic inputs of the benchmarks
+
+- station networks on the WGS84 ellipsoid, clustered like the real GNSS networks:
+  dense in Europe, North America and East Asia, sparse over the oceans
+- TOPSIS scores and anubis QC frames of the stations
+- RINEX observation headers and SINEX weekly solutions of the stations
+
+All the generators are deterministic for a given seed.
+'''
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+# (latitude, longitude, spread in degrees, share of the stations)
+REGIONS = [
+    (50.0, 10.0, 8.0, 0.30),      # Europe
+    (40.0, -95.0, 12.0, 0.22),    # North America
+    (35.0, 120.0, 10.0, 0.13),    # East Asia
+    (-25.0, 135.0, 10.0, 0.07),   # Australia
+    (-15.0, -55.0, 12.0, 0.07),   # South America
+    (0.0, 20.0, 15.0, 0.06),      # Africa
+]
+# the other stations are spread uniformly over the sphere (ocean islands, polar stations)
+BACKGROUND_SHARE = 1.0 - sum(region[3] for region in REGIONS)
+
+SYSTEMS = ['G', 'R', 'E', 'C']
+QC_INDICATORS = ['nobs', 'csAll', 'nSlp', 'nJmp', 'nGap', 'nPcs', 'mp1', 'mp2', 'cnr1', 'cnr2']
+
+CODE_CHARS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+def site_code(i: int) -> str:
+    """
+    Unique 4-char site code of station i (base 36)
+    """
+    code = ''
+    for _ in range(4):
+        i, digit = divmod(i, 36)
+        code = CODE_CHARS[digit] + code
+    return code
+
+def llh_to_xyz(lat, lon, h):
+    """
+    WGS84 geodetic latitude, longitude (degrees) and height (m) to ECEF x, y, z (m)
+    """
+    a = 6378137.0
+    f = 1.0 / 298.257223563
+    e2 = f * (2 - f)
+    lat = np.radians(lat)
+    lon = np.radians(lon)
+    n = a / np.sqrt(1 - e2 * np.sin(lat) ** 2)
+    x = (n + h) * np.cos(lat) * np.cos(lon)
+    y = (n + h) * np.cos(lat) * np.sin(lon)
+    z = (n * (1 - e2) + h) * np.sin(lat)
+    return x, y, z
+
+def station_network(n: int, seed: int = 0) -> pd.DataFrame:
+    """
+    n stations clustered in the REGIONS, the others spread over the sphere
+
+    Returns:
+    - pandas DataFrame with site_name, x, y, z
+    """
+    rng = np.random.default_rng(seed)
+    shares = [region[3] for region in REGIONS] + [BACKGROUND_SHARE]
+    region_of = rng.choice(len(shares), size=n, p=shares)
+
+    lat = np.empty(n)
+    lon = np.empty(n)
+    for i, (lat0, lon0, spread, _) in enumerate(REGIONS):
+        mask = region_of == i
+        m = int(mask.sum())
+        lat[mask] = np.clip(rng.normal(lat0, spread, m), -89.9, 89.9)
+        # same spread in kilometres east-west as north-south
+        lon[mask] = (rng.normal(lon0, spread / np.cos(np.radians(lat0)), m) + 180.0) % 360.0 - 180.0
+    mask = region_of == len(REGIONS)
+    lat[mask] = np.degrees(np.arcsin(rng.uniform(-1, 1, int(mask.sum()))))
+    lon[mask] = rng.uniform(-180.0, 180.0, int(mask.sum()))
+    h = rng.uniform(0.0, 2000.0, n)
+
+    x, y, z = llh_to_xyz(lat, lon, h)
+    return pd.DataFrame({'site_name': [site_code(i) for i in range(n)], 'x': x, 'y': y, 'z': z})
+
+def station_scores(site_names: list[str], seed: int = 0) -> pd.DataFrame:
+    """
+    TOPSIS scores skewed to good quality, as in the real rankings
+
+    Returns:
+    - pandas DataFrame with site_name, topsis_score
+    """
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'site_name': list(site_names), 'topsis_score': rng.beta(8.0, 2.0, len(site_names))})
+
+def qc_frame(site_names: list[str], year: int, doy: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Anubis QC indicators of one day, in the layout of extract_qc_single_day
+
+    Returns:
+    - pandas DataFrame indexed by site_name, columns '{system}_{indicator}_{yyyydoy}'
+    """
+    rng = np.random.default_rng(seed)
+    n = len(site_names)
+    columns = {}
+    for system in SYSTEMS:
+        nobs = rng.normal(2800.0, 200.0, n).clip(0)
+        values = {
+            'nobs': nobs,
+            'csAll': rng.poisson(20, n),
+            'nSlp': rng.poisson(5, n),
+            'nJmp': rng.poisson(1, n),
+            'nGap': rng.poisson(2, n),
+            'nPcs': rng.poisson(2, n),
+            'mp1': rng.gamma(4.0, 0.1, n),
+            'mp2': rng.gamma(4.0, 0.12, n),
+            'cnr1': rng.normal(45.0, 3.0, n),
+            'cnr2': rng.normal(42.0, 3.0, n),
+        }
+        for indicator in QC_INDICATORS:
+            columns[f"{system}_{indicator}_{year:04d}{doy:03d}"] = values[indicator].astype(float)
+    frame = pd.DataFrame(columns, index=pd.Index(list(site_names), name='site_name'))
+    return frame
+
+def write_rinex_headers(data_root_path: str, network: pd.DataFrame, year: int, doy: int) -> None:
+    """
+    RINEX 3 observation files (header and a few epoch lines) of the stations,
+    in f"{data_root_path}/obs/daily/{year:04d}/{doy:03d}/"
+    """
+    obs_path = Path(data_root_path, 'obs', 'daily', f"{year:04d}", f"{doy:03d}")
+    obs_path.mkdir(parents=True, exist_ok=True)
+    for site, x, y, z in zip(network['site_name'], network['x'], network['y'], network['z']):
+        with open(obs_path / f"{site.lower()}{doy:03d}0.{year % 100:02d}o", 'w') as outp:
+            outp.write(f"{'3.04':>9}{'':11}{'OBSERVATION DATA':20}{'M':20}RINEX VERSION / TYPE\n")
+            outp.write(f"{site:60}MARKER NAME\n")
+            outp.write(f"{'1234':20}{'SEPT POLARX5':20}{'5.3.2':20}REC # / TYPE / VERS\n")
+            outp.write(f"{'5678':20}{'TRM59800.00     NONE':20}{'':20}ANT # / TYPE\n")
+            outp.write(f"{x:14.4f}{y:14.4f}{z:14.4f}{'':18}APPROX POSITION XYZ\n")
+            outp.write(f"{'G    8 C1C L1C D1C S1C C2W L2W D2W S2W':60}SYS / # / OBS TYPES\n")
+            outp.write(f"{30.0:10.3f}{'':50}INTERVAL\n")
+            outp.write(f"{'':60}END OF HEADER\n")
+            outp.write(f"> {year:04d} 01 01 00 00  0.0000000  0  8\n" * 20)
+
+def write_sinex(sinex_file: str, network: pd.DataFrame, ref_epoch: str = '22:092:43200',
+                matrix_lines: int = 0) -> None:
+    """
+    SINEX file with the STAX/STAY/STAZ/VELX estimates of the stations,
+    followed by matrix_lines lines of a covariance block (never read by the readers)
+    """
+    with open(sinex_file, 'w') as outp:
+        outp.write('%=SNX 2.02 IGS 22:099:00000 IGS 22:092:00000 22:099:00000 P 00000 2 S\n')
+        outp.write('+SOLUTION/ESTIMATE\n')
+        outp.write('*INDEX TYPE__ CODE PT SOLN _REF_EPOCH__ UNIT S __ESTIMATED VALUE____ _STD_DEV___\n')
+        index = 1
+        for site, x, y, z in zip(network['site_name'], network['x'], network['y'], network['z']):
+            for param_type, value in (('STAX', x), ('STAY', y), ('STAZ', z), ('VELX', 0.0)):
+                outp.write(f"{index:6d} {param_type:6s} {site:4s}  A    1 {ref_epoch} m    2 "
+                           f"{value:21.14e} 1.00000e-03\n")
+                index += 1
+        outp.write('-SOLUTION/ESTIMATE\n')
+        outp.write('+SOLUTION/MATRIX_ESTIMATE L COVA\n')
+        outp.write(' 1 1 1.0e-06 0.0e+00 0.0e+00\n' * matrix_lines)
+        outp.write('-SOLUTION/MATRIX_ESTIMATE L COVA\n')
+        outp.write('%ENDSNX\n')
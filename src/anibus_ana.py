@@ -1,7 +1,10 @@
 import xml.etree.ElementTree as ET
 from pathlib import Path
 import subprocess
+import shlex
+import shutil
 import os
+import metrics
 
 def gene_rinex_code(site_name: str,
                     year: int,
@@ -36,7 +39,6 @@ def replace_rinex(xml_path: str,
     if not xml_path.exists():
         backup_path = xml_path.with_suffix(xml_path.suffix + '.bak')
         if backup_path.exists():
-            import shutil
             shutil.copy(backup_path, xml_path)
         else:
             raise FileNotFoundError(f"cannot find XML file: {xml_path} And there are no backup files available.")
@@ -72,19 +74,28 @@ def exec_anibus_single_site(xml_file: str,
                             doy: int,
                             data_root_path: str,
                             work_root_path: str,
+                            backup_xml: bool = True,
                             ) -> None:
     """
-    Perform a single-station, single-day analysis using anubis
+    Perform a single-station, single-day analysis using anubis, RuntimeError if anubis fails
+    - backup_xml: back up xml_file before it is modified, see replace_rinex
+    anubis runs in the anubis work directory of the day; the working directory
+    of this process is not changed, so days can run concurrently with their own xml_file.
     """
     rinex_o_content, rinex_n_content = gene_rinex_code(site_name,year,doy,data_root_path)
-    replace_rinex(xml_file, str(rinex_o_content), str(rinex_n_content))
+    replace_rinex(xml_file, str(rinex_o_content), str(rinex_n_content), backup=backup_xml)
 
     
     anubis_work_path = Path(work_root_path,'work'+str(year).zfill(4)+str(doy).zfill(3),'anubis')
     if not anubis_work_path.exists():
-        os.makedirs(anubis_work_path)
-    os.chdir(anubis_work_path)
-    os.system(f'{anubis_bin_pathandname} -x {xml_file}')
+        os.makedirs(anubis_work_path, exist_ok=True)
+    # posix=False keeps the backslashes of Windows paths
+    command = shlex.split(anubis_bin_pathandname, posix=os.name != 'nt')
+    with metrics.timer('anubis'):
+        completed = subprocess.run(command + ['-x', str(Path(xml_file).resolve())], cwd=anubis_work_path)
+    metrics.count('anubis_runs')
+    if completed.returncode != 0:
+        raise RuntimeError(f"anubis failed for {site_name} {year:04d}-{doy:03d} (exit code {completed.returncode})")
 
 def exec_anibus_multi_sites(xml_file: str,
                             anubis_bin_pathandname: str,
@@ -93,12 +104,37 @@ def exec_anibus_multi_sites(xml_file: str,
                             doy: int,
                             data_root_path: str,
                             work_root_path: str,
-                            ) -> None:
+                            ) -> list[str]:
     """
-    Perform a multiple-stations, single-day analysis using anubis
+    Perform a multiple-stations, single-day analysis using anubis.
+    The xml_file template is copied into the anubis work directory of the day
+    and only the copy is modified.
+    A station for which anubis fails is reported and skipped, extract_qc gives it penalty values;
+    RuntimeError is raised only if anubis fails for every station (e.g. a broken installation),
+    a missing executable raises OSError.
+
+    Returns:
+    - the stations for which anubis failed
     """
+    anubis_work_path = Path(work_root_path,'work'+str(year).zfill(4)+str(doy).zfill(3),'anubis')
+    os.makedirs(anubis_work_path, exist_ok=True)
+    day_xml_file = Path(anubis_work_path, f"anubis_{year:04d}{doy:03d}.xml")
+    shutil.copyfile(xml_file, day_xml_file)
+    
+    failed_sites = []
     for site_name in site_list:
-        exec_anibus_single_site(xml_file, anubis_bin_pathandname, site_name, year, doy, data_root_path, work_root_path)
+        try:
+            exec_anibus_single_site(day_xml_file, anubis_bin_pathandname, site_name, year, doy, data_root_path, work_root_path,
+                                    backup_xml=False)
+        except RuntimeError as e:
+            print(f"Warning: {e}")
+            failed_sites.append(site_name)
+    if failed_sites and len(failed_sites) == len(site_list):
+        raise RuntimeError(f"anubis failed for all the {len(site_list)} stations of {year:04d}-{doy:03d}")
+    if failed_sites:
+        print(f"anubis failed for {len(failed_sites)} of {len(site_list)} stations "
+              f"of {year:04d}-{doy:03d}: {' '.join(failed_sites)}")
+    return failed_sites
 
 def exec_anibus_multi_days(xml_file: str,
                            anubis_bin_pathandname: str,
@@ -108,16 +144,27 @@ def exec_anibus_multi_days(xml_file: str,
                            doy_end: int,
                            data_root_path: str,
                            work_root_path: str,
-                           ) -> None:
+                           ) -> dict:
 
     """
-    Perform a multiple-stations, mutiple-days analysis using anubis
+    Perform a multiple-stations, mutiple-days analysis using anubis.
+    A day for which anubis fails for every station is reported and the next day is analysed.
+
+    Returns:
+    - dict doy -> the stations for which anubis failed (all of them for a failed day)
     """
     from site_list import read_list
     sitelist = read_list(site_list_file)
 
+    failed_sites = {}
     for doy in range(doy_start, doy_end+1):
-        exec_anibus_multi_sites(xml_file, anubis_bin_pathandname, sitelist, year, doy, data_root_path, work_root_path)
+        try:
+            failed_sites[doy] = exec_anibus_multi_sites(xml_file, anubis_bin_pathandname, sitelist, year, doy,
+                                                        data_root_path, work_root_path)
+        except RuntimeError as e:
+            print(f"Warning: {e}")
+            failed_sites[doy] = list(sitelist)
+    return failed_sites
 
 
 if __name__ == '__main__':
@@ -132,7 +179,9 @@ if __name__ == '__main__':
     parser.add_argument('--doy_end', type=int, help='end of DOY')
     parser.add_argument('--data_root_path', help='Data root directory path')
     parser.add_argument('--work_root_path', help='Working root directory path')
+    metrics.add_cli_arguments(parser)
     # ===========================
 
     args = parser.parse_args()
-    exec_anibus_multi_days(args.xml_file, args.anubis_bin, args.site_list_file, args.year, args.doy_start, args.doy_end, args.data_root_path, args.work_root_path)
\ No newline at end of file
+    with metrics.cli_session(args, 'anibus_ana'):
+        exec_anibus_multi_days(args.xml_file, args.anubis_bin, args.site_list_file, args.year, args.doy_start, args.doy_end, args.data_root_path, args.work_root_path)
\ No newline at end of file
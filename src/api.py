@@ -0,0 +1,185 @@
+'''
+Python API of the station selection
+
+Every stage takes and returns in-memory structures (lists and DataFrames), so a
+long-running process can chain the stages without writing and re-reading the
+site lists and score files. The files of the command line tools are an optional
+sink of each stage (out_file / out_path).
+
+    site_list = initial_site_list(sinex_root_path, 2022, 92, 92)
+    run_anubis(site_list, 2022, 92, 92, xml_file, anubis_bin, data_root_path, work_root_path)
+    scores = evaluate_stations(site_list, 2022, 92, 92, work_root_path)
+    selector = select_stations(scores, 30, 2022, 92, 92, data_root_path)
+    selected = selector.get_selected_stations()
+
+Only the anubis analysis communicates through files, since it is an external program.
+'''
+from __future__ import annotations
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    import pandas as pd
+    from choose_sta import SphericalKMeansStationSelector
+    from station_coord import StationCoordProvider
+
+
+def initial_site_list(sinex_root_path: str, year: int, doy_start: int, doy_end: int,
+                      igs_filename: str = 'IGSNetwork.csv', sinex_index_file: str = None,
+                      out_file: str = None) -> list[str]:
+    """
+    The initial station list S1: four-system stations with coordinates in all the sinex weekly solutions of the period
+
+    Parameters:
+    - sinex_root_path: directory of the sinex weekly solutions
+    - year, doy_start, doy_end: the period
+    - igs_filename: path of IGSNetwork.csv
+    - sinex_index_file: persistent index of the sinex archive, see gene_initial_4sys_sitelist
+    - out_file: if given, the site list and its _CLKTYPE file are also written
+    """
+    from gene_initial_4sys_sitelist import initial_site_list as _initial_site_list, write_clock_type
+
+    site_list = _initial_site_list(sinex_root_path, year, doy_start, doy_end,
+                                   sinex_index_file=sinex_index_file, igs_filename=igs_filename)
+    if out_file is not None:
+        from site_list import write_site_list
+        write_site_list(site_list, out_file)
+        write_clock_type(site_list, f"{out_file}_CLKTYPE", igs_filename)
+    return site_list
+
+def run_anubis(site_list: list[str], year: int, doy_start: int, doy_end: int, xml_file: str,
+               anubis_bin: str, data_root_path: str, work_root_path: str) -> dict:
+    """
+    Anubis analysis of the stations for every day of the period,
+    the results are written to f"{work_root_path}/work{year:04d}{doy:03d}/anubis/out/".
+    The stations for which anubis fails get penalty values in extract_qc;
+    RuntimeError if anubis fails for every station of a day.
+
+    Returns:
+    - dict doy -> the stations for which anubis failed
+    """
+    from anibus_ana import exec_anibus_multi_sites
+
+    failed_sites = {}
+    for doy in range(doy_start, doy_end + 1):
+        failed_sites[doy] = exec_anibus_multi_sites(xml_file, anubis_bin, site_list, year, doy,
+                                                    data_root_path, work_root_path)
+    return failed_sites
+
+def extract_qc(site_list: list[str], year: int, doy_start: int, doy_end: int, work_root_path: str) -> pd.DataFrame:
+    """
+    QC indicators of the anubis results of the period
+
+    Returns:
+    - pandas DataFrame indexed by site_name, columns '{system}_{indicator}_{yyyydoy}'
+    """
+    from extract_qc import extract_qc_multiple_days
+
+    return extract_qc_multiple_days(site_list, year, doy_start, doy_end, work_root_path).set_index('site_name')
+
+def score_stations(qc: pd.DataFrame, w_sys: dict = None, show_details: bool = False) -> pd.DataFrame:
+    """
+    Hybrid-weight TOPSIS scores of a QC frame (see extract_qc)
+
+    Returns:
+    - pandas DataFrame indexed by site_name with topsis_score and quality_level, best first
+    """
+    from station_eval import gnss_topsis_evaluation
+
+    return gnss_topsis_evaluation(qc, w_sys=w_sys, show_details=show_details)[['topsis_score', 'quality_level']]
+
+def evaluate_stations(site_list: list[str], year: int, doy_start: int, doy_end: int, work_root_path: str,
+                      show_details: bool = False, out_file: str = None) -> pd.DataFrame:
+    """
+    Quality scores of the stations from the anubis results of the period (all days together)
+
+    Parameters:
+    - out_file: if given, the scores are also written (the sta_rank_evaluation CSV of station_eval)
+
+    Returns:
+    - pandas DataFrame indexed by site_name with topsis_score and quality_level, best first
+    """
+    from station_eval import station_eval_period
+
+    scores = station_eval_period(site_list, year, doy_start, doy_end, work_root_path, show_details=show_details)
+    if out_file is not None:
+        scores.to_csv(out_file)
+    return scores
+
+def coord_provider(data_root_path: str, year: int, doy_start: int, doy_end: int,
+                   igs_filename: str = 'IGSNetwork.csv', coord_cache_file: str = None) -> StationCoordProvider:
+    """
+    Station coordinate provider of the period, to be reused by select_stations calls
+    (the parsed sinex files and RINEX headers are kept in memory)
+    """
+    from station_coord import StationCoordProvider
+
+    return StationCoordProvider(data_root_path, year, doy_start, doy_end,
+                                igs_filename=igs_filename, cache_file=coord_cache_file)
+
+def select_stations(scores: pd.DataFrame, chosen_num: int, year: int, doy_start: int, doy_end: int,
+                    data_root_path: str, quality_threshold: float = 0.8, selection_method: str = 'kmeans',
+                    n_init: int = 30, coords: StationCoordProvider = None, igs_filename: str = 'IGSNetwork.csv',
+                    coord_cache_file: str = None, cache=None, out_path: str = None) -> SphericalKMeansStationSelector:
+    """
+    Select chosen_num stations among the scored stations
+
+    Parameters:
+    - scores: station scores (evaluate_stations, or any frame with site_name and topsis_score)
+    - chosen_num: The number of selected stations
+    - year, doy_start, doy_end: the period, for the station coordinates
+    - data_root_path: Data Directory (sinex files and RINEX headers)
+    - quality_threshold: only stations with topsis_score >= quality_threshold are candidates
+    - selection_method: 'kmeans' (spherical K-means) or 'fps' (quality-weighted farthest-point)
+    - n_init: Number of K-means++ runs
+    - coords: coordinate provider (see coord_provider), default: a new one with igs_filename and coord_cache_file
+    - cache: selection_cache.SelectionCache of the results (None: no cache)
+    - out_path: if given, the files of choose_sta are also written
+
+    Returns:
+    - the fitted selector, see get_selected_stations() and get_all_stations_with_clusters()
+    """
+    from choose_sta import load_candidates, make_selector, write_selection
+
+    df = load_candidates(year, doy_start, doy_end, None, data_root_path,
+                         coord_cache_file=coord_cache_file, igs_filename=igs_filename,
+                         scores=scores, coord_provider=coords)
+    df = df[df['topsis_score'] >= quality_threshold]
+
+    selector = make_selector(selection_method, chosen_num, n_init)
+    selector.fit(df, quality_col='topsis_score', cache=cache)
+    if out_path is not None:
+        write_selection(selector, out_path, f'{chosen_num}_{year:04d}_{doy_start:03d}_{doy_end:03d}')
+    return selector
+
+def select_network(year: int, doy_start: int, doy_end: int, data_root_path: str, work_root_path: str,
+                   chosen_num: int, quality_threshold: float = 0.8, selection_method: str = 'kmeans',
+                   igs_filename: str = 'IGSNetwork.csv', xml_file: str = None, anubis_bin: str = None,
+                   site_list: list[str] = None, coords: StationCoordProvider = None) -> dict:
+    """
+    The whole selection of a period in memory
+
+    Parameters:
+    - xml_file, anubis_bin: if given, the anubis analysis is run first (otherwise its results must exist)
+    - site_list: initial station list (default: initial_site_list with the sinex files of data_root_path/snx)
+    - coords: coordinate provider of the period, see select_stations
+    - the other parameters: see select_stations
+
+    Returns:
+    - dict with site_list, scores (DataFrame), selector and selected (DataFrame of the selected stations)
+    """
+    from pathlib import Path
+
+    if site_list is None:
+        site_list = initial_site_list(str(Path(data_root_path, 'snx')), year, doy_start, doy_end,
+                                      igs_filename=igs_filename)
+    if anubis_bin is not None:
+        run_anubis(site_list, year, doy_start, doy_end, xml_file, anubis_bin, data_root_path, work_root_path)
+    scores = evaluate_stations(site_list, year, doy_start, doy_end, work_root_path)
+    selector = select_stations(scores, chosen_num, year, doy_start, doy_end, data_root_path,
+                               quality_threshold=quality_threshold, selection_method=selection_method,
+                               coords=coords, igs_filename=igs_filename)
+    return {
+        'site_list': site_list,
+        'scores': scores,
+        'selector': selector,
+        'selected': selector.get_selected_stations(),
+    }
@@ -1,13 +1,28 @@
-import pandas as pd
+from __future__ import annotations
 import numpy as np
-from sklearn.cluster import KMeans
-from sklearn.metrics import silhouette_score
 from pathlib import Path
 import os
-import matplotlib.pyplot as plt
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import TYPE_CHECKING
 import warnings
+import metrics
+# pandas, scipy and sklearn are imported on the code paths that use them,
+# which keeps the start-up of the command line tools short
+if TYPE_CHECKING:
+    import pandas as pd
 warnings.filterwarnings('ignore')
 
+# version of the selection algorithm, part of the result cache keys:
+# bump it whenever a change alters the selection for the same inputs
+ALGORITHM_VERSION = '3'
+
+# mean radius of the Earth, to convert kilometres into angles on the unit sphere
+EARTH_RADIUS_KM = 6371.0
+# from this number of centers on, the nearest center is found with a KD-tree
+# instead of the full station-center similarity matrix
+KDTREE_MIN_CENTERS = 200
+
 def ecef2pos(r):
     """  ECEF to LLH position conversion
     r[0:3]=x,y,z
@@ -33,13 +48,119 @@ def ecef2pos(r):
     pos[2] = np.sqrt(r2 + z**2) - v
     return pos
 
+# selector of the worker process, rebuilt only when the shared coordinates or the parameters change
+_worker_selector = {}
+
+def _shared_coords_single_run(params, shm_name, shape, quality_scores, run_id, seed, init_centers):
+    """
+    Worker of the process backend: run one K-means++ run on the coordinates
+    placed in shared memory by SphericalKMeansStationSelector.fit
+    - params: (n_clusters, max_iter, random_state, engine), see _worker_params;
+              the selector itself is not sent, it would pickle its fitted state with every run
+    """
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=shm_name)
+    coords_xyz = np.ndarray(shape, dtype=float, buffer=shm.buf)
+    coords_xyz.flags.writeable = False
+    try:
+        key = (shm_name, params)
+        selector = _worker_selector.get(key)
+        if selector is None:
+            n_clusters, max_iter, random_state, engine = params
+            selector = SphericalKMeansStationSelector(n_clusters, n_init=1, max_iter=max_iter,
+                                                      random_state=random_state, engine=engine)
+            # the KD-tree keeps its own copy of the unit vectors
+            selector.station_tree = build_kdtree(coords_xyz / np.linalg.norm(coords_xyz, axis=1, keepdims=True))
+            _worker_selector.clear()
+            _worker_selector[key] = selector
+        return selector.spherical_kmeans_single_run(coords_xyz, quality_scores, run_id=run_id,
+                                                    seed=seed, init_centers=init_centers)
+    finally:
+        # the view must be released before the segment can be closed
+        del coords_xyz
+        shm.close()
+
+def ecef2pos_array(xyz):
+    """  ECEF to LLH position conversion of many stations at once
+    xyz[:, 0:3]=x,y,z
+    pos[:, 0:3]=lat,lon,h
+    the same iteration as ecef2pos, applied to whole columns;
+    every row stops iterating with the same criterion as ecef2pos
+    """
+    RE_WGS84 = 6378137.0
+    FE_WGS84 = 1.0/298.257223563
+    
+    xyz = np.atleast_2d(np.asarray(xyz, dtype=float))
+    e2 = FE_WGS84*(2-FE_WGS84)
+    r2 = xyz[:, 0]**2+xyz[:, 1]**2
+    v = np.full(len(xyz), RE_WGS84)
+    z = xyz[:, 2].copy()
+    zk = np.zeros(len(xyz))
+    active = np.abs(z - zk) >= 1e-4
+    while active.any():
+        zk[active] = z[active]
+        sinp = z[active] / np.sqrt(r2[active]+z[active]**2)
+        v[active] = RE_WGS84 / np.sqrt(1 - e2 * sinp**2)
+        z[active] = xyz[active, 2] + v[active] * e2 * sinp
+        active[active] = np.abs(z[active] - zk[active]) >= 1e-4
+    
+    pos = np.zeros((len(xyz), 3))
+    polar = r2 <= 1e-12
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pos[:, 0] = np.where(polar, np.pi / 2 * np.sign(xyz[:, 2]), np.arctan(z / np.sqrt(r2)))
+    pos[:, 1] = np.where(polar, 0, np.arctan2(xyz[:, 1], xyz[:, 0]))
+    pos[:, 2] = np.sqrt(r2 + z**2) - v
+    return pos
+
+def spherical_inertia(coords_normalized, labels, centers):
+    """
+    Sum of the squared angular distances (radians) between the points and their cluster centers
+    """
+    centers_normalized = centers / np.linalg.norm(centers, axis=1, keepdims=True)
+    cosine_sim = np.einsum('ij,ij->i', coords_normalized, centers_normalized[labels])
+    return float(np.sum(np.arccos(np.clip(cosine_sim, -1.0, 1.0)) ** 2))
+
+def build_kdtree(points):
+    """
+    KD-tree (scipy cKDTree) over the points
+    """
+    from scipy.spatial import cKDTree
+    return cKDTree(points)
+
+def angle_to_chord(angle):
+    """
+    Chord length on the unit sphere of an angular distance (radians),
+    i.e. the Euclidean distance used by the KD-tree over unit vectors
+    """
+    return 2.0 * np.sin(np.minimum(angle, np.pi) / 2.0)
+
+def assign_to_centers(coords_normalized, centers):
+    """
+    Assign every unit vector to the center with the largest cosine similarity
+    
+    Returns:
+    - labels: index of the nearest center
+    - similarity: cosine similarity of every point to its center
+    """
+    if len(centers) >= KDTREE_MIN_CENTERS:
+        # the nearest center in chord length is the one with the largest cosine similarity
+        chord, labels = build_kdtree(centers).query(coords_normalized)
+        return labels, 1.0 - chord ** 2 / 2.0
+    
+    similarity = coords_normalized @ centers.T
+    labels = np.argmax(similarity, axis=1)
+    return labels, similarity[np.arange(len(labels)), labels]
+
 class SphericalKMeansStationSelector:
     """
     Spherical K-means station selection.
     select the station with the highest quality score in each cluster
     """
     
-    def __init__(self, n_clusters, n_init=20, max_iter=300, random_state=42):
+    report_title = 'Spherical K-means'
+    
+    def __init__(self, n_clusters, n_init=20, max_iter=300, random_state=42, engine='numpy',
+                 n_jobs=None, backend='thread'):
         """
         Initialize the selector
         
@@ -48,13 +169,36 @@ class SphericalKMeansStationSelector:
         - n_init: Number of runs for K-means++ initialization
         - max_iter: The maximum number of iterations per run
         - random_state: random seed
+        - engine: 'numpy' for the native spherical Lloyd iterations (default),
+                  'sklearn' for the Euclidean sklearn KMeans fallback
+        - n_jobs: Number of workers running the K-means++ runs in parallel
+                  (None: all CPUs). The result does not depend on it.
+        - backend: 'thread' or 'process' worker pool
         """
+        if engine not in ('numpy', 'sklearn'):
+            raise ValueError(f"Unknown clustering engine: {engine}")
+        if backend not in ('thread', 'process'):
+            raise ValueError(f"Unknown parallel backend: {backend}")
+        if max_iter < 1:
+            raise ValueError(f"max_iter must be at least 1: {max_iter}")
         self.n_clusters = n_clusters
         self.n_init = n_init
         self.max_iter = max_iter
         self.random_state = random_state
+        self.engine = engine
+        self.n_jobs = n_jobs
+        self.backend = backend
         self.best_result = None
         self.stability_metrics = None
+        self.selected_stations = None
+        # latitude, longitude (deg) and height of the fitted stations, converted once per fit
+        self.station_llh = None
+        # KD-tree over the unit vectors of the fitted stations, built once per fit
+        self.station_tree = None
+        # cluster-quality metrics of the fit, computed on demand
+        self.cluster_quality = None
+        # tag of the output file names of the fit, persisted by save_fit
+        self.name_tag = None
     
     def xyz_to_llh(self, df, xyz_col=['x', 'y', 'z']):
         """
@@ -66,7 +210,7 @@ class SphericalKMeansStationSelector:
         - xyz_col: The column names of three-dimensional rectangular coordinates
         """
         xyz = df[xyz_col].values
-        pos = np.apply_along_axis(ecef2pos, 1, xyz)
+        pos = ecef2pos_array(xyz)
 
         df['latitude'] = np.degrees(pos[:, 0])
         df['longitude'] = np.degrees(pos[:, 1])
@@ -75,127 +219,459 @@ class SphericalKMeansStationSelector:
         return df
 
     
-    def spherical_kmeans_plus_plus_init(self, coords_normalized, n_clusters, random_state=None):
+    def spherical_kmeans_plus_plus_init(self, coords_normalized, n_clusters, random_state=None, init_centers=None):
         """
         spherical K-means++ initialization
+        
+        - random_state: seed, SeedSequence or numpy Generator of this run
+        - init_centers: (m, 3) centers to start from (warm start, e.g. the solution
+                        for a smaller number of clusters); only the remaining
+                        n_clusters - m centers are drawn by K-means++
         """
-        np.random.seed(random_state)
+        rng = np.random.default_rng(random_state)
         n_samples = len(coords_normalized)
+        tree = self.station_tree
+        if tree is not None and tree.n != n_samples:
+            tree = None
         
-        # Randomly select the first center
-        centers = []
-        first_idx = np.random.randint(0, n_samples)
-        centers.append(coords_normalized[first_idx])
+        if init_centers is not None and len(init_centers) > 0:
+            init_centers = np.asarray(init_centers, dtype=float)[:n_clusters]
+            init_centers = init_centers / np.linalg.norm(init_centers, axis=1, keepdims=True)
+            centers = list(init_centers)
+        else:
+            # Randomly select the first center
+            first_idx = rng.integers(0, n_samples)
+            centers = [coords_normalized[first_idx]]
         
-        # Select the remaining k-1 centers
-        for _ in range(1, n_clusters):
-            # Calculate the spherical distance from each point to the nearest selected center
-            distances = np.zeros(n_samples)
-            
-            for i, point in enumerate(coords_normalized):
-                min_dist = float('inf')
-                for center in centers:
-                    cosine_sim = np.clip(np.dot(point, center), -1.0, 1.0)
-                    angular_dist = np.arccos(cosine_sim)
-                    min_dist = min(min_dist, angular_dist)
-                distances[i] = min_dist
-            
+        # spherical distance from each point to the nearest selected center
+        distances = np.arccos(np.clip(coords_normalized @ np.array(centers).T, -1.0, 1.0)).min(axis=1)
+        
+        # Select the remaining centers
+        for _ in range(len(centers), n_clusters):
             # Probability selection based on squared distance
             probabilities = distances ** 2
             probabilities /= probabilities.sum()
             
             # Select the next center
-            next_idx = np.random.choice(n_samples, p=probabilities)
+            next_idx = rng.choice(n_samples, p=probabilities)
             centers.append(coords_normalized[next_idx])
+            
+            # Only the points closer to the new center than the current farthest
+            # distance can get nearer, the KD-tree returns just those
+            if tree is not None:
+                nearby = tree.query_ball_point(coords_normalized[next_idx], angle_to_chord(distances.max()))
+                nearby = np.asarray(nearby, dtype=int)
+            else:
+                nearby = np.arange(n_samples)
+            new_distances = np.arccos(np.clip(coords_normalized[nearby] @ centers[-1], -1.0, 1.0))
+            distances[nearby] = np.minimum(distances[nearby], new_distances)
         
         return np.array(centers)
     
-    def spherical_kmeans_single_run(self, coords_xyz, quality_scores, run_id=0):
+    def spherical_lloyd(self, coords_normalized, initial_centers):
+        """
+        Lloyd iterations of spherical K-means (cosine similarity)
+        
+        Parameters:
+        - coords_normalized: (n, 3) unit vectors of the stations
+        - initial_centers: (k, 3) initial centers, e.g. from K-means++
+        
+        Returns:
+        - labels: cluster id of each station
+        - centers: (k, 3) unit-norm cluster centers
+        - n_iter: number of iterations performed
+        """
+        n_clusters = len(initial_centers)
+        centers = initial_centers / np.linalg.norm(initial_centers, axis=1, keepdims=True)
+        labels = None
+        
+        for n_iter in range(1, self.max_iter + 1):
+            # assign every station to the center with the largest cosine similarity
+            new_labels, own_similarity = assign_to_centers(coords_normalized, centers)
+            
+            # labels are stable, the centers computed from them are final
+            if labels is not None and np.array_equal(new_labels, labels):
+                break
+            labels = new_labels
+            
+            # new center: the mean direction of the cluster, projected back onto the sphere
+            sums = np.zeros((n_clusters, 3))
+            for dim in range(3):
+                sums[:, dim] = np.bincount(labels, weights=coords_normalized[:, dim], minlength=n_clusters)
+            norms = np.linalg.norm(sums, axis=1)
+            
+            # empty (or degenerate) clusters are reseeded from the stations
+            # farthest from their current centers
+            empty = np.flatnonzero(norms < 1e-12)
+            if len(empty) > 0:
+                farthest = np.argsort(own_similarity, kind='stable')[:len(empty)]
+                sums[empty[:len(farthest)]] = coords_normalized[farthest]
+                norms[empty[:len(farthest)]] = 1.0
+            
+            valid = norms >= 1e-12
+            centers[valid] = sums[valid] / norms[valid, np.newaxis]
+        else:
+            # max_iter reached: make the labels consistent with the last centers
+            labels, _ = assign_to_centers(coords_normalized, centers)
+        
+        return labels, centers, n_iter
+    
+    def spherical_kmeans_single_run(self, coords_xyz, quality_scores, run_id=0, seed=None, init_centers=None):
         """
         Single run of spherical K-means
+        
+        - seed: seed of the K-means++ initialization (default: random_state + run_id)
+        - init_centers: warm-start centers, see spherical_kmeans_plus_plus_init
         """
+        if seed is None:
+            seed = self.random_state + run_id
         # Normalize to the unit sphere
         coords_normalized = coords_xyz / np.linalg.norm(coords_xyz, axis=1, keepdims=True)
         
         # K-means++ initialization
         initial_centers = self.spherical_kmeans_plus_plus_init(
-            coords_normalized, self.n_clusters, random_state=self.random_state + run_id
-        )
-        
-        # Use sklearn's KMeans with custom initialization
-        kmeans = KMeans(
-            n_clusters=self.n_clusters,
-            init=initial_centers,
-            n_init=1,
-            max_iter=self.max_iter,
-            random_state=self.random_state + run_id
+            coords_normalized, self.n_clusters, random_state=seed, init_centers=init_centers
         )
         
-        cluster_labels = kmeans.fit_predict(coords_normalized)
+        if self.engine == 'numpy':
+            cluster_labels, cluster_centers, n_iter = self.spherical_lloyd(
+                coords_normalized, initial_centers
+            )
+        else:
+            # Use sklearn's KMeans with custom initialization
+            from sklearn.cluster import KMeans
+            kmeans = KMeans(
+                n_clusters=self.n_clusters,
+                init=initial_centers,
+                n_init=1,
+                max_iter=self.max_iter,
+                random_state=self.random_state + run_id
+            )
+            
+            cluster_labels = kmeans.fit_predict(coords_normalized)
+            cluster_centers = kmeans.cluster_centers_
+            n_iter = kmeans.n_iter_
         
         # Select the station with the highest quality score in each cluster.
-        selected_indices = []
-        selected_scores = []
+        # Sort by cluster and then by descending score: the first station of every
+        # cluster group is its best one (ties go to the first station, as idxmax).
+        scores = np.asarray(quality_scores, dtype=float)
+        order = np.lexsort((-scores, cluster_labels))
+        sorted_labels = cluster_labels[order]
+        group_start = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]])
+        selected_positions = order[group_start]
+        selected_scores = scores[selected_positions]
         
-        for cluster_id in range(self.n_clusters):
-
-            cluster_mask = cluster_labels == cluster_id
-            cluster_indices = np.where(cluster_mask)[0]
-            
-            if len(cluster_indices) == 0:
-                # the cluster is empty, skip
-                continue
-            
-            # get the quality scores of all stations in the cluster
-            cluster_quality_scores = quality_scores.iloc[cluster_indices]
-            
-            # choose the station with the highest quality score
-            best_local_idx = cluster_quality_scores.idxmax()
-            best_score = cluster_quality_scores.loc[best_local_idx]
-            
-            '''
-            ##### the following code which is commented out is for the paper
-            # choose the station with the lowest quality score
-            best_local_idx = cluster_quality_scores.idxmin()
-            best_score = cluster_quality_scores.loc[best_local_idx]
-            
-            # choose the station with the middle quality score
-            median_idx = len(cluster_quality_scores) // 2
-            best_local_idx = cluster_quality_scores.sort_values().index[median_idx]
-            best_score = cluster_quality_scores.loc[best_local_idx]
-            
-            # choose the station with the ith best quality score
-            i = 2
-            if len(cluster_quality_scores) > i:
-                best_local_idx = cluster_quality_scores.sort_values(ascending=False).index[i]
-                best_score = cluster_quality_scores.loc[best_local_idx]
-            #####
-            '''
-            
-            selected_indices.append(best_local_idx)
-            selected_scores.append(best_score)
+        '''
+        ##### the following code which is commented out is for the paper
+        group_size = np.diff(np.r_[group_start, len(order)])
+        
+        # choose the station with the lowest quality score
+        selected_positions = order[group_start + group_size - 1]
+        
+        # choose the station with the middle quality score
+        selected_positions = order[group_start + group_size - 1 - group_size // 2]
+        
+        # choose the station with the ith best quality score
+        i = 2
+        selected_positions = order[np.where(group_size > i, group_start + i, group_start)]
+        
+        selected_scores = scores[selected_positions]
+        #####
+        '''
         
         # Calculate inertia (based on spherical distance)
-        inertia = 0
-        for i, point in enumerate(coords_normalized):
-            cluster_id = cluster_labels[i]
-            center = kmeans.cluster_centers_[cluster_id]
-            center = center / np.linalg.norm(center)
-            cosine_sim = np.clip(np.dot(point, center), -1.0, 1.0)
-            angular_dist = np.arccos(cosine_sim)
-            inertia += angular_dist ** 2
+        inertia = spherical_inertia(coords_normalized, cluster_labels, cluster_centers)
+        
+        # positional indices, or index labels if the scores come with an index
+        if hasattr(quality_scores, 'index'):
+            selected_indices = quality_scores.index[selected_positions].tolist()
+        else:
+            selected_indices = selected_positions.tolist()
         
         return {
             'selected_indices': selected_indices,
+            'selected_positions': selected_positions,
             'selected_scores': selected_scores,
             'cluster_labels': cluster_labels,
-            'cluster_centers': kmeans.cluster_centers_,
+            'cluster_centers': cluster_centers,
             'inertia': inertia,
+            'n_iter': n_iter,
             'run_id': run_id,
             'n_selected': len(selected_indices)
         }
     
-    def fit(self, df, quality_col='quality_score'):
+    def _iter_runs(self, coords_xyz, quality_scores, init_centers=None):
+        """
+        Run the n_init K-means++ runs on a worker pool and yield (run_id, result)
+        as they finish. A failed run yields its exception instead of a result.
+        
+        Every run gets its own generator spawned from random_state, so the
+        results do not depend on the number of workers or on the finishing order.
+        Only a bounded number of runs is in flight, so finished results can be
+        dropped by the caller while the rest are still running.
+        """
+        seeds = np.random.SeedSequence(self.random_state).spawn(self.n_init)
+        n_jobs = self.n_jobs or os.cpu_count() or 1
+        n_jobs = max(1, min(n_jobs, self.n_init))
+        
+        shm = None
+        if self.backend == 'process':
+            # share the coordinates with the worker processes instead of pickling them per run
+            from multiprocessing import shared_memory
+            shm = shared_memory.SharedMemory(create=True, size=coords_xyz.nbytes)
+            shared_coords = np.ndarray(coords_xyz.shape, dtype=coords_xyz.dtype, buffer=shm.buf)
+            shared_coords[:] = coords_xyz
+            del shared_coords
+            executor = ProcessPoolExecutor(max_workers=n_jobs)
+            params = self._worker_params()
+            submit = lambda run: executor.submit(
+                _shared_coords_single_run, params, shm.name, coords_xyz.shape,
+                quality_scores, run, seeds[run], init_centers
+            )
+        else:
+            # threads see the same array, it only has to be protected from writes
+            coords_xyz = coords_xyz.copy()
+            coords_xyz.flags.writeable = False
+            executor = ThreadPoolExecutor(max_workers=n_jobs)
+            submit = lambda run: executor.submit(
+                self.spherical_kmeans_single_run, coords_xyz, quality_scores,
+                run_id=run, seed=seeds[run], init_centers=init_centers
+            )
+        
+        try:
+            pending = {}
+            next_run = 0
+            while next_run < self.n_init or pending:
+                while next_run < self.n_init and len(pending) < 2 * n_jobs:
+                    pending[submit(next_run)] = next_run
+                    next_run += 1
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    run = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = e
+                    yield run, result
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+    
+    def selection_key(self, df, quality_col='quality_score', init_centers=None):
+        """
+        Content hash of everything that determines the result of fit: the candidate
+        table (coordinates and scores included), the clustering parameters and the
+        algorithm version. The number of workers is left out, it does not change the result.
+        """
+        import pandas as pd
+        from selection_cache import hash_content
+        
+        table_hash = pd.util.hash_pandas_object(df, index=True).to_numpy()
+        coords_xyz = np.ascontiguousarray(df[['x', 'y', 'z']].values, dtype=float)
+        if init_centers is not None:
+            init_centers = np.ascontiguousarray(init_centers, dtype=float)
+        
+        return hash_content(
+            ALGORITHM_VERSION, type(self).__name__, list(df.columns), table_hash, coords_xyz, quality_col,
+            self._key_params(), init_centers
+        )
+    
+    def _worker_params(self):
+        """
+        The picklable parameters a worker process needs to run spherical_kmeans_single_run
+        """
+        return (self.n_clusters, self.max_iter, self.random_state, self.engine)
+    
+    def _key_params(self):
+        """
+        The parameters of the selector that change its result
+        """
+        return (self.n_clusters, self.n_init, self.max_iter, self.random_state, self.engine)
+    
+    def get_state(self):
+        """
+        The fitted result as a plain dict, e.g. for caching or persisting a fit
+        """
+        if self.best_result is None:
+            raise ValueError("The fit() method has not been executed yet.")
+        
+        return {
+            'best_result': self.best_result,
+            'stability_metrics': self.stability_metrics,
+            'selected_stations': self.selected_stations,
+            'all_stations_with_clusters': self.all_stations_with_clusters,
+        }
+    
+    def set_state(self, state):
+        """
+        Restore a result produced by get_state
+        """
+        self.best_result = state['best_result']
+        self.stability_metrics = state['stability_metrics']
+        self.selected_stations = state['selected_stations'].copy()
+        self.all_stations_with_clusters = state['all_stations_with_clusters']
+        self.station_llh = None
+        self.cluster_quality = None
+        coords_xyz = self.all_stations_with_clusters[['x', 'y', 'z']].values.astype(float)
+        self.station_tree = build_kdtree(coords_xyz / np.linalg.norm(coords_xyz, axis=1, keepdims=True))
+        
+        return self
+    
+    def get_params(self):
+        """
+        The constructor parameters of the selector
+        """
+        return {'n_clusters': self.n_clusters, 'n_init': self.n_init, 'max_iter': self.max_iter,
+                'random_state': self.random_state, 'engine': self.engine,
+                'n_jobs': self.n_jobs, 'backend': self.backend}
+    
+    def save_fit(self, fit_file, name_tag=None):
+        """
+        Persist the fitted result (labels, centers, scores and station tables),
+        see load_fit and reselect
+        - name_tag: tag of the output file names of the fit (default: the tag it was loaded with)
+        """
+        import pickle
+        if name_tag is not None:
+            self.name_tag = name_tag
+        with open(fit_file, 'wb') as outp:
+            pickle.dump({'selector': type(self).__name__, 'params': self.get_params(),
+                         'state': self.get_state(), 'name_tag': self.name_tag},
+                        outp, protocol=pickle.HIGHEST_PROTOCOL)
+    
+    def reselect(self, removed=None, added=None, quality_col='topsis_score', n_neighbours=3):
+        """
+        Update the selection after stations dropped out (e.g. a data outage) or were
+        added, without a refit. Only the clusters touched by the change are re-solved:
+        - a cluster whose selected station was removed promotes its next-best station
+        - a cluster that lost all its stations is re-clustered together with its
+          n_neighbours adjacent clusters by a local spherical K-means
+        - added stations join the cluster of the nearest center and are selected
+          if they score better than the current station
+        - the other clusters keep their selected station
+        
+        Parameters:
+        - removed: site names of the stations to remove
+        - added: pandas DataFrame of new stations with site_name, x, y, z and quality_col
+        - quality_col: Quality Score Column Name of added
+        - n_neighbours: number of adjacent clusters merged with an emptied cluster
+        
+        Returns:
+        - pandas DataFrame, the new selected stations (see get_selected_stations)
+        """
+        if self.best_result is None:
+            raise ValueError("The fit() method has not been executed yet.")
+        
+        import pandas as pd
+        
+        t_start = time.perf_counter()
+        all_stations = self.all_stations_with_clusters
+        labels = self.best_result['cluster_labels']
+        centers = np.array(self.best_result['cluster_centers'], dtype=float)
+        centers = centers / np.linalg.norm(centers, axis=1, keepdims=True)
+        old_selected = all_stations['site_name'].iloc[self.best_result['selected_positions']].tolist()
+        
+        # clusters whose selected station is removed
+        removed_mask = all_stations['site_name'].isin(set(removed or [])).to_numpy()
+        selected_mask = np.zeros(len(all_stations), dtype=bool)
+        selected_mask[self.best_result['selected_positions']] = True
+        affected = set(labels[removed_mask & selected_mask].tolist())
+        # clusters whose station is picked again among all their members
+        repick = set(affected)
+        
+        stations = all_stations[~removed_mask]
+        labels = labels[~removed_mask]
+        # the selected stations that are kept, and the added stations
+        kept_selected = selected_mask[~removed_mask]
+        is_added = np.zeros(len(stations), dtype=bool)
+        
+        if added is not None and len(added) > 0:
+            added = added.copy()
+            added['topsis_score'] = added[quality_col]
+            added_xyz = added[['x', 'y', 'z']].values.astype(float)
+            added_labels, _ = assign_to_centers(added_xyz / np.linalg.norm(added_xyz, axis=1, keepdims=True), centers)
+            affected |= set(added_labels.tolist())
+            if pd.api.types.is_integer_dtype(stations.index) and len(stations) > 0:
+                added.index = np.arange(len(added)) + stations.index.max() + 1
+            stations = pd.concat([stations, added])
+            labels = np.concatenate([labels, added_labels])
+            kept_selected = np.concatenate([kept_selected, np.zeros(len(added), dtype=bool)])
+            is_added = np.concatenate([is_added, np.ones(len(added), dtype=bool)])
+        
+        coords_xyz = stations[['x', 'y', 'z']].values.astype(float)
+        coords_normalized = coords_xyz / np.linalg.norm(coords_xyz, axis=1, keepdims=True)
+        scores = stations['topsis_score'].to_numpy(dtype=float)
+        
+        # clusters left without stations: local K-means on them and their neighbours
+        counts = np.bincount(labels, minlength=len(centers))
+        similarity = centers @ centers.T
+        for cluster_id in sorted(c for c in affected if counts[c] == 0):
+            group = np.argsort(-similarity[cluster_id], kind='stable')[:n_neighbours + 1]
+            if cluster_id not in group:
+                group[-1] = cluster_id
+            members = np.flatnonzero(np.isin(labels, group))
+            if len(members) == 0:
+                continue
+            local_labels, local_centers, _ = self.spherical_lloyd(coords_normalized[members], centers[group])
+            labels[members] = group[local_labels]
+            centers[group] = local_centers
+            counts = np.bincount(labels, minlength=len(centers))
+            affected |= set(group.tolist())
+            repick |= set(group.tolist())
+        
+        # unaffected clusters keep their station (not necessarily the best scored one, e.g. of
+        # a farthest-point fit); a kept station is replaced only by a better added station;
+        # the other affected clusters pick their best station
+        selected_positions = []
+        for cluster_id in np.unique(labels):
+            members = np.flatnonzero(labels == cluster_id)
+            current = members[kept_selected[members]]
+            if len(current) > 0 and cluster_id not in repick:
+                candidates = np.concatenate([current[:1], members[is_added[members]]])
+            else:
+                candidates = members
+            # the first candidate wins ties
+            selected_positions.append(candidates[np.argmax(scores[candidates])])
+        selected_positions = np.array(selected_positions, dtype=int)
+        
+        inertia = spherical_inertia(coords_normalized, labels, centers)
+        self.best_result = dict(self.best_result)
+        self.best_result.update({
+            'selected_positions': selected_positions,
+            'selected_scores': scores[selected_positions],
+            'cluster_labels': labels,
+            'cluster_centers': centers,
+            'inertia': inertia,
+            'n_selected': len(selected_positions)
+        })
+        # the runs of the fit do not describe the new selection: one deterministic update
+        self.stability_metrics = {
+            'mean_inertia': inertia,
+            'std_inertia': 0.0,
+            'coefficient_of_variation': 0.0,
+            'min_inertia': inertia,
+            'max_inertia': inertia,
+            'mean_n_selected': len(selected_positions),
+            'n_successful_runs': 1,
+            'fit_seconds': time.perf_counter() - t_start,
+            'reselected': True
+        }
+        self._store_result(stations, 'topsis_score')
+        self.station_tree = build_kdtree(coords_normalized)
+        
+        new_selected = stations['site_name'].iloc[selected_positions].tolist()
+        dropped = [site for site in old_selected if site not in new_selected]
+        promoted = [site for site in new_selected if site not in old_selected]
+        print(f"Reselection of {len(affected)} clusters in {(time.perf_counter() - t_start) * 1000:.1f} ms")
+        print(f"Dropped stations: {dropped}")
+        print(f"New stations: {promoted}")
+        
+        return self.get_selected_stations()
+    
+    def fit(self, df, quality_col='quality_score', init_centers=None, cache=None):
         """
         Perform spherical K-means clustering multiple times and select the best result
         
@@ -206,7 +682,18 @@ class SphericalKMeansStationSelector:
         - quality_col: Quality Score Column Name
         - height_col: Elevation column name (optional)
         - station_id_col: Station ID Column Name (Optional)
+        - init_centers: warm-start centers, e.g. the cluster_centers of a fit with fewer clusters
+        - cache: optional SelectionCache; a fit with identical inputs is restored from it
         """
+        if cache is not None:
+            cache_key = self.selection_key(df, quality_col, init_centers)
+            state = cache.get(cache_key)
+            if state is not None:
+                print(f"The selection is restored from the cache: {cache_key[:16]}")
+                metrics.count('selection_cache_hits')
+                return self.set_state(state)
+        
+        t_start = time.perf_counter()
         print(f"Start spherical K-means station selection...")
         print(f"Total number of stations: {len(df)}")
         print(f"The selected number of stations: {self.n_clusters}")
@@ -214,36 +701,42 @@ class SphericalKMeansStationSelector:
         print("=" * 60)
         
         
-        coords_xyz = df[['x', 'y', 'z']].values
-        quality_scores = df[quality_col]
+        coords_xyz = np.ascontiguousarray(df[['x', 'y', 'z']].values, dtype=float)
+        quality_scores = df[quality_col].to_numpy(dtype=float)
+        self.station_tree = build_kdtree(coords_xyz / np.linalg.norm(coords_xyz, axis=1, keepdims=True))
         
-        # spherical K-means by multiple runs
-        results = []
+        # spherical K-means by multiple runs, the best run is kept while streaming
+        self.best_result = None
+        inertias = np.full(self.n_init, np.nan)
+        n_selected_counts = np.zeros(self.n_init, dtype=int)
+        n_finished = 0
         
-        for run in range(self.n_init):
-            try:
-                result = self.spherical_kmeans_single_run(
-                    coords_xyz, quality_scores, run_id=run
-                )
-                results.append(result)
-                
-                if (run + 1) % 5 == 0:
-                    print(f"Finish running {run + 1}/{self.n_init}, "
-                          f"Current best inertia: {min(r['inertia'] for r in results):.4f}")
-                          
-            except Exception as e:
-                print(f"{run} failed to run: {e}")
+        for run, result in self._iter_runs(coords_xyz, quality_scores, init_centers):
+            n_finished += 1
+            if isinstance(result, Exception):
+                print(f"{run} failed to run: {result}")
                 continue
+            
+            inertias[run] = result['inertia']
+            n_selected_counts[run] = result['n_selected']
+            metrics.count('kmeans_runs')
+            metrics.count('kmeans_iterations', result['n_iter'])
+            # the smallest inertia wins, ties go to the lowest run id
+            if (self.best_result is None
+                    or (result['inertia'], run) < (self.best_result['inertia'], self.best_result['run_id'])):
+                self.best_result = result
+            
+            if n_finished % 5 == 0:
+                print(f"Finish running {n_finished}/{self.n_init}, "
+                      f"Current best inertia: {self.best_result['inertia']:.4f}")
         
-        if not results:
+        if self.best_result is None:
             raise ValueError("All runs have failed.")
         
-        # Select the best result (with the smallest inertia)
-        self.best_result = min(results, key=lambda x: x['inertia'])
-        
         # Calculate the stability index
-        inertias = [r['inertia'] for r in results]
-        n_selected_counts = [r['n_selected'] for r in results]
+        succeeded = ~np.isnan(inertias)
+        inertias = inertias[succeeded]
+        n_selected_counts = n_selected_counts[succeeded]
         
         self.stability_metrics = {
             'mean_inertia': np.mean(inertias),
@@ -252,21 +745,28 @@ class SphericalKMeansStationSelector:
             'min_inertia': np.min(inertias),
             'max_inertia': np.max(inertias),
             'mean_n_selected': np.mean(n_selected_counts),
-            'n_successful_runs': len(results)
+            'n_successful_runs': len(inertias),
+            'fit_seconds': time.perf_counter() - t_start
         }
+        metrics.observe('fit', self.stability_metrics['fit_seconds'])
         
-        selected_df = df.loc[self.best_result['selected_indices']].copy()
+        self._store_result(df, quality_col)
         
-        cluster_info = []
-        for i, idx in enumerate(self.best_result['selected_indices']):
-            original_idx = df.index.get_loc(idx) if idx in df.index else -1
-            if original_idx >= 0:
-                cluster_id = self.best_result['cluster_labels'][original_idx]
-                cluster_info.append(cluster_id)
-            else:
-                cluster_info.append(-1)
+        if cache is not None:
+            cache.put(cache_key, self.get_state())
         
-        selected_df['cluster_id'] = cluster_info
+        return self
+    
+    def _store_result(self, df, quality_col):
+        """
+        Build the selected and the clustered station tables of the best result
+        """
+        # the runs work on positions, map the selection back to the index of df
+        selected_positions = self.best_result['selected_positions']
+        self.best_result['selected_indices'] = df.index[selected_positions].tolist()
+        selected_df = df.iloc[selected_positions].copy()
+        
+        selected_df['cluster_id'] = self.best_result['cluster_labels'][selected_positions]
         selected_df['selected_quality_score'] = self.best_result['selected_scores']
         
         self.selected_stations = selected_df
@@ -274,16 +774,16 @@ class SphericalKMeansStationSelector:
         # Save the cluster ID and score of all stations
         all_stations_df = df.copy()
         all_stations_df['cluster_id'] = self.best_result['cluster_labels']
-        all_stations_df['topsis_score'] = quality_scores
+        all_stations_df['topsis_score'] = df[quality_col]
         self.all_stations_with_clusters = all_stations_df
+        self.station_llh = None
+        self.cluster_quality = None
         
         print(f"\nSelection completed!")
         print(f"{len(self.best_result['selected_indices'])} stations are selected successfully.")
         print(f"The best inertia: {self.best_result['inertia']:.4f}")
         print(f"the stability CV: {self.stability_metrics['coefficient_of_variation']:.4f}")
         print(f"Average quality score: {np.mean(self.best_result['selected_scores']):.4f}")
-        
-        return self
     
     def get_selected_stations(self):
         """
@@ -292,11 +792,67 @@ class SphericalKMeansStationSelector:
         if self.selected_stations is None:
             raise ValueError("The fit() method has not been executed yet.")
 
-        # Convert the xyz coordinates of the selected stations into longitude, latitude, and elevation for plotting.
-        self.selected_stations = self.xyz_to_llh(self.selected_stations)
+        # Add longitude, latitude, and elevation of the selected stations for plotting.
+        llh = self.get_station_llh()[self.best_result['selected_positions']]
+        self.selected_stations['latitude'] = llh[:, 0]
+        self.selected_stations['longitude'] = llh[:, 1]
+        self.selected_stations['height'] = llh[:, 2]
         
         return self.selected_stations
     
+    def get_station_llh(self):
+        """
+        Latitude, longitude (degrees) and geodetic height of all fitted stations,
+        in the row order of the fitted DataFrame. Converted once per fit.
+        """
+        if not hasattr(self, 'all_stations_with_clusters'):
+            raise ValueError("The fit() method has not been executed yet.")
+        
+        if self.station_llh is None:
+            pos = ecef2pos_array(self.all_stations_with_clusters[['x', 'y', 'z']].values)
+            pos[:, 0:2] = np.degrees(pos[:, 0:2])
+            self.station_llh = pos
+        
+        return self.station_llh
+    
+    def query_radius(self, points_xyz, radius_km=300.0):
+        """
+        Search the fitted stations within a great-circle distance of the given points
+        
+        Parameters:
+        - points_xyz: (m, 3) or (3,) ECEF coordinates of the query points
+        - radius_km: search radius in kilometres
+        
+        Returns:
+        - list with, for every query point, the row positions of the stations in
+          the fitted DataFrame that lie within radius_km
+        """
+        if self.station_tree is None:
+            raise ValueError("The fit() method has not been executed yet.")
+        
+        points = np.atleast_2d(np.asarray(points_xyz, dtype=float))
+        points = points / np.linalg.norm(points, axis=1, keepdims=True)
+        chord = angle_to_chord(radius_km / EARTH_RADIUS_KM)
+        neighbours = self.station_tree.query_ball_point(points, chord)
+        
+        return [np.sort(np.asarray(idx, dtype=int)) for idx in neighbours]
+    
+    def stations_within(self, site_name, radius_km=300.0):
+        """
+        All candidate stations within radius_km of the fitted station site_name
+        (the station itself included)
+        
+        Returns:
+        - pandas DataFrame, the rows of the fitted stations inside the radius
+        """
+        all_stations = self.all_stations_with_clusters
+        matched = np.flatnonzero(all_stations['site_name'].to_numpy() == site_name)
+        if len(matched) == 0:
+            raise ValueError(f"{site_name} is not among the fitted stations")
+        
+        center = all_stations[['x', 'y', 'z']].values[matched[0]]
+        return all_stations.iloc[self.query_radius(center, radius_km)[0]]
+    
     def get_all_stations_with_clusters(self):
         """
         Obtain information of all stations participating in clustering, 
@@ -310,7 +866,10 @@ class SphericalKMeansStationSelector:
         
         all_stations = self.all_stations_with_clusters.copy()
         
-        all_stations = self.xyz_to_llh(all_stations)
+        llh = self.get_station_llh()
+        all_stations['latitude'] = llh[:, 0]
+        all_stations['longitude'] = llh[:, 1]
+        all_stations['height'] = llh[:, 2]
         
         required_columns = ['site_name', 'latitude', 'longitude', 'cluster_id', 'topsis_score']
         for col in required_columns:
@@ -322,15 +881,96 @@ class SphericalKMeansStationSelector:
         
         return result_df
     
+    def get_cluster_quality(self, sample_size=1000, block_size=256):
+        """
+        Cluster-quality metrics of the fit, without the O(n^2) cost of an exact silhouette
+        
+        Parameters:
+        - sample_size: number of stations whose silhouette is computed (seeded by random_state);
+                       each of them is compared with all the stations
+        - block_size: number of sampled stations processed per vectorized block
+        
+        Returns:
+        - dict with
+          silhouette: mean angular silhouette of the sampled stations
+          cluster_radius_km: angular radius (largest member distance to the center) of every cluster
+          mean_cluster_radius_km, max_cluster_radius_km
+          mean_selected_gap_km, max_selected_gap_km: distance from the stations to the nearest selected station
+        """
+        if self.best_result is None:
+            raise ValueError("The fit() method has not been executed yet.")
+        if self.cluster_quality is not None:
+            return self.cluster_quality
+        
+        coords_xyz = self.all_stations_with_clusters[['x', 'y', 'z']].values.astype(float)
+        coords_normalized = coords_xyz / np.linalg.norm(coords_xyz, axis=1, keepdims=True)
+        labels = np.asarray(self.best_result['cluster_labels'])
+        centers = np.asarray(self.best_result['cluster_centers'], dtype=float)
+        centers = centers / np.linalg.norm(centers, axis=1, keepdims=True)
+        n_samples = len(coords_normalized)
+        
+        # stations grouped by cluster, so that per-cluster sums are one reduceat per block
+        order = np.argsort(labels, kind='stable')
+        cluster_ids, group_start, counts = np.unique(labels[order], return_index=True, return_counts=True)
+        sorted_coords = coords_normalized[order]
+        
+        # sampled silhouette with the angular distance
+        rng = np.random.default_rng(self.random_state)
+        sample = np.sort(rng.choice(n_samples, size=min(sample_size, n_samples), replace=False))
+        silhouettes = np.zeros(len(sample))
+        if len(cluster_ids) > 1:
+            for start in range(0, len(sample), block_size):
+                block = sample[start:start + block_size]
+                distances = np.arccos(np.clip(coords_normalized[block] @ sorted_coords.T, -1.0, 1.0))
+                cluster_sums = np.add.reduceat(distances, group_start, axis=1)
+                
+                own = np.searchsorted(cluster_ids, labels[block])
+                rows = np.arange(len(block))
+                own_counts = counts[own]
+                # mean distance to the other members of the own cluster (the station itself adds 0)
+                a = cluster_sums[rows, own] / np.maximum(own_counts - 1, 1)
+                mean_distances = cluster_sums / counts
+                mean_distances[rows, own] = np.inf
+                b = mean_distances.min(axis=1)
+                s = (b - a) / np.maximum(np.maximum(a, b), 1e-15)
+                # singleton clusters have a silhouette of 0
+                silhouettes[start:start + len(block)] = np.where(own_counts > 1, s, 0.0)
+        
+        # angular radius of each cluster
+        member_angles = np.arccos(np.clip(np.einsum('ij,ij->i', coords_normalized, centers[labels]), -1.0, 1.0))
+        cluster_radius = np.zeros(len(centers))
+        np.maximum.at(cluster_radius, labels, member_angles)
+        cluster_radius_km = cluster_radius[cluster_ids] * EARTH_RADIUS_KM
+        
+        # gap: distance from every station to the nearest selected station
+        selected_tree = build_kdtree(coords_normalized[self.best_result['selected_positions']])
+        chord, _ = selected_tree.query(coords_normalized)
+        gap_km = 2.0 * np.arcsin(np.clip(chord / 2.0, 0.0, 1.0)) * EARTH_RADIUS_KM
+        
+        self.cluster_quality = {
+            'silhouette': float(np.mean(silhouettes)),
+            'silhouette_sample_size': len(sample),
+            'cluster_radius_km': cluster_radius_km,
+            'mean_cluster_radius_km': float(np.mean(cluster_radius_km)),
+            'max_cluster_radius_km': float(np.max(cluster_radius_km)),
+            'mean_selected_gap_km': float(np.mean(gap_km)),
+            'max_selected_gap_km': float(np.max(gap_km)),
+        }
+        
+        return self.cluster_quality
+    
     def get_stability_report(self):
         
         if self.stability_metrics is None:
             raise ValueError("The fit() method has not been executed")
         
+        cluster_quality = self.get_cluster_quality()
+        
         report = f"""
-Stability Report on Spherical K-means
+Stability Report on {self.report_title}
 {'='*50}
 Number of successful runs: {self.stability_metrics['n_successful_runs']}
+Fit time: {self.stability_metrics.get('fit_seconds', float('nan')):.3f} s
 Number of target clusters: {self.n_clusters}
 Actual number of selected stations: {len(self.best_result['selected_indices'])}
 
@@ -346,86 +986,458 @@ Quality score statistics:
   Highest quality score: {np.max(self.best_result['selected_scores']):.4f}
   Minimum quality score: {np.min(self.best_result['selected_scores']):.4f}
 
+Cluster quality:
+  Angular silhouette ({cluster_quality['silhouette_sample_size']} sampled stations): {cluster_quality['silhouette']:.4f}
+  Average cluster radius: {cluster_quality['mean_cluster_radius_km']:.1f} km
+  Maximum cluster radius: {cluster_quality['max_cluster_radius_km']:.1f} km
+  Average distance to the nearest selected station: {cluster_quality['mean_selected_gap_km']:.1f} km
+  Maximum distance to the nearest selected station: {cluster_quality['max_selected_gap_km']:.1f} km
+
 Stability evaluation:
   {'excellent (CV < 0.05)' if self.stability_metrics['coefficient_of_variation'] < 0.05 
    else 'good (CV < 0.1)' if self.stability_metrics['coefficient_of_variation'] < 0.1
    else 'general (CV < 0.2)' if self.stability_metrics['coefficient_of_variation'] < 0.2
    else 'poor (CV >= 0.2)'}
         """
+        if self.stability_metrics.get('reselected'):
+            report = (report.rstrip() + "\n\nReselected without a refit: the figures describe "
+                      "the updated selection, not the runs of the fit\n")
         
         return report
     
 
+class FarthestPointStationSelector(SphericalKMeansStationSelector):
+    """
+    Quality-weighted greedy max-min dispersion station selection.
+    Starting from the best station, repeatedly select the station that maximizes
+    (angular distance to the nearest selected station) * quality_score ** quality_weight.
+    Deterministic and O(n) per selected station, a fast alternative to the
+    K-means++ runs for operational daily selections.
+    """
+    
+    report_title = 'Quality-weighted farthest-point selection'
+    
+    def __init__(self, n_clusters, quality_weight=1.0, min_quality=0.0):
+        """
+        Initialize the selector
+        
+        Parameters:
+        - n_clusters: Number of stations to be selected
+        - quality_weight: Exponent of the quality score in the selection criterion,
+                          0 gives the pure farthest-point selection
+        - min_quality: Stations scoring below this value are only selected when no
+                       other station is left (penalty)
+        """
+        super().__init__(n_clusters, n_init=1)
+        self.quality_weight = quality_weight
+        self.min_quality = min_quality
+    
+    def _key_params(self):
+        return (self.n_clusters, self.quality_weight, self.min_quality)
+    
+    def get_params(self):
+        return {'n_clusters': self.n_clusters, 'quality_weight': self.quality_weight,
+                'min_quality': self.min_quality}
+    
+    def farthest_point_selection(self, coords_normalized, quality_scores):
+        """
+        Greedy selection of the stations
+        
+        Returns:
+        - selected_positions: positions of the selected stations, in selection order
+        - labels: position in selected_positions of the nearest selected station of every station
+        """
+        n_samples = len(coords_normalized)
+        n_select = min(self.n_clusters, n_samples)
+        scores = np.asarray(quality_scores, dtype=float)
+        weights = np.clip(np.nan_to_num(scores, nan=0.0), 0.0, None) ** self.quality_weight
+        # penalized stations are selected only when no regular candidate is left
+        penalized = ~(scores >= self.min_quality)
+        
+        # start from the best station (the first one on ties)
+        first = int(np.argmax(np.where(penalized, -np.inf, scores))) if not penalized.all() else 0
+        selected_positions = [first]
+        labels = np.zeros(n_samples, dtype=int)
+        # angular distance from each station to its nearest selected station
+        min_angle = np.arccos(np.clip(coords_normalized @ coords_normalized[first], -1.0, 1.0))
+        
+        unselected = np.ones(n_samples, dtype=bool)
+        unselected[first] = False
+        
+        for j in range(1, n_select):
+            pool = unselected & ~penalized
+            if not pool.any():
+                pool = unselected
+            utility = np.where(pool, min_angle * weights, -np.inf)
+            
+            # ties are broken by the higher quality score, then by the lower position
+            best_utility = utility.max()
+            candidates = np.flatnonzero(utility >= best_utility - 1e-12 * max(abs(best_utility), 1.0))
+            next_idx = int(candidates[np.argmax(scores[candidates])])
+            selected_positions.append(next_idx)
+            unselected[next_idx] = False
+            
+            new_angle = np.arccos(np.clip(coords_normalized @ coords_normalized[next_idx], -1.0, 1.0))
+            closer = new_angle < min_angle
+            # a selected station is in its own cell, also when it duplicates the position of another one
+            closer[next_idx] = True
+            labels[closer] = j
+            min_angle[closer] = new_angle[closer]
+        
+        return np.array(selected_positions), labels
+    
+    def fit(self, df, quality_col='quality_score', init_centers=None, cache=None):
+        """
+        Select the stations by quality-weighted farthest-point sampling
+        
+        Parameters:
+        - df: pandas DataFrame, including station information (x, y, z)
+        - quality_col: Quality Score Column Name
+        - init_centers: not used, for compatibility with SphericalKMeansStationSelector.fit
+        - cache: optional SelectionCache; a fit with identical inputs is restored from it
+        """
+        if cache is not None:
+            cache_key = self.selection_key(df, quality_col)
+            state = cache.get(cache_key)
+            if state is not None:
+                print(f"The selection is restored from the cache: {cache_key[:16]}")
+                metrics.count('selection_cache_hits')
+                return self.set_state(state)
+        
+        t_start = time.perf_counter()
+        print(f"Start quality-weighted farthest-point station selection...")
+        print(f"Total number of stations: {len(df)}")
+        print(f"The selected number of stations: {self.n_clusters}")
+        print("=" * 60)
+        
+        coords_xyz = np.ascontiguousarray(df[['x', 'y', 'z']].values, dtype=float)
+        coords_normalized = coords_xyz / np.linalg.norm(coords_xyz, axis=1, keepdims=True)
+        quality_scores = df[quality_col].to_numpy(dtype=float)
+        self.station_tree = build_kdtree(coords_normalized)
+        
+        selected_positions, labels = self.farthest_point_selection(coords_normalized, quality_scores)
+        
+        # the centers of the cells of the selected stations, so that the inertia
+        # is computed in the same way as for the K-means clusters
+        n_selected = len(selected_positions)
+        centers = np.zeros((n_selected, 3))
+        for dim in range(3):
+            centers[:, dim] = np.bincount(labels, weights=coords_normalized[:, dim], minlength=n_selected)
+        # degenerate cells (opposite stations cancelling out): the selected station is the center
+        degenerate = np.linalg.norm(centers, axis=1) < 1e-12
+        centers[degenerate] = coords_normalized[selected_positions[degenerate]]
+        inertia = spherical_inertia(coords_normalized, labels, centers)
+        
+        self.best_result = {
+            'selected_indices': df.index[selected_positions].tolist(),
+            'selected_positions': selected_positions,
+            'selected_scores': quality_scores[selected_positions],
+            'cluster_labels': labels,
+            'cluster_centers': centers / np.linalg.norm(centers, axis=1, keepdims=True),
+            'inertia': inertia,
+            'n_iter': n_selected,
+            'run_id': 0,
+            'n_selected': n_selected
+        }
+        # a single deterministic run
+        self.stability_metrics = {
+            'mean_inertia': inertia,
+            'std_inertia': 0.0,
+            'coefficient_of_variation': 0.0,
+            'min_inertia': inertia,
+            'max_inertia': inertia,
+            'mean_n_selected': n_selected,
+            'n_successful_runs': 1,
+            'fit_seconds': time.perf_counter() - t_start
+        }
+        metrics.observe('fit', self.stability_metrics['fit_seconds'])
+        
+        self._store_result(df, quality_col)
+        
+        if cache is not None:
+            cache.put(cache_key, self.get_state())
+        
+        return self
 
 
-def choose_sta_main(chosen_num: int, year: int, doy_start: int, doy_end: int, work_root_path: str, data_root_path: str, site_list_file: str, out_path: str):
+def load_fit(fit_file) -> SphericalKMeansStationSelector:
     """
-    The main program for selecting stations using the spherical k-means algorithm based on station quality scores
+    Load a selector persisted by save_fit
+    """
+    import pickle
+    with open(fit_file, 'rb') as inp:
+        saved = pickle.load(inp)
+    
+    selector_class = {cls.__name__: cls for cls in (SphericalKMeansStationSelector,
+                                                    FarthestPointStationSelector)}[saved['selector']]
+    selector = selector_class(**saved['params']).set_state(saved['state'])
+    selector.name_tag = saved.get('name_tag')
+    return selector
+
+
+def make_selector(selection_method: str, chosen_num: int, n_init: int = 30) -> SphericalKMeansStationSelector:
+    """
+    Create the station selector of a selection method
+    - selection_method: 'kmeans' (spherical K-means, n_init runs) or 'fps' (quality-weighted farthest-point)
     - chosen_num: The number of selected stations
+    """
+    if selection_method == 'kmeans':
+        return SphericalKMeansStationSelector(
+            n_clusters=chosen_num,    # select n stations
+            n_init=n_init,            # run K-means++ by n_init times
+            random_state=42
+        )
+    elif selection_method == 'fps':
+        return FarthestPointStationSelector(n_clusters=chosen_num)
+    else:
+        raise ValueError(f"Unknown selection method: {selection_method}")
+
+
+def load_candidates(year: int, doy_start: int, doy_end: int, work_root_path: str, data_root_path: str,
+                    coord_cache_file: str = None, igs_filename: str = 'IGSNetwork.csv',
+                    scores: pd.DataFrame = None, rank_file: str = None, coord_provider=None) -> pd.DataFrame:
+    """
+    Read the station ranking of the period (or take it in memory) and attach the station coordinates
     - year
     - doy_start: Start of day of the year
     - doy_end: End of Day of Year
     - work_root_path: working directory
-    - data_root_path: Data Directory (mainly scanning the approximate location in the obs file)
-    - site_list_file: Site list file
-    - out_path: Output file directory
-    """
+    - data_root_path: Data Directory (SINEX files in snx/, RINEX headers in obs/)
+    - coord_cache_file: persistent station coordinate cache (None: no cache), see station_coord
+    - igs_filename: path of IGSNetwork.csv, second coordinate source after the SINEX files
+    - scores: station scores in memory (see station_eval.station_eval_period), the ranking file is not read
+    - rank_file: ranking file (default: work_root_path/sta_eval/sta_rank_evaluation_{year}_{doy_start}_{doy_end}.csv)
+    - coord_provider: StationCoordProvider of the period to reuse between calls
+      (default: a new one with coord_cache_file and igs_filename)
     
+    Returns:
+    - pandas DataFrame with site_name, topsis_score, x, y, z, coord_source of the scored stations
+    """
+    import pandas as pd
     
-    # read sta_rank file
-    sta_rank_name = f"sta_rank_evaluation_{year:04d}_{doy_start:03d}_{doy_end:03d}.csv"
-    df = pd.read_csv(Path(work_root_path, 'sta_eval', sta_rank_name))
-    df = df[df['topsis_score'] > 1e-10]
+    t_start = time.perf_counter()
+    if scores is None:
+        # read sta_rank file
+        if rank_file is None:
+            sta_rank_name = f"sta_rank_evaluation_{year:04d}_{doy_start:03d}_{doy_end:03d}.csv"
+            rank_file = Path(work_root_path, 'sta_eval', sta_rank_name)
+        scores = pd.read_csv(rank_file)
+    elif 'site_name' not in scores.columns:
+        # indexed by site_name, as returned by station_eval_period
+        scores = scores.reset_index()
+    df = scores[scores['topsis_score'] > 1e-10]
     print("Data preview:")
     print(df.head())
     print(f"\nData shape: {df.shape}")
     
-    
-    selector = SphericalKMeansStationSelector(
-        n_clusters=chosen_num,    # select n stations
-        n_init=30,                # run K-means++ by 30 times
-        random_state=42
-    )
-    
-    from site_list import scan_rinexo_coord
-    # obtain xyz from rinex o file
-    sta_coord_df = scan_rinexo_coord(data_root_path, df['site_name'].tolist(), year, doy_start)
+    # obtain xyz from the SINEX files, IGSNetwork.csv or the rinex o files
+    if coord_provider is None:
+        from station_coord import StationCoordProvider
+        coord_provider = StationCoordProvider(data_root_path, year, doy_start, doy_end,
+                                              igs_filename=igs_filename, cache_file=coord_cache_file)
+    sta_coord_df = coord_provider.get_coords(df['site_name'].tolist())
     df = df.merge(sta_coord_df, on='site_name', how='inner')
-
-    df = df[df['topsis_score'] >= 0.8]
-
-    
-    # select stations
-    selector.fit(df, quality_col='topsis_score')
+    metrics.observe('load_candidates', time.perf_counter() - t_start)
     
+    return df
+
+def write_selection(selector: SphericalKMeansStationSelector, out_path: str, name_tag: str) -> None:
+    """
+    Write the selected stations, their coordinates and all the clustered stations
+    - selector: fitted selector
+    - out_path: Output file directory
+    - name_tag: tag of the output file names, e.g. {chosen_num}_{year:04d}_{doy_start:03d}_{doy_end:03d}
+    """
     # obtain results
     selected_stations = selector.get_selected_stations()
     
-    print(f"\nSelected station:")
-    print(selected_stations[['site_name', 'latitude', 'longitude', 
-                           'topsis_score']].head(10))
-    
     # Save the station names of the selected stations to a text file, 
     # and save the coordinates of the selected stations to a text file.
     from site_list import write_site_list, write_site_list_coord
     if not os.path.exists(out_path): 
         os.makedirs(out_path)
     write_site_list(selected_stations['site_name'].tolist(), 
-                    Path(out_path, f'selected_stations_{chosen_num}_{year:04d}_{doy_start:03d}_{doy_end:03d}.txt'))
+                    Path(out_path, f'selected_stations_{name_tag}.txt'))
     write_site_list_coord(selected_stations, 
-                        Path(out_path, f'selected_stations_coord_{chosen_num}_{year:04d}_{doy_start:03d}_{doy_end:03d}.txt'), 
+                        Path(out_path, f'selected_stations_coord_{name_tag}.txt'), 
                         coord_col=['latitude', 'longitude'])
-
-    
-    # Output Stability Report
-    print(selector.get_stability_report())
     
     # Save all the information of the stations participating in the clustering to a CSV file.
     all_stations_with_clusters = selector.get_all_stations_with_clusters()
-    all_stations_csv_path = Path(out_path, f'all_stations_with_clusters_{chosen_num}_{year:04d}_{doy_start:03d}_{doy_end:03d}.csv')
+    all_stations_csv_path = Path(out_path, f'all_stations_with_clusters_{name_tag}.csv')
     all_stations_with_clusters.to_csv(all_stations_csv_path, index=False)
     print(f"All the information of the stations participating in the clustering has been saved to: {all_stations_csv_path}")
+
+def choose_sta_main(chosen_num: int, year: int, doy_start: int, doy_end: int, work_root_path: str, data_root_path: str, site_list_file: str, out_path: str,
+                    quality_threshold: float = 0.8, cache_dir: str = None, cache_max_mb: float = 256,
+                    selection_method: str = 'kmeans', fit_file: str = None,
+                    coord_cache_file: str = None, igs_filename: str = 'IGSNetwork.csv',
+                    scores: pd.DataFrame = None, rank_file: str = None,
+                    coord_provider=None) -> SphericalKMeansStationSelector:
+    """
+    The main program for selecting stations using the spherical k-means algorithm based on station quality scores
+    - chosen_num: The number of selected stations
+    - year
+    - doy_start: Start of day of the year
+    - doy_end: End of Day of Year
+    - work_root_path: working directory
+    - data_root_path: Data Directory (SINEX files in snx/, RINEX headers in obs/)
+    - site_list_file: Site list file
+    - out_path: Output file directory (None: nothing is written)
+    - quality_threshold: only stations with topsis_score >= quality_threshold are candidates
+    - cache_dir: directory of the selection result cache (None: no cache)
+    - cache_max_mb: maximum size of the selection result cache in MB
+    - selection_method: 'kmeans' (spherical K-means) or 'fps' (quality-weighted farthest-point)
+    - fit_file: if given, the fit is persisted to this file for choose_sta_reselect
+    - coord_cache_file: persistent station coordinate cache (None: no cache)
+    - igs_filename: path of IGSNetwork.csv, see load_candidates
+    - scores, rank_file, coord_provider: station scores in memory, ranking file and coordinates, see load_candidates
+    
+    Returns:
+    - the fitted selector
+    """
+    
+    df = load_candidates(year, doy_start, doy_end, work_root_path, data_root_path,
+                         coord_cache_file=coord_cache_file, igs_filename=igs_filename,
+                         scores=scores, rank_file=rank_file, coord_provider=coord_provider)
+    df = df[df['topsis_score'] >= quality_threshold]
+    
+    selector = make_selector(selection_method, chosen_num)
+    
+    cache = None
+    if cache_dir is not None:
+        from selection_cache import SelectionCache
+        cache = SelectionCache(cache_dir, max_bytes=int(cache_max_mb * 1024 * 1024))
+    
+    # select stations
+    selector.fit(df, quality_col='topsis_score', cache=cache)
+    
+    selected_stations = selector.get_selected_stations()
+    print(f"\nSelected station:")
+    print(selected_stations[['site_name', 'latitude', 'longitude', 
+                           'topsis_score']].head(10))
+    
+    name_tag = f'{chosen_num}_{year:04d}_{doy_start:03d}_{doy_end:03d}'
+    if out_path is not None:
+        write_selection(selector, out_path, name_tag)
+    if fit_file is not None:
+        selector.save_fit(fit_file, name_tag=name_tag)
+    
+    # Output Stability Report
+    print(selector.get_stability_report())
+    
+    return selector
+
+def choose_sta_reselect(fit_file: str, removed_sites: list[str], out_path: str, name_tag: str = None):
+    """
+    Replace stations that dropped out of a persisted selection without a refit
+    - fit_file: fit persisted by choose_sta_main (fit_file), updated in place
+    - removed_sites: The station names to remove
+    - out_path: Output file directory
+    - name_tag: tag of the output file names, see write_selection
+                (default: the tag of the fit followed by _reselected)
+    """
+    from pathlib import Path
     
+    selector = load_fit(fit_file)
+    selector.reselect(removed=removed_sites)
+    if name_tag is None:
+        # fit files written before the tag was persisted: the name of the file
+        name_tag = f"{selector.name_tag or Path(fit_file).stem}_reselected"
+    write_selection(selector, out_path, name_tag)
+    selector.save_fit(fit_file)
+    print(selector.get_stability_report())
+
+def choose_sta_sweep(chosen_nums: list[int], quality_thresholds: list[float], year: int, doy_start: int, doy_end: int,
+                     work_root_path: str, data_root_path: str, site_list_file: str, out_path: str,
+                     n_init: int = 30, cache_dir: str = None, cache_max_mb: float = 256,
+                     selection_method: str = 'kmeans', coord_cache_file: str = None,
+                     igs_filename: str = 'IGSNetwork.csv', rank_file: str = None) -> pd.DataFrame:
+    """
+    Select stations for a grid of (chosen_num, quality threshold) pairs.
+    The ranking and the coordinates are loaded once; for every threshold the
+    numbers of stations are solved in increasing order, each one warm-started
+    from the cluster centers of the previous one.
+    - chosen_nums: The numbers of selected stations
+    - quality_thresholds: The minimum topsis_score of the candidates
+    - the other parameters are the same as choose_sta_main
+    - n_init: Number of K-means++ runs per configuration
+    - cache_dir, cache_max_mb: selection result cache, see choose_sta_main
+    - selection_method, coord_cache_file, igs_filename, rank_file: see choose_sta_main
+    
+    Returns:
+    - pandas DataFrame, summary of every configuration (also written to out_path)
+    """
+    import pandas as pd
+    
+    candidates = load_candidates(year, doy_start, doy_end, work_root_path, data_root_path,
+                                 coord_cache_file=coord_cache_file, igs_filename=igs_filename,
+                                 rank_file=rank_file)
+    
+    cache = None
+    if cache_dir is not None:
+        from selection_cache import SelectionCache
+        cache = SelectionCache(cache_dir, max_bytes=int(cache_max_mb * 1024 * 1024))
+    
+    summary = []
+    for threshold in sorted(quality_thresholds):
+        df = candidates[candidates['topsis_score'] >= threshold]
+        warm_centers = None
+        
+        for chosen_num in sorted(chosen_nums):
+            if chosen_num > len(df):
+                print(f"Skip chosen_num={chosen_num}, threshold={threshold}: only {len(df)} candidates")
+                continue
+            
+            selector = make_selector(selection_method, chosen_num, n_init)
+            t_start = time.perf_counter()
+            selector.fit(df, quality_col='topsis_score', init_centers=warm_centers, cache=cache)
+            fit_seconds = time.perf_counter() - t_start
+            warm_centers = selector.best_result['cluster_centers']
+            
+            write_selection(selector, out_path,
+                            f'{chosen_num}_{year:04d}_{doy_start:03d}_{doy_end:03d}_q{threshold:.2f}')
+            
+            summary.append({
+                'chosen_num': chosen_num,
+                'quality_threshold': threshold,
+                'n_candidates': len(df),
+                'n_selected': len(selector.best_result['selected_indices']),
+                'best_inertia': selector.best_result['inertia'],
+                'mean_inertia': selector.stability_metrics['mean_inertia'],
+                'coefficient_of_variation': selector.stability_metrics['coefficient_of_variation'],
+                'mean_quality_score': np.mean(selector.best_result['selected_scores']),
+                'min_quality_score': np.min(selector.best_result['selected_scores']),
+                'fit_seconds': fit_seconds,
+            })
+    
+    summary_df = pd.DataFrame(summary)
+    summary_csv_path = Path(out_path, f'selection_sweep_summary_{year:04d}_{doy_start:03d}_{doy_end:03d}.csv')
+    if not os.path.exists(out_path):
+        os.makedirs(out_path)
+    summary_df.to_csv(summary_csv_path, index=False)
+    print(summary_df.to_string(index=False))
+    print(f"The summary of the sweep has been saved to: {summary_csv_path}")
+    
+    return summary_df
+
+def parse_sweep_values(text: str, value_type=int) -> list:
+    """
+    Parse a sweep argument: comma-separated values (0.7,0.8) and/or
+    start:stop:step ranges with an inclusive stop (20:200:10)
+    """
+    values = []
+    for item in text.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if ':' in item:
+            start, stop, step = (value_type(x) for x in item.split(':'))
+            n_steps = int(round((stop - start) / step))
+            values.extend(value_type(round(start + i * step, 10)) for i in range(n_steps + 1))
+        else:
+            values.append(value_type(item))
+    return values
 
 if __name__ == "__main__":
     
@@ -441,6 +1453,20 @@ if __name__ == "__main__":
     parser.add_argument('--data_root_path', help='Data root directory path')
     parser.add_argument('--site_list_file', help='Site list file path')
     parser.add_argument('--out_path', help='Output path of the station selection result file')
+    parser.add_argument('--quality_threshold', type=float, default=0.8, help='Minimum topsis_score of the candidate stations')
+    parser.add_argument('--sweep_chosen_num', help='Sweep mode: numbers of selected stations, e.g. 20:200:10 or 20,30,50')
+    parser.add_argument('--sweep_threshold', help='Sweep mode: quality thresholds, e.g. 0.7,0.8 (default: --quality_threshold)')
+    parser.add_argument('--n_init', type=int, default=30, help='Sweep mode: number of K-means++ runs per configuration')
+    parser.add_argument('--cache_dir', help='Directory of the selection result cache (default: no cache)')
+    parser.add_argument('--selection_method', default='kmeans', choices=['kmeans', 'fps'],
+                        help='kmeans: spherical K-means, fps: quality-weighted farthest-point selection')
+    parser.add_argument('--fit_file', help='File to persist the fit to, or to reselect from (with --removed_sites)')
+    parser.add_argument('--removed_sites', help='Reselect mode: comma-separated stations dropped out of the fit in --fit_file')
+    parser.add_argument('--cache_max_mb', type=float, default=256, help='Maximum size of the selection result cache in MB')
+    parser.add_argument('--coord_cache_file', help='Persistent station coordinate cache file (default: no cache)')
+    parser.add_argument('--igs_filename', default='IGSNetwork.csv', help='Path of IGSNetwork.csv, used for the station coordinates')
+    parser.add_argument('--rank_file', help='Station score file (default: the file of the period in {work_root_path}/sta_eval)')
+    metrics.add_cli_arguments(parser)
     # ===========================
     # year = 2025
     # doy_start = 1
@@ -450,8 +1476,31 @@ if __name__ == "__main__":
     # site_list_file = 'site_list'
     # out_path = 'D:/code_tmp/Python/cepnt_sta/out'
     args = parser.parse_args()
-    choose_sta_main(args.chosen_num, args.year, 
-                    args.doy_start, args.doy_end, 
-                    args.work_root_path, args.data_root_path, 
-                    args.site_list_file, args.out_path)
+    with metrics.cli_session(args, 'choose_sta'):
+        if args.removed_sites:
+            removed_sites = [site.strip() for site in args.removed_sites.split(',') if site.strip()]
+            # the name tag of the output files is read from the fit file
+            choose_sta_reselect(args.fit_file, removed_sites, args.out_path)
+        elif args.sweep_chosen_num or args.sweep_threshold:
+            chosen_nums = parse_sweep_values(args.sweep_chosen_num) if args.sweep_chosen_num else [args.chosen_num]
+            thresholds = (parse_sweep_values(args.sweep_threshold, float) if args.sweep_threshold
+                          else [args.quality_threshold])
+            choose_sta_sweep(chosen_nums, thresholds, args.year,
+                             args.doy_start, args.doy_end,
+                             args.work_root_path, args.data_root_path,
+                             args.site_list_file, args.out_path, n_init=args.n_init,
+                             cache_dir=args.cache_dir, cache_max_mb=args.cache_max_mb,
+                             selection_method=args.selection_method,
+                             coord_cache_file=args.coord_cache_file, igs_filename=args.igs_filename,
+                             rank_file=args.rank_file)
+        else:
+            choose_sta_main(args.chosen_num, args.year, 
+                            args.doy_start, args.doy_end, 
+                            args.work_root_path, args.data_root_path, 
+                            args.site_list_file, args.out_path,
+                            quality_threshold=args.quality_threshold,
+                            cache_dir=args.cache_dir, cache_max_mb=args.cache_max_mb,
+                            selection_method=args.selection_method, fit_file=args.fit_file,
+                            coord_cache_file=args.coord_cache_file, igs_filename=args.igs_filename,
+                            rank_file=args.rank_file)
     
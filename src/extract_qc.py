@@ -28,14 +28,22 @@ cnr1、cnr2
 
 import re
 import os
-import pandas as pd
 from pathlib import Path
+from typing import TYPE_CHECKING
+import metrics
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 def extract_qc_single_site(site_name: str, year: int, doy: int, work_root_path: str) -> dict:
     """
     Extract qc information from the analysis results of a single station
     """
+    # the per-station messages are logged at INFO level, not printed:
+    # a batch of thousands of stations is not bound by the output
+    import logging
+    logger = logging.getLogger(__name__)
+
     qc_dict = {} 
 
     qc_file_name = site_name.upper() + str(year).zfill(4)+str(doy).zfill(3) +'.xtr'
@@ -44,6 +52,8 @@ def extract_qc_single_site(site_name: str, year: int, doy: int, work_root_path:
     
     # penalty values
     if not qc_file_path.exists():
+        logger.info("%s: no anubis result, penalty values", qc_file_name)
+        metrics.count('qc_stations_penalized')
         qc_dict['GPS'] = [0,999999,999999,999999,999999,999999,999999,999999,0,0]
         qc_dict['GLO'] = [0,999999,999999,999999,999999,999999,999999,999999,0,0]
         qc_dict['GAL'] = [0,999999,999999,999999,999999,999999,999999,999999,0,0]
@@ -53,6 +63,9 @@ def extract_qc_single_site(site_name: str, year: int, doy: int, work_root_path:
     
     with open(qc_file_path, "r") as file:
         data = file.readlines()
+    metrics.count('files_opened')
+    metrics.count('bytes_read', qc_file_path.stat().st_size)
+    metrics.count('stations_parsed')
 
     # extract summary statistics
     s_index = 0
@@ -68,7 +81,8 @@ def extract_qc_single_site(site_name: str, year: int, doy: int, work_root_path:
             tmp_list = line.split()
             hours = float(tmp_list[5])
             if hours < 0.5 + 1e-10:
-                print('Only several epochs, skip this station\n')
+                logger.info("%s: only several epochs, skip this station", qc_file_name)
+                metrics.count('qc_stations_penalized')
                 qc_dict['GPS'] = [0,999999,999999,999999,999999,999999,999999,999999,0,0]
                 qc_dict['GLO'] = [0,999999,999999,999999,999999,999999,999999,999999,0,0]
                 qc_dict['GAL'] = [0,999999,999999,999999,999999,999999,999999,999999,0,0]
@@ -92,7 +106,8 @@ def extract_qc_single_site(site_name: str, year: int, doy: int, work_root_path:
             continue
     # If the observation data of a certain system is missing, then return the penalty value.
     if False in lack_of_sys.values():
-        print('Obs of certain system is lack, skip this station\n')
+        logger.info("%s: obs of certain system is lack, skip this station", qc_file_name)
+        metrics.count('qc_stations_penalized')
         qc_dict['GPS'] = [0,999999,999999,999999,999999,999999,999999,999999,0,0]
         qc_dict['GLO'] = [0,999999,999999,999999,999999,999999,999999,999999,0,0]
         qc_dict['GAL'] = [0,999999,999999,999999,999999,999999,999999,999999,0,0]
@@ -419,7 +434,9 @@ def extract_qc_single_site(site_name: str, year: int, doy: int, work_root_path:
 
     
 # Extract the QC information of multiple stations on a single day
-def extract_qc_single_day(site_list: list[str], year: int, doy: int, work_root_path: str) -> pd.DataFrame:
+def extract_qc_single_day(site_list: list[str], year: int, doy: int, work_root_path: str) -> 'pd.DataFrame':
+    import pandas as pd
+    
     all_sites_data = []
     col_name = ['site_name',
                 f"G_nobs_{year:04d}{doy:03d}",
@@ -464,17 +481,20 @@ def extract_qc_single_day(site_list: list[str], year: int, doy: int, work_root_p
                 f"C_cnr2_{year:04d}{doy:03d}",
                 ]
 
-    for site_name in site_list:
-        one_site_dict = extract_qc_single_site(site_name, year, doy, work_root_path)
-        # One line of data from a single station: [site_name] + GPS index + GLO index + GAL index + BDS index
-        one_site_data = [site_name] + one_site_dict['GPS'] + one_site_dict['GLO'] + one_site_dict['GAL'] + one_site_dict['BDS']
-        all_sites_data.append(one_site_data)
+    with metrics.timer('extract_qc'):
+        for site_name in site_list:
+            one_site_dict = extract_qc_single_site(site_name, year, doy, work_root_path)
+            # One line of data from a single station: [site_name] + GPS index + GLO index + GAL index + BDS index
+            one_site_data = [site_name] + one_site_dict['GPS'] + one_site_dict['GLO'] + one_site_dict['GAL'] + one_site_dict['BDS']
+            all_sites_data.append(one_site_data)
 
     
     return pd.DataFrame(all_sites_data, columns=col_name)
 
 
-def extract_qc_multiple_days(site_list:list[str], year: int, doy_start: int, doy_end: int, work_root_path: str) -> pd.DataFrame:
+def extract_qc_multiple_days(site_list:list[str], year: int, doy_start: int, doy_end: int, work_root_path: str) -> 'pd.DataFrame':
+    import pandas as pd
+    
     all_days_df = None
     for doy in range(doy_start, doy_end + 1):
         daily_df = extract_qc_single_day(site_list, year, doy, work_root_path)
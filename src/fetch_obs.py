@@ -0,0 +1,189 @@
+'''
+Download the RINEX observation files of the stations in a site list
+into f"{data_root_path}/obs/daily/{year:04d}/{doy:03d}/"
+
+The remote files are given by a URL template with the fields
+- {site}, {SITE}: four-character station ID in lower / upper case
+- {yyyy}, {yy}, {doy}: year, two-digit year and three-digit day of year
+e.g. https://mirror.example.org/gnss/data/daily/{yyyy}/{doy}/{yy}o/{site}{doy}0.{yy}o.gz
+The downloaded file keeps its remote name next to the RINEX file read by anubis
+({site}{doy}0.{yy}o, see anibus_ana.gene_rinex_code), which is decompressed from it:
+.gz and .Z files are decompressed, Hatanaka files (.crx, .{yy}d) are converted with CRX2RNX.
+'''
+import gzip
+import os
+import re
+import shutil
+import subprocess
+import time
+import zlib
+from pathlib import Path
+
+HATANAKA_PATTERN = re.compile(r'(\.crx|\.\d\dd)$', re.IGNORECASE)
+
+
+def obs_jobs(site_list: list[str], year: int, doy_start: int, doy_end: int,
+             data_root_path: str, url_template: str) -> list[tuple[str, Path, Path]]:
+    """
+    (url, downloaded file, RINEX file) of every station and day
+    """
+    from anibus_ana import gene_rinex_code
+
+    jobs = []
+    for doy in range(doy_start, doy_end + 1):
+        fields = {'yyyy': f"{year:04d}", 'yy': f"{year:04d}"[-2:], 'doy': f"{doy:03d}"}
+        for site in site_list:
+            url = url_template.format(site=site[0:4].lower(), SITE=site[0:4].upper(), **fields)
+            rinex_o_content, _ = gene_rinex_code(site[0:4], year, doy, data_root_path)
+            # the download keeps its remote name for the conditional requests of the next runs
+            jobs.append((url, rinex_o_content.with_name(url.rsplit('/', 1)[-1]), rinex_o_content))
+    return jobs
+
+def is_hatanaka(file_name: str) -> bool:
+    """
+    file_name is a Hatanaka compressed RINEX file (.crx or .{yy}d, possibly .gz/.Z compressed)
+    """
+    name = re.sub(r'\.(gz|Z)$', '', file_name)
+    return HATANAKA_PATTERN.search(name) is not None
+
+def decompress_obs(download_file: Path, rinex_file: Path, crx2rnx: str = 'CRX2RNX') -> Path:
+    """
+    Write the RINEX file rinex_file from the downloaded download_file (.gz/.Z decompressed,
+    Hatanaka converted with the crx2rnx program), unless rinex_file is newer.
+    A corrupt archive raises OSError, EOFError, ValueError or zlib.error; a failed conversion RuntimeError.
+    """
+    from sinex import LZWReader
+
+    if download_file == rinex_file:
+        return rinex_file
+    if rinex_file.exists() and rinex_file.stat().st_mtime >= download_file.stat().st_mtime:
+        return rinex_file
+    if download_file.suffix == '.gz':
+        inp = gzip.open(download_file, 'rb')
+    elif download_file.suffix == '.Z':
+        inp = LZWReader(open(download_file, 'rb'))
+    else:
+        inp = open(download_file, 'rb')
+
+    tmp_file = rinex_file.with_name(rinex_file.name + f".tmp{os.getpid()}")
+    try:
+        if is_hatanaka(download_file.name):
+            crx2rnx_path = shutil.which(crx2rnx)
+            if crx2rnx_path is None:
+                raise RuntimeError(f"{crx2rnx} not found, cannot convert the Hatanaka file {download_file}")
+            with inp, open(tmp_file, 'wb') as outp:
+                # '-': filter mode, from the standard input to the standard output
+                process = subprocess.run([crx2rnx_path, '-'], input=inp.read(), stdout=outp,
+                                         stderr=subprocess.PIPE)
+            if process.returncode != 0:
+                raise RuntimeError(f"{crx2rnx} failed on {download_file}: "
+                                   f"{process.stderr.decode(errors='replace').strip()}")
+        else:
+            with inp, open(tmp_file, 'wb') as outp:
+                shutil.copyfileobj(inp, outp)
+        os.replace(tmp_file, rinex_file)
+    finally:
+        if tmp_file.exists():
+            tmp_file.unlink()
+    return rinex_file
+
+def is_complete(fetcher, url: str, dest: Path, rinex_file: Path) -> bool:
+    """
+    dest is the complete download of url, or rinex_file was put there by hand (no download record)
+    """
+    if fetcher.is_current(url, dest):
+        return True
+    return rinex_file.exists() and not dest.with_name(dest.name + '.meta').exists()
+
+def prefetch_obs(site_list: list[str], year: int, doy_start: int, doy_end: int, data_root_path: str,
+                 url_template: str, n_jobs: int = 8, retries: int = 3, backoff: float = 2.0) -> dict:
+    """
+    Download the observation files of the stations for every day of the period.
+    The files whose download is complete (size and modification time recorded by the previous download,
+    checksum if they changed) are skipped without any request; a RINEX file present without a download
+    record (copied by hand) is kept.
+
+    Parameters:
+    - site_list: station names
+    - year, doy_start, doy_end: the period
+    - data_root_path: Data Directory
+    - url_template: remote file URL template, see the module documentation
+    - n_jobs: number of parallel downloads (one persistent connection per host each)
+    - retries, backoff: retries of a failed download, delay before the first one in seconds (doubled each retry)
+
+    Returns:
+    - dict with the number of files per status (decompress_failed: downloads that cannot be decompressed),
+      the transferred bytes, the seconds, the throughput in MB/s and errors (downloaded file -> error
+      of its decompression)
+    """
+    from fetcher import Fetcher
+
+    t_start = time.perf_counter()
+    fetcher = Fetcher(n_jobs=n_jobs, retries=retries, backoff=backoff)
+
+    all_jobs = obs_jobs(site_list, year, doy_start, doy_end, data_root_path, url_template)
+    jobs = []
+    counts = {'skipped': 0}
+    for url, dest, rinex_file in all_jobs:
+        if is_complete(fetcher, url, dest, rinex_file):
+            counts['skipped'] += 1
+        else:
+            jobs.append((url, dest))
+    print(f"{len(jobs)} files to download, {counts['skipped']} already complete")
+
+    with fetcher:
+        results = fetcher.fetch_many(jobs)
+
+    n_bytes = 0
+    failed = set()
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+        n_bytes += result['bytes']
+        if result['status'] == 'failed':
+            failed.add(result['path'])
+            print(f"Warning: {result['url']} failed ({result['error']})")
+
+    # also the downloads skipped above, which may not be decompressed yet
+    errors = {}
+    for url, dest, rinex_file in all_jobs:
+        if dest == rinex_file or str(dest) in failed or not dest.exists():
+            continue
+        try:
+            decompress_obs(dest, rinex_file)
+        except (OSError, EOFError, ValueError, RuntimeError, zlib.error) as e:
+            # one corrupt archive must not stop the others
+            errors[str(dest)] = f"{type(e).__name__}: {e}"
+            print(f"Warning: cannot decompress {dest} ({errors[str(dest)]})")
+    if errors:
+        counts['decompress_failed'] = len(errors)
+
+    seconds = time.perf_counter() - t_start
+    summary = {**counts, 'bytes': n_bytes, 'seconds': seconds, 'errors': errors,
+               'mb_per_second': n_bytes / 1e6 / seconds if seconds > 0 else 0.0}
+    print(' '.join(f"{status}: {count}" for status, count in counts.items()))
+    print(f"{n_bytes / 1e6:.1f} MB in {seconds:.1f} s ({summary['mb_per_second']:.2f} MB/s)")
+    return summary
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--site_list_file', help='Path of the site list file')
+    parser.add_argument('--year', type=int, help='year')
+    parser.add_argument('--doy_start', type=int, help='start of DOY')
+    parser.add_argument('--doy_end', type=int, help='end of DOY')
+    parser.add_argument('--data_root_path', help='Data root directory path')
+    parser.add_argument('--url_template', help='URL template of the remote observation files, e.g. '
+                        'https://mirror/gnss/data/daily/{yyyy}/{doy}/{yy}o/{site}{doy}0.{yy}o.gz')
+    parser.add_argument('--n_jobs', type=int, default=8, help='Number of parallel downloads')
+    parser.add_argument('--retries', type=int, default=3, help='Retries of a failed download')
+    import metrics
+    metrics.add_cli_arguments(parser)
+    # ===========================
+
+    args = parser.parse_args()
+    from site_list import read_list
+    with metrics.cli_session(args, 'fetch_obs'):
+        prefetch_obs(read_list(args.site_list_file), args.year, args.doy_start, args.doy_end,
+                     args.data_root_path, args.url_template, n_jobs=args.n_jobs, retries=args.retries)
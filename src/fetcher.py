@@ -0,0 +1,326 @@
+'''
+In-process downloader of the metadata, products and observation files
+
+- one persistent HTTP(S) connection per host and worker thread
+- conditional GET (If-None-Match / If-Modified-Since): nothing is transferred when the local copy is current
+- interrupted downloads resume from the partial file (Range / If-Range)
+- parallel downloads with a bounded thread pool
+- every downloaded file has a sidecar {file}.meta (JSON) with its validators, size, modification time
+  and SHA-256; a local copy whose size or modification time changed is hashed,
+  and downloaded again when it does not match its checksum
+- file:// URLs and plain local paths (local mirrors) are copied
+'''
+import hashlib
+import http.client
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urljoin, urlsplit
+from urllib.request import url2pathname
+import metrics
+
+IGS_NETWORK_URL = 'https://files.igs.org/pub/station/general/IGSNetwork.csv'
+
+CHUNK_SIZE = 1 << 16
+MAX_REDIRECTS = 5
+
+
+def join_url(base_url: str, path: str) -> str:
+    """
+    base_url/path with exactly one separator
+    """
+    return base_url.rstrip('/') + '/' + path.lstrip('/')
+
+def file_sha256(path) -> str:
+    """
+    SHA-256 hex digest of a file
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as inp:
+        for chunk in iter(lambda: inp.read(CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Fetcher:
+    """
+    Downloads url -> local file, see the module documentation.
+    fetch() and fetch_many() return, for every file, a dict with
+    url, path, status ('downloaded', 'resumed', 'not_modified', 'copied' or 'failed'),
+    bytes (transferred), seconds and error (failed downloads only).
+    """
+
+    def __init__(self, n_jobs: int = 4, timeout: float = 30.0, retries: int = 3,
+                 backoff: float = 1.0, verify: bool = False):
+        """
+        Parameters:
+        - n_jobs: number of parallel downloads of fetch_many
+        - timeout: socket timeout in seconds
+        - retries: number of retries of a failed download
+        - backoff: delay before the first retry in seconds, doubled at every retry
+        - verify: check the SHA-256 of the local copy before trusting it, even when its size
+          and modification time match the download record
+        """
+        self.n_jobs = n_jobs
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.verify = verify
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self) -> None:
+        """
+        Close the connections of all the threads
+        """
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+    def _connection(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        connections = self._local.__dict__.setdefault('connections', {})
+        conn = connections.get((scheme, netloc))
+        if conn is None:
+            if scheme == 'https':
+                conn = http.client.HTTPSConnection(netloc, timeout=self.timeout)
+            elif scheme == 'http':
+                conn = http.client.HTTPConnection(netloc, timeout=self.timeout)
+            else:
+                raise ValueError(f"unsupported URL scheme: {scheme}")
+            connections[(scheme, netloc)] = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _drop_connection(self, scheme: str, netloc: str) -> None:
+        conn = self._local.__dict__.get('connections', {}).pop((scheme, netloc), None)
+        if conn is not None:
+            conn.close()
+
+    @staticmethod
+    def _meta_path(dest: Path) -> Path:
+        return dest.with_name(dest.name + '.meta')
+
+    def _read_meta(self, dest: Path) -> dict:
+        try:
+            with open(self._meta_path(dest), 'r') as inp:
+                return json.load(inp)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_meta(self, dest: Path, meta: dict) -> None:
+        meta_path = self._meta_path(dest)
+        tmp_path = meta_path.with_name(meta_path.name + f".tmp{os.getpid()}.{threading.get_ident()}")
+        with open(tmp_path, 'w') as outp:
+            json.dump(meta, outp)
+        os.replace(tmp_path, meta_path)
+
+    def _is_current(self, dest: Path, meta: dict, url: str) -> bool:
+        """
+        The local copy is the complete file of url: same size and modification time as recorded,
+        otherwise (or with verify) same checksum
+        """
+        if meta.get('url') != url or 'sha256' not in meta or not dest.exists():
+            return False
+        stat = dest.stat()
+        if stat.st_size != meta.get('size'):
+            return False
+        if not self.verify and stat.st_mtime_ns == meta.get('mtime_ns'):
+            return True
+        if file_sha256(dest) != meta['sha256']:
+            return False
+        if stat.st_mtime_ns != meta.get('mtime_ns'):
+            # touched but unchanged: the next runs need not hash it again
+            meta['mtime_ns'] = stat.st_mtime_ns
+            self._write_meta(dest, meta)
+        return True
+
+    def is_current(self, url: str, dest: str) -> bool:
+        """
+        dest is the complete download of url (no request is made), see _is_current
+        """
+        dest = Path(dest)
+        return self._is_current(dest, self._read_meta(dest), url)
+
+    def fetch(self, url: str, dest: str) -> dict:
+        """
+        Download url to dest unless dest is current, with retries
+        """
+        dest = Path(dest)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        t_start = time.perf_counter()
+        result = {'url': url, 'path': str(dest), 'status': 'failed', 'bytes': 0}
+
+        for attempt in range(self.retries + 1):
+            try:
+                if urlsplit(url).scheme in ('http', 'https'):
+                    status, n_bytes = self._fetch_http(url, dest)
+                else:
+                    status, n_bytes = self._fetch_local(url, dest)
+                result.update(status=status, bytes=result['bytes'] + n_bytes)
+                result.pop('error', None)
+                break
+            except (OSError, http.client.HTTPException, RuntimeError) as e:
+                result['error'] = f"{type(e).__name__}: {e}"
+                if isinstance(e, FileNotFoundError) or attempt == self.retries:
+                    break
+                time.sleep(self.backoff * 2 ** attempt)
+
+        result['seconds'] = time.perf_counter() - t_start
+        metrics.observe('fetch', result['seconds'])
+        metrics.count('bytes_downloaded', result['bytes'])
+        if result['status'] in ('downloaded', 'resumed', 'copied'):
+            metrics.count('files_downloaded')
+        return result
+
+    def fetch_many(self, jobs: list[tuple[str, str]]) -> list[dict]:
+        """
+        Download the (url, dest) pairs with n_jobs parallel workers; the results are in the order of jobs
+        """
+        if not jobs:
+            return []
+        n_jobs = max(1, min(self.n_jobs, len(jobs)))
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            return list(executor.map(lambda job: self.fetch(*job), jobs))
+
+    def _fetch_local(self, url: str, dest: Path) -> tuple[str, int]:
+        """
+        Copy a file:// URL or a local path
+        """
+        parts = urlsplit(url)
+        src = Path(url2pathname(parts.path)) if parts.scheme == 'file' else Path(url)
+        stat = src.stat()
+        meta = self._read_meta(dest)
+        source = [stat.st_mtime_ns, stat.st_size]
+        if meta.get('source') == source and self._is_current(dest, meta, url):
+            return 'not_modified', 0
+
+        part = dest.with_name(dest.name + '.part')
+        shutil.copyfile(src, part)
+        size = part.stat().st_size
+        sha256 = file_sha256(part)
+        os.replace(part, dest)
+        self._write_meta(dest, {'url': url, 'source': source, 'sha256': sha256, 'size': size,
+                                'mtime_ns': dest.stat().st_mtime_ns})
+        return 'copied', size
+
+    def _fetch_http(self, url: str, dest: Path) -> tuple[str, int]:
+        """
+        One conditional (or resuming) GET of url
+        """
+        meta = self._read_meta(dest)
+        part = dest.with_name(dest.name + '.part')
+        headers = {'User-Agent': 'gnss_station_selector', 'Accept-Encoding': 'identity'}
+
+        if self._is_current(dest, meta, url):
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        resume_from = 0
+        part_validator = meta.get('part_validator')
+        if part.exists() and part_validator and meta.get('url') == url:
+            resume_from = part.stat().st_size
+            headers['Range'] = f"bytes={resume_from}-"
+            headers['If-Range'] = part_validator
+
+        response, final_url = self._request(url, headers)
+        try:
+            if response.status == 304:
+                response.read()
+                return 'not_modified', 0
+            if response.status == 416 and resume_from:
+                # the range starts at the end of the file: the partial file may be complete already
+                response.read()
+                total = response.getheader('Content-Range', '*/*').rsplit('/', 1)[1]
+                if total.isdigit() and int(total) == resume_from:
+                    self._promote_part(part, dest, meta)
+                    return 'resumed', 0
+                # the partial file does not fit the remote file: download it again
+                part.unlink()
+                return self._fetch_http(url, dest)
+            if response.status == 206 and resume_from:
+                mode = 'ab'
+                # bytes start-end/total
+                expected = int(response.getheader('Content-Range', '*/-1').rsplit('/', 1)[1])
+            elif response.status == 200:
+                mode = 'wb'
+                resume_from = 0
+                expected = int(response.getheader('Content-Length', '-1'))
+            elif response.status in (404, 410):
+                response.read()
+                # not retried
+                raise FileNotFoundError(f"HTTP {response.status} {response.reason}: {final_url}")
+            else:
+                response.read()
+                raise RuntimeError(f"HTTP {response.status} {response.reason}: {final_url}")
+
+            etag = response.getheader('ETag')
+            last_modified = response.getheader('Last-Modified')
+            # the partial file can be resumed only against the same version
+            meta = {'url': url, 'etag': etag, 'last_modified': last_modified,
+                    'part_validator': etag or last_modified}
+            self._write_meta(dest, meta)
+
+            n_bytes = 0
+            with open(part, mode) as outp:
+                for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                    outp.write(chunk)
+                    n_bytes += len(chunk)
+        except (OSError, http.client.HTTPException):
+            self._drop_connection(*urlsplit(final_url)[0:2])
+            raise
+
+        size = part.stat().st_size
+        if expected >= 0 and size != expected:
+            raise RuntimeError(f"incomplete download of {url}: {size} of {expected} bytes")
+        self._promote_part(part, dest, meta)
+        return ('resumed' if mode == 'ab' else 'downloaded'), n_bytes
+
+    def _promote_part(self, part: Path, dest: Path, meta: dict) -> None:
+        """
+        Move the complete partial file to dest and record its size, modification time and checksum
+        """
+        meta.update(sha256=file_sha256(part), size=part.stat().st_size)
+        meta.pop('part_validator', None)
+        os.replace(part, dest)
+        meta['mtime_ns'] = dest.stat().st_mtime_ns
+        self._write_meta(dest, meta)
+
+    def _request(self, url: str, headers: dict):
+        """
+        GET url on the persistent connection of its host, following redirects.
+        A connection closed by the server while idle is reopened once.
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            target = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+            for reopen in (False, True):
+                conn = self._connection(parts.scheme, parts.netloc)
+                try:
+                    conn.request('GET', target, headers=headers)
+                    response = conn.getresponse()
+                    break
+                except (ConnectionError, http.client.RemoteDisconnected, http.client.CannotSendRequest):
+                    self._drop_connection(parts.scheme, parts.netloc)
+                    if reopen:
+                        raise
+            if response.status in (301, 302, 303, 307, 308):
+                response.read()
+                url = urljoin(url, response.getheader('Location'))
+                continue
+            return response, url
+        raise RuntimeError(f"too many redirects: {url}")
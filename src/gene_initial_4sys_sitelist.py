@@ -3,22 +3,49 @@
 # have precise coordinates in all sinex weekly solution files during the analysis period.
 
 import os
-import platform
-from time_convert import doy_mjd, mjd_gpswk,doy_ymd
+from time_convert import doy_mjd, mjd_gpswk
 from pathlib import Path
-import pandas as pd
+import metrics
 
-def download_metadata(bindir:str) -> None:
-    if platform.system() == 'Windows':
-        wget = os.path.join(bindir, 'wget.exe')
-        wget += " -T 3 -t 10 -N -c "
+def download_metadata(igs_filename:str='IGSNetwork.csv', url:str=None) -> None:
+    """
+    Download IGSNetwork.csv (default: from files.igs.org) to igs_filename.
+    Nothing is transferred when the local copy is current.
+    """
+    from fetcher import Fetcher, IGS_NETWORK_URL
+    
+    with Fetcher() as fetcher:
+        result = fetcher.fetch(url or IGS_NETWORK_URL, igs_filename)
+    if result['status'] == 'failed':
+        print(f"Warning: download of {result['url']} failed ({result['error']})\n")
+        if not os.path.exists(igs_filename):
+            raise FileNotFoundError(f"{igs_filename} is not available")
     else:
-        wget = os.path.join(bindir, 'wget')
-        wget += " -T 3 -t 10 -N -c "
-    metadata_addr = "https://files.igs.org/pub/station/general/IGSNetwork.csv"
-    cmd_dl = wget + metadata_addr
-    for value in range(1, 3):
-    	os.system(cmd_dl)
+        print(f"{igs_filename}: {result['status']} ({result['bytes']} bytes)\n")
+
+def download_sinex_products(sinex_root_path:str, year:int, doy_start:int, doy_end:int,
+                            base_url:str, n_jobs:int=4) -> None:
+    """
+    Download the compressed sinex weekly solutions of the period into sinex_root_path
+    from base_url/{gpsweek}/ (the layout of the IGS product archives and their mirrors).
+    The files already downloaded and unchanged are not transferred again.
+    """
+    from fetcher import Fetcher, join_url
+    from sinex_index import sinex_file_week
+    
+    jobs = []
+    for sinex_file in generate_sinex_week_file_list(sinex_root_path, year, doy_start, doy_end):
+        gpsweek = sinex_file_week(sinex_file.name)
+        # the archives hold igs22P2237.snx.Z and IGS0OPSSNX_..._SOL.SNX.gz
+        remote_name = sinex_file.name + ('.gz' if gpsweek >= 2238 else '.Z')
+        jobs.append((join_url(base_url, f"{gpsweek}/{remote_name}"), Path(sinex_root_path, remote_name)))
+    
+    with Fetcher(n_jobs=n_jobs) as fetcher:
+        for result in fetcher.fetch_many(jobs):
+            if result['status'] == 'failed':
+                print(f"Warning: download of {result['url']} failed ({result['error']})\n")
+            else:
+                print(f"{result['path']}: {result['status']} ({result['bytes']} bytes)\n")
 
 
 def get_4sys_site_from_igs_metadata(igs_filename:str,
@@ -27,30 +54,10 @@ def get_4sys_site_from_igs_metadata(igs_filename:str,
     """
     support four systems
     """
-    with open(igs_filename, 'r') as inp:
-        alldata = inp.readlines()
-
-    igs_site_name_4s = []
-
-    for line in alldata:
-        oneline = line.split(',')
-        if oneline[0].startswith('#'):
-            continue
-        else:
-            sat_system = oneline[8].split('+')
-            if 'GPS' in sat_system and 'GLO' in sat_system and 'GAL' in sat_system and 'BDS' in sat_system:
-                # rec_data_datestr = oneline[12]
-                # # 日期格式: yyyy-mm-dd/yyyy-mm-ddThh:mmZ
-                # rec_data_year = int(rec_data_datestr[0:4])
-                # rec_data_month = int(rec_data_datestr[5:7])
-                # rec_data_day = int(rec_data_datestr[8:10])
-                # rec_data_year, rec_data_doy = doy_ymd(rec_data_year,rec_data_month,rec_data_day)
-                # rec_data_mjd = doy_mjd(rec_data_year, rec_data_doy)
-                # mjd = doy_mjd(year,doy_start)
-                # if rec_data_mjd < mjd:
-                #     # 接收到数据的日期早于分析时段
-                #     igs_site_name_4s.append(oneline[0][0:4].upper())
-                igs_site_name_4s.append(oneline[0][0:4].upper())
+    from igs_metadata import load_igs_metadata, query_metadata, FOUR_SYSTEMS
+    
+    meta = load_igs_metadata(igs_filename)
+    igs_site_name_4s = query_metadata(meta, systems=FOUR_SYSTEMS).index.tolist()
 
     return igs_site_name_4s
 
@@ -61,9 +68,10 @@ def generate_sinex_week_file_list(sinex_root_path:str, year:int, doy_start:int,
     """
     sinex_file_list = []
 
-    for doy in range(doy_start, doy_end+1):
-        mjd = doy_mjd(year, doy)
-        gpsweek, gpsdow = mjd_gpswk(mjd)
+    # one weekly solution per GPS week of the period
+    first_week, _ = mjd_gpswk(doy_mjd(year, doy_start))
+    last_week, _ = mjd_gpswk(doy_mjd(year, doy_end))
+    for gpsweek in range(first_week, last_week+1):
         used_mjd = mjd_gpswk(gpsweek, 0)
         used_year, used_doy = doy_mjd(used_mjd)
         if gpsweek >= 2238:
@@ -81,102 +89,121 @@ def delete_site_not_in_sinex(init_site_list:list[str], sinex_file_list:list[Path
     """
     If the precise coordinates of the station exist in all sinex 
     weekly solution files, return the 4-system station name.
+    Every sinex file is read once into the set of its site codes
+    with STAX/STAY/STAZ estimates, the sets are intersected.
     """
+    import logging
+    from sinex import read_sinex_sites
+    
+    logger = logging.getLogger(__name__)
     site_list = init_site_list.copy()
-    i_len = len(sinex_file_list)
     
-    sites_to_remove = []
-    for site in site_list:
-        site_found_in_all_files = True
-        for i, sinex_file in enumerate(sinex_file_list):
-            # print(f"Finding {site} in {i+1}/{i_len} sinex_file: {sinex_file}\n")
-            try:
-                with open(sinex_file, 'r') as inp:
-                    all_data = inp.readlines()
-            except FileNotFoundError:
-                print(f"Warning: SINEX file {sinex_file} not found\n")
-                site_found_in_all_files = False
-                break
-            
-            # SOLUTION/ESTIMATE start and end indices
-            s_index, e_index = None, None
-            for index, line in enumerate(all_data):
-                if line.startswith('+SOLUTION/ESTIMATE'):
-                    s_index = index + 2  
-                if line.startswith('-SOLUTION/ESTIMATE'):
-                    e_index = index
-                    break
-            
-            site_found = False
-            if s_index is not None and e_index is not None:
-                for line in all_data[s_index:e_index]:
-                    if 'STAX' and site.upper() in line:
-                        site_found = True
-                        break
-            
-            if site_found:
-                continue
+    for sinex_file in sinex_file_list:
+        try:
+            sinex_sites = read_sinex_sites(sinex_file)
+        except FileNotFoundError:
+            print(f"Warning: SINEX file {sinex_file} not found\n")
+            sinex_sites = set()
+        
+        kept_sites = []
+        for site in site_list:
+            if site.upper() in sinex_sites:
+                kept_sites.append(site)
             else:
                 # The site was not found in the current file 
                 # and is marked as not present in all files.
-                print(f"{site} is not in {sinex_file}, will be removed\n")
-                site_found_in_all_files = False
-                break
-        
-        # If the site is not present in all files, mark it as deleted.
-        if not site_found_in_all_files:
-            sites_to_remove.append(site)
-    
-    # Delete the marked site
-    for site in sites_to_remove:
-        site_list.remove(site)
+                logger.info("%s is not in %s, will be removed", site, sinex_file)
+        if len(kept_sites) < len(site_list):
+            print(f"{len(site_list) - len(kept_sites)} sites are not in {sinex_file}, removed\n")
+        site_list = kept_sites
     
     return site_list
 
-def write_clock_type(site_list: list[str], out_file_path:str):
+def write_clock_type(site_list: list[str], out_file_path:str, igs_filename:str='IGSNetwork.csv'):
     """
     Write the type of hydrogen atomic clock of the 
     selected observation stations into the file.
     """
-    h_clk_flag = ['H-MASER','H_MASER','H2 MASER','HYDROGEN','UTC(','VCH-1008','EXTERNAL IMASER 3000','EXTERNAL MASER']
-    with open('IGSNetwork.csv','r') as inp:
-        lines = inp.readlines()
+    from igs_metadata import load_igs_metadata, hydrogen_clock_mask
+    
+    meta = load_igs_metadata(igs_filename)
+    h_clk_sites = meta[hydrogen_clock_mask(meta)]
     
     with open(out_file_path, 'w') as outp:
         for site in site_list:
-            for line in lines:
-                if site.upper() == line.split(',')[0][0:4].upper():
-                    clock_type = line.split(',')[21].upper()
-                    if any(flag in clock_type for flag in h_clk_flag):
-                        outp.write(site.upper()+'  '+clock_type+'\n')
-
-
-def this_file_main(bindir:str, sinex_root_path:str, year:int, doy_start:int, doy_end:int, out_file_path:str):
-    download_metadata(bindir)
-    site_list = get_4sys_site_from_igs_metadata('IGSNetwork.csv',year,doy_start)
-    sinex_file_list = generate_sinex_week_file_list(sinex_root_path, year, doy_start, doy_end)
-    site_list = delete_site_not_in_sinex(site_list, sinex_file_list)
+            if site.upper() in h_clk_sites.index:
+                outp.write(site.upper()+'  '+h_clk_sites.at[site.upper(), 'clock']+'\n')
+
+
+def initial_site_list(sinex_root_path:str, year:int, doy_start:int, doy_end:int,
+                      sinex_index_file:str=None, igs_filename:str='IGSNetwork.csv') -> list[str]:
+    """
+    The four-system stations of IGSNetwork.csv with coordinates in all the sinex
+    weekly solutions of the period (the initial station list S1), in memory
+    - sinex_index_file: see this_file_main
+    """
+    with metrics.timer('site_list'):
+        site_list = get_4sys_site_from_igs_metadata(igs_filename,year,doy_start)
+        if sinex_index_file is not None:
+            from sinex_index import SinexPresenceIndex
+            sinex_index = SinexPresenceIndex(sinex_root_path, sinex_index_file)
+            sinex_index.update()
+            site_list = sinex_index.filter_sites(site_list, year, doy_start, doy_end)
+        else:
+            sinex_file_list = generate_sinex_week_file_list(sinex_root_path, year, doy_start, doy_end)
+            site_list = delete_site_not_in_sinex(site_list, sinex_file_list)
+    return site_list
+
+def this_file_main(sinex_root_path:str, year:int, doy_start:int, doy_end:int, out_file_path:str,
+                   sinex_index_file:str=None, igs_filename:str='IGSNetwork.csv',
+                   metadata_url:str=None, sinex_base_url:str=None, download:bool=True):
+    """
+    - sinex_index_file: if given, the sites are checked against a persistent index
+      of the whole sinex archive (see sinex_index), updated with the new files first
+    - igs_filename: path of IGSNetwork.csv, downloaded to the current directory by default
+    - metadata_url: URL of IGSNetwork.csv (default: files.igs.org), may be a file:// URL or a local mirror
+    - sinex_base_url: if given, the sinex weekly solutions of the period are downloaded from it first
+    - download: False to use the files already downloaded (IGSNetwork.csv and sinex files)
+    """
+    if download:
+        download_metadata(igs_filename, metadata_url)
+    if download and sinex_base_url is not None:
+        download_sinex_products(sinex_root_path, year, doy_start, doy_end, sinex_base_url)
+    site_list = initial_site_list(sinex_root_path, year, doy_start, doy_end,
+                                  sinex_index_file=sinex_index_file, igs_filename=igs_filename)
     
     from site_list import write_site_list
     write_site_list(site_list, out_file_path)
-    write_clock_type(site_list,out_file_path+'_CLKTYPE')
+    write_clock_type(site_list,out_file_path+'_CLKTYPE',igs_filename)
 
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser()
 
-    parser.add_argument('--bindir', help='The path of wget binary file')
+    parser.add_argument('--metadata_url', help='URL of IGSNetwork.csv (default: files.igs.org)')
+    parser.add_argument('--sinex_base_url', help='Download the sinex weekly solutions from {sinex_base_url}/{gpsweek}/ first')
     parser.add_argument('--sinex_root_path', help='Root directory of sinex weekly solution files')
     parser.add_argument('--year', type=int, help='year')
     parser.add_argument('--doy_start', type=int, help='start of DOY')
     parser.add_argument('--doy_end', type=int, help='end of DOY')
     parser.add_argument('--out_file_path', help='the full output path of the site list file')
+    parser.add_argument('--igs_filename', default='IGSNetwork.csv', help='path of IGSNetwork.csv')
+    parser.add_argument('--sinex_index_file', help='persistent index of the sinex archive (default: scan the sinex files of the period)')
+    # kept so that the existing command lines still work, the downloads no longer use wget
+    parser.add_argument('--bindir', help='Deprecated and ignored (path of the wget binary)')
+    metrics.add_cli_arguments(parser)
     # ===========================
 
     args = parser.parse_args()
-    this_file_main(bindir=args.bindir, 
-                   sinex_root_path=args.sinex_root_path, 
-                   year=args.year, doy_start=args.doy_start, doy_end=args.doy_end, 
-                   out_file_path=args.out_file_path)
+    if args.bindir is not None:
+        print("Warning: --bindir is deprecated and ignored, the files are downloaded without wget")
+    with metrics.cli_session(args, 'gene_initial_4sys_sitelist'):
+        this_file_main(sinex_root_path=args.sinex_root_path, 
+                       year=args.year, doy_start=args.doy_start, doy_end=args.doy_end, 
+                       out_file_path=args.out_file_path,
+                       sinex_index_file=args.sinex_index_file,
+                       igs_filename=args.igs_filename,
+                       metadata_url=args.metadata_url,
+                       sinex_base_url=args.sinex_base_url)
 
 
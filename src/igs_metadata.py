@@ -0,0 +1,177 @@
+'''
+Station metadata of IGSNetwork.csv (https://files.igs.org/pub/station/general/IGSNetwork.csv)
+
+The CSV is parsed once into a table indexed by the 4-char site ID and cached
+on disk next to it; the cache is rebuilt when the modification time or the
+size of the CSV changes. The filters work on whole columns.
+'''
+from __future__ import annotations
+import os
+import pickle
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    import pandas as pd
+
+METADATA_VERSION = 2
+
+# bit of every constellation in the sat_mask column
+SYSTEM_BITS = {'GPS': 1, 'GLO': 2, 'GAL': 4, 'BDS': 8, 'QZSS': 16, 'SBAS': 32, 'IRNSS': 64}
+FOUR_SYSTEMS = ('GPS', 'GLO', 'GAL', 'BDS')
+
+# clock types of the hydrogen atomic clocks
+H_CLOCK_FLAGS = ['H-MASER', 'H_MASER', 'H2 MASER', 'HYDROGEN', 'UTC(', 'VCH-1008', 'EXTERNAL IMASER 3000', 'EXTERNAL MASER']
+
+# column: (names in the CSV header, lower case without separators; position in a CSV without header)
+# the header of IGSNetwork.csv: #StationName,X,Y,Z,Latitude,Longitude,Height,ReceiverName,
+# ReceiverSatelliteSystem,ReceiverSerialNumber,ReceiverFirmwareVersion,ReceiverElevationCutoff,
+# ReceiverDateInstalled,AntennaName,...
+COLUMNS = {
+    'station_name': (['stationname', 'station', 'name'], 0),
+    'x': (['x'], 1),
+    'y': (['y'], 2),
+    'z': (['z'], 3),
+    'sat_system': (['receiversatellitesystem', 'satellitesystem', 'satellitesystems'], 8),
+    'receiver': (['receivername', 'receivertype', 'receiver'], 7),
+    'date_installed': (['receiverdateinstalled', 'dateinstalled'], 12),
+    'antenna': (['antennaname', 'antennatype', 'antenna'], 13),
+    'clock': (['frequencystandardtype', 'frequencystandard', 'clocktype', 'clock', 'externalclock'], 21),
+}
+
+
+def systems_mask(systems) -> int:
+    """
+    Bitmask of constellation names, e.g. ('GPS', 'GAL') -> 5
+    """
+    mask = 0
+    for system in systems:
+        mask |= SYSTEM_BITS[system.upper()]
+    return mask
+
+def _normalize(name: str) -> str:
+    return ''.join(ch for ch in name.lower() if ch.isalnum())
+
+def parse_igs_metadata(igs_filename: str) -> pd.DataFrame:
+    """
+    Parse IGSNetwork.csv
+
+    Returns:
+    - pandas DataFrame indexed by site_id (4-char, upper case, first row of a site kept) with
+      station_name, x, y, z (float64), sat_mask (uint8, see SYSTEM_BITS), receiver, antenna,
+      clock (upper case, blanks collapsed) and date_installed (datetime64, NaT if unknown)
+    A header without one of the COLUMNS raises ValueError; a file without header is read by position.
+    """
+    import numpy as np
+    import pandas as pd
+
+    with open(igs_filename, 'r', errors='replace') as inp:
+        has_header = inp.readline().startswith('#')
+    raw = pd.read_csv(igs_filename, dtype=str, keep_default_na=False, skipinitialspace=True,
+                      header=0 if has_header else None)
+    header = [_normalize(str(name)) for name in raw.columns] if has_header else []
+
+    columns = {}
+    for column, (names, position) in COLUMNS.items():
+        if has_header:
+            matched = [header.index(name) for name in names if name in header]
+            if not matched:
+                raise ValueError(f"{igs_filename}: no {column} column in the header "
+                                 f"(expected one of {', '.join(names)})")
+            index = matched[0]
+        else:
+            index = position
+        columns[column] = raw.iloc[:, index] if index < raw.shape[1] else pd.Series('', index=raw.index)
+
+    station_name = columns['station_name'].str.strip()
+    sat_system = columns['sat_system'].str.upper().str.replace(' ', '', regex=False)
+    sat_mask = np.zeros(len(raw), dtype=np.uint8)
+    for system, bit in SYSTEM_BITS.items():
+        # exact names between the '+' separators
+        sat_mask[('+' + sat_system + '+').str.contains(f'+{system}+', regex=False).to_numpy()] |= bit
+
+    meta = pd.DataFrame({
+        'site_id': station_name.str[0:4].str.upper(),
+        'station_name': station_name,
+        'x': pd.to_numeric(columns['x'], errors='coerce'),
+        'y': pd.to_numeric(columns['y'], errors='coerce'),
+        'z': pd.to_numeric(columns['z'], errors='coerce'),
+        'sat_mask': sat_mask,
+        'receiver': columns['receiver'].str.strip().str.upper(),
+        'antenna': columns['antenna'].str.strip().str.upper(),
+        'clock': columns['clock'].str.upper().str.split().str.join(' '),
+        'date_installed': pd.to_datetime(columns['date_installed'].str[0:10], format='%Y-%m-%d', errors='coerce'),
+    })
+    meta = meta[~station_name.str.startswith('#') & (station_name != '')]
+    meta = meta.drop_duplicates('site_id').set_index('site_id')
+    return meta
+
+def load_igs_metadata(igs_filename: str = 'IGSNetwork.csv', cache_file: str = None) -> pd.DataFrame:
+    """
+    Metadata table of IGSNetwork.csv (see parse_igs_metadata), from the disk cache if it is up to date
+
+    Parameters:
+    - igs_filename: path of IGSNetwork.csv
+    - cache_file: path of the cache (default: igs_filename + '.pkl'; False: no disk cache)
+    """
+    if cache_file is False:
+        return parse_igs_metadata(igs_filename)
+    if cache_file is None:
+        cache_file = f"{igs_filename}.pkl"
+
+    stat = os.stat(igs_filename)
+    signature = (METADATA_VERSION, stat.st_mtime_ns, stat.st_size)
+    try:
+        with open(cache_file, 'rb') as inp:
+            cached_signature, meta = pickle.load(inp)
+        if cached_signature == signature:
+            return meta
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError, AttributeError, ImportError):
+        pass
+
+    meta = parse_igs_metadata(igs_filename)
+    tmp_file = f"{cache_file}.tmp{os.getpid()}"
+    try:
+        with open(tmp_file, 'wb') as outp:
+            pickle.dump((signature, meta), outp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        # read-only location: work without the disk cache
+        print(f"Warning: cannot write the metadata cache {cache_file}")
+    return meta
+
+def query_metadata(meta: pd.DataFrame, systems=None, hydrogen_clock: bool = False,
+                   receiver: str = None, installed_before=None) -> pd.DataFrame:
+    """
+    Stations of the metadata table that pass all the given filters
+
+    Parameters:
+    - meta: table of load_igs_metadata
+    - systems: constellations the station must all track, e.g. FOUR_SYSTEMS (None: no filter)
+    - hydrogen_clock: keep only the stations with a hydrogen atomic clock (H_CLOCK_FLAGS)
+    - receiver: substring of the receiver type, case insensitive (None: no filter)
+    - installed_before: date (str or datetime), keep the stations installed before it (None: no filter)
+    """
+    import numpy as np
+    import pandas as pd
+
+    keep = np.ones(len(meta), dtype=bool)
+    if systems is not None:
+        need = systems_mask(systems)
+        keep &= (meta['sat_mask'].to_numpy() & need) == need
+    if hydrogen_clock:
+        keep &= hydrogen_clock_mask(meta)
+    if receiver is not None:
+        keep &= meta['receiver'].str.contains(receiver.upper(), regex=False).to_numpy()
+    if installed_before is not None:
+        keep &= (meta['date_installed'] < pd.Timestamp(installed_before)).to_numpy()
+    return meta[keep]
+
+def hydrogen_clock_mask(meta: pd.DataFrame):
+    """
+    Boolean array, True for the stations with a hydrogen atomic clock
+    """
+    import numpy as np
+
+    keep = np.zeros(len(meta), dtype=bool)
+    for flag in H_CLOCK_FLAGS:
+        keep |= meta['clock'].str.contains(flag, regex=False).to_numpy()
+    return keep
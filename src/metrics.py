@@ -0,0 +1,280 @@
+'''
+Lightweight instrumentation of the stages: timers, counters and profiling
+
+    import metrics
+    with metrics.timer('extract_qc'):
+        ...
+    metrics.count('files_opened')
+    metrics.count('bytes_read', os.path.getsize(path))
+
+The timers and counters of the process are kept in one thread-safe registry and
+exported as JSON or in the Prometheus text format (for the textfile collector of
+the node exporter). The command line tools get the options of add_cli_arguments:
+--log_level, --metrics_file, --prometheus_file and --profile (cProfile and
+tracemalloc report of the whole run, worker threads included).
+
+Counters used by the modules:
+- files_opened: anubis results, RINEX headers and SINEX files read
+- bytes_read: bytes of the anubis results and RINEX headers read (the SINEX files are streamed)
+- stations_parsed: stations read from the anubis results and the RINEX headers
+- sinex_estimates: coordinate estimates read from the SINEX files
+- qc_stations_penalized: stations without usable anubis results
+- kmeans_runs, kmeans_iterations: spherical K-means runs and their Lloyd iterations
+- selection_cache_hits: fits restored from the selection cache
+- bytes_downloaded, files_downloaded: transfers of the fetcher
+- anubis_runs: anubis executions
+'''
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+PROMETHEUS_PREFIX = 'gnss_station_selector'
+
+
+class MetricsRegistry:
+    """
+    Counters (name -> value) and timers (name -> number of runs, total and maximum seconds)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.timers = {}
+        self.started = time.time()
+
+    def count(self, name: str, value: float = 1) -> None:
+        """
+        Add value to the counter name
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float) -> None:
+        """
+        Record one run of the timer name
+        """
+        with self._lock:
+            runs, total, maximum = self.timers.get(name, (0, 0.0, 0.0))
+            self.timers[name] = (runs + 1, total + seconds, max(maximum, seconds))
+
+    @contextmanager
+    def timer(self, name: str):
+        """
+        Time the block as one run of the timer name (also when it raises)
+        """
+        t_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t_start)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters = {}
+            self.timers = {}
+            self.started = time.time()
+
+    def snapshot(self) -> dict:
+        """
+        Copy of the metrics: {'started', 'counters', 'timers': {name: {'runs', 'seconds', 'max_seconds'}}}
+        """
+        with self._lock:
+            return {
+                'started': self.started,
+                'counters': dict(self.counters),
+                'timers': {name: {'runs': runs, 'seconds': total, 'max_seconds': maximum}
+                           for name, (runs, total, maximum) in self.timers.items()},
+            }
+
+    def to_prometheus(self, prefix: str = PROMETHEUS_PREFIX, labels: dict = None) -> str:
+        """
+        The metrics in the Prometheus text exposition format
+        """
+        snapshot = self.snapshot()
+        base_labels = ''.join(f',{key}="{value}"' for key, value in (labels or {}).items())
+        lines = []
+        for name, value in sorted(snapshot['counters'].items()):
+            metric = f"{prefix}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{{{base_labels[1:]}}} {value}" if base_labels else f"{metric} {value}")
+        timer_metrics = [
+            ('stage_runs_total', 'counter', 'Number of runs of the stage', 'runs'),
+            ('stage_seconds_total', 'counter', 'Wall time spent in the stage', 'seconds'),
+            ('stage_seconds_max', 'gauge', 'Longest run of the stage', 'max_seconds'),
+        ]
+        if snapshot['timers']:
+            for suffix, metric_type, help_text, key in timer_metrics:
+                metric = f"{prefix}_{suffix}"
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} {metric_type}")
+                for name, timer in sorted(snapshot['timers'].items()):
+                    lines.append(f'{metric}{{stage="{name}"{base_labels}}} {timer[key]}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+def count(name: str, value: float = 1) -> None:
+    """
+    Add value to the counter name of the process registry
+    """
+    REGISTRY.count(name, value)
+
+def observe(name: str, seconds: float) -> None:
+    """
+    Record one run of the timer name in the process registry
+    """
+    REGISTRY.observe(name, seconds)
+
+def timer(name: str):
+    """
+    Context manager timing a block as one run of name in the process registry
+    """
+    return REGISTRY.timer(name)
+
+def timed(name: str):
+    """
+    Decorator timing every call of a function as one run of name
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with REGISTRY.timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def snapshot() -> dict:
+    return REGISTRY.snapshot()
+
+def reset() -> None:
+    REGISTRY.reset()
+
+def _write_atomic(path: str, text: str) -> None:
+    # the textfile collector must never see a partial file
+    tmp_file = f"{path}.tmp{os.getpid()}"
+    with open(tmp_file, 'w') as outp:
+        outp.write(text)
+    os.replace(tmp_file, path)
+
+def write_json(path: str) -> None:
+    """
+    Write the metrics of the process registry to a JSON file
+    """
+    import json
+
+    _write_atomic(path, json.dumps(REGISTRY.snapshot(), indent=2))
+
+def write_prometheus(path: str, labels: dict = None) -> None:
+    """
+    Write the metrics of the process registry in the Prometheus text format,
+    e.g. into the directory of the node exporter textfile collector (file name *.prom)
+    """
+    _write_atomic(path, REGISTRY.to_prometheus(labels=labels))
+
+
+@contextmanager
+def profile(report_file: str, top: int = 40):
+    """
+    Run the block under cProfile and tracemalloc and write a text report:
+    the functions with the largest cumulative time, the lines allocating
+    the most memory, and the peak of the traced memory.
+    The threads started in the block (e.g. the stage workers of pipeline.py) are
+    profiled too and their calls are merged into the report.
+    """
+    import cProfile
+    import io
+    import pstats
+    import sys
+    import tracemalloc
+
+    profiler = cProfile.Profile()
+    profilers = [profiler]
+    # before 3.12 a profiler sees the calls of the thread that enabled it only:
+    # every new thread enables its own profiler on its first call
+    per_thread = sys.version_info < (3, 12)
+    lock = threading.Lock()
+
+    def profile_thread(frame, event, arg):
+        thread_profiler = cProfile.Profile()
+        with lock:
+            profilers.append(thread_profiler)
+        # replaces this hook for the thread
+        thread_profiler.enable()
+
+    tracemalloc.start()
+    t_start = time.perf_counter()
+    if per_thread:
+        threading.setprofile(profile_thread)
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        if per_thread:
+            threading.setprofile(None)
+            with lock:
+                for thread_profiler in profilers[1:]:
+                    thread_profiler.disable()
+        seconds = time.perf_counter() - t_start
+        memory_snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        stream = io.StringIO()
+        stream.write(f"Wall time: {seconds:.3f} s\n")
+        stream.write(f"Peak traced memory: {peak / 1e6:.1f} MB\n")
+        stream.write(f"Profiled threads: {len(profilers)}\n\n")
+        stream.write(f"=== Top {top} functions by cumulative time ===\n")
+        stats = pstats.Stats(profiler, stream=stream)
+        for thread_profiler in profilers[1:]:
+            thread_profiler.create_stats()
+            if thread_profiler.stats:
+                stats.add(thread_profiler)
+        stats.sort_stats('cumulative').print_stats(top)
+        stream.write(f"=== Top {top} allocations by line ===\n")
+        for stat in memory_snapshot.statistics('lineno')[:top]:
+            stream.write(f"{stat}\n")
+        with open(report_file, 'w') as outp:
+            outp.write(stream.getvalue())
+        print(f"The profile report has been saved to: {report_file}")
+
+
+def add_cli_arguments(parser) -> None:
+    """
+    Add the logging, metrics and profiling options to an argparse parser
+    """
+    parser.add_argument('--log_level', default='WARNING',
+                        help='Logging level: DEBUG, INFO (per-station messages), WARNING')
+    parser.add_argument('--metrics_file', help='Write the timers and counters of the run to this JSON file')
+    parser.add_argument('--prometheus_file', help='Write the timers and counters in the Prometheus text format to this file')
+    parser.add_argument('--profile', help='Profile the run with cProfile and tracemalloc, the report is written to this file')
+
+@contextmanager
+def cli_session(args, job: str):
+    """
+    Set up logging, profile the block if args.profile is set and write the metrics
+    of args.metrics_file / args.prometheus_file at the end
+    - job: name of the tool, the label of the Prometheus metrics
+    """
+    # json and logging are imported on use, which keeps the start-up of the command line tools short
+    import logging
+
+    logging.basicConfig(level=getattr(logging, str(args.log_level).upper(), logging.WARNING),
+                        format='%(levelname)s %(name)s: %(message)s')
+    try:
+        if args.profile:
+            with profile(args.profile):
+                with timer(job):
+                    yield
+        else:
+            with timer(job):
+                yield
+    finally:
+        if args.metrics_file:
+            write_json(args.metrics_file)
+        if args.prometheus_file:
+            write_prometheus(args.prometheus_file, labels={'job': job})
@@ -0,0 +1,404 @@
+'''
+End-to-end station selection: the steps of the README as one DAG of stages
+
+    download -> site_list -> [fetch_obs_{doy}] -> anubis_{doy} -> station_eval -> choose_sta
+
+Every stage declares its input files, its parameters and its code (source modules).
+Their fingerprint is kept in f"{work_root_path}/pipeline_state.json" after a successful run,
+and a stage whose fingerprint is unchanged and whose outputs exist is skipped:
+a rerun with another chosen_num executes only choose_sta.
+Independent stages (the anubis runs of the days) run concurrently.
+The file contents are hashed once and memoised by size and modification time.
+'''
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+import metrics
+
+STATE_VERSION = 1
+
+SRC_PATH = Path(__file__).resolve().parent
+
+
+class Stage:
+    """
+    One step of the pipeline
+    """
+
+    def __init__(self, name: str, run, inputs=(), outputs=(), params: dict = None,
+                 code=(), deps=(), always: bool = False):
+        """
+        Parameters:
+        - name: unique name of the stage
+        - run: function without arguments executing the stage
+        - inputs: input files, or a function returning them (called once the dependencies are done);
+          directories stand for all the files below them
+        - outputs: files or directories written by the stage
+        - params: parameters of the stage (their repr is fingerprinted)
+        - code: modules of src whose source is fingerprinted
+        - deps: names of the stages that must be done first
+        - always: run at every time; for the stages that are incremental by themselves (downloads)
+        """
+        self.name = name
+        self.run = run
+        self.inputs = inputs
+        self.outputs = [Path(output) for output in outputs]
+        self.params = params or {}
+        self.code = list(code)
+        self.deps = list(deps)
+        self.always = always
+
+    def input_files(self) -> list[Path]:
+        inputs = self.inputs() if callable(self.inputs) else self.inputs
+        files = []
+        for path in map(Path, inputs):
+            if path.is_dir():
+                files.extend(sorted(p for p in path.rglob('*') if p.is_file()))
+            else:
+                files.append(path)
+        return files
+
+    def outputs_exist(self) -> bool:
+        for output in self.outputs:
+            if not output.exists() or (output.is_dir() and not any(output.iterdir())):
+                return False
+        return True
+
+
+class Pipeline:
+    """
+    Runs the stages in the order of their dependencies, skipping the current ones.
+    run() returns the status of every stage: 'ran', 'skipped', 'failed' or 'blocked' (a dependency failed).
+    """
+
+    def __init__(self, stages: list[Stage], state_file: str, n_jobs: int = 4):
+        """
+        Parameters:
+        - stages: the stages, names unique, dependencies among them
+        - state_file: JSON file of the fingerprints of the stages and of the hashes of the files
+        - n_jobs: number of stages running at the same time
+        """
+        self.stages = {stage.name: stage for stage in stages}
+        for stage in stages:
+            unknown = [dep for dep in stage.deps if dep not in self.stages]
+            if unknown:
+                raise ValueError(f"stage {stage.name}: unknown dependencies {unknown}")
+        self.state_file = state_file
+        self.n_jobs = n_jobs
+        self._lock = threading.Lock()
+        self.state = self._load()
+
+    def _load(self) -> dict:
+        empty = {'version': STATE_VERSION, 'stages': {}, 'files': {}}
+        try:
+            with open(self.state_file, 'r') as inp:
+                state = json.load(inp)
+        except (OSError, ValueError):
+            return empty
+        return state if state.get('version') == STATE_VERSION else empty
+
+    def _save(self) -> None:
+        with self._lock:
+            tmp_file = f"{self.state_file}.tmp{os.getpid()}"
+            with open(tmp_file, 'w') as outp:
+                json.dump(self.state, outp)
+            os.replace(tmp_file, self.state_file)
+
+    def file_hash(self, path: Path) -> str:
+        """
+        Content hash of a file, memoised by its size and modification time ('missing' if it does not exist)
+        """
+        from fetcher import file_sha256
+
+        try:
+            stat = path.stat()
+        except OSError:
+            return 'missing'
+        key = str(path.resolve())
+        with self._lock:
+            entry = self.state['files'].get(key)
+        if entry is not None and entry[0:2] == [stat.st_size, stat.st_mtime_ns]:
+            return entry[2]
+        digest = file_sha256(path)
+        with self._lock:
+            self.state['files'][key] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def fingerprint(self, stage: Stage) -> str:
+        """
+        Hash of the code, parameters and input file contents of a stage
+        """
+        from selection_cache import hash_content
+
+        code = [self.file_hash(SRC_PATH / f"{module}.py") for module in stage.code]
+        params = sorted((key, repr(value)) for key, value in stage.params.items())
+        files = [(str(path), self.file_hash(path)) for path in stage.input_files()]
+        return hash_content(stage.name, code, params, files)
+
+    def is_current(self, stage: Stage) -> bool:
+        """
+        The stage ran successfully with the same fingerprint and its outputs exist
+        """
+        if stage.always:
+            return False
+        return (self.state['stages'].get(stage.name) == self.fingerprint(stage)
+                and stage.outputs_exist())
+
+    def _run_stage(self, stage: Stage, force: bool) -> str:
+        try:
+            if not force and self.is_current(stage):
+                print(f"[{stage.name}] up to date, skipped")
+                return 'skipped'
+            print(f"[{stage.name}] running")
+            t_start = time.perf_counter()
+            with metrics.timer(f"pipeline_{stage.name}"):
+                stage.run()
+            if not stage.always:
+                # the outputs may be inputs of the fingerprint (hashed after the run)
+                fingerprint = self.fingerprint(stage)
+                with self._lock:
+                    self.state['stages'][stage.name] = fingerprint
+            self._save()
+            print(f"[{stage.name}] done in {time.perf_counter() - t_start:.1f} s")
+            return 'ran'
+        except Exception:
+            print(f"[{stage.name}] failed:\n{traceback.format_exc()}")
+            with self._lock:
+                self.state['stages'].pop(stage.name, None)
+            self._save()
+            return 'failed'
+
+    def run(self, force=(), dry_run: bool = False) -> dict:
+        """
+        Run the pipeline
+
+        Parameters:
+        - force: names of the stages to run even if they are current ('all' for every stage)
+        - dry_run: only report which stages are current, nothing is run (the stages whose
+          inputs are produced by others are judged on the files present now)
+        """
+        force = set(self.stages) if force == 'all' or 'all' in force else set(force)
+        if dry_run:
+            status = {}
+            for name, stage in self.stages.items():
+                current = name not in force and self.is_current(stage)
+                status[name] = 'current' if current else 'to run'
+                print(f"[{name}] {status[name]}")
+            return status
+
+        status = {}
+        pending = dict(self.stages)
+        running = {}
+        with ThreadPoolExecutor(max_workers=max(1, self.n_jobs)) as executor:
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    dep_status = [status.get(dep) for dep in stage.deps]
+                    if any(s in ('failed', 'blocked') for s in dep_status):
+                        print(f"[{name}] blocked by a failed dependency")
+                        status[name] = 'blocked'
+                        del pending[name]
+                    elif all(s in ('ran', 'skipped') for s in dep_status):
+                        # the outputs of the dependencies are fingerprinted as inputs of the stage
+                        running[executor.submit(self._run_stage, stage, name in force)] = name
+                        del pending[name]
+                if not running:
+                    if not pending:
+                        break
+                    raise ValueError(f"dependency cycle among the stages {sorted(pending)}")
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    status[running.pop(future)] = future.result()
+        return status
+
+
+def build_stages(year: int, doy_start: int, doy_end: int, work_root_path: str, data_root_path: str,
+                 out_path: str, xml_file: str, anubis_bin: str, chosen_num: int,
+                 quality_threshold: float = 0.8, selection_method: str = 'kmeans',
+                 url_template: str = None, metadata_url: str = None, sinex_base_url: str = None,
+                 fetch_jobs: int = 8) -> list[Stage]:
+    """
+    The stages of the station selection of a period, with the directory layout of the README:
+    the site list, IGSNetwork.csv, the score files and the coordinate cache are kept in work_root_path
+    - fetch_jobs: number of parallel downloads of the fetch_obs stages
+    """
+    from anibus_ana import gene_rinex_code
+    from sinex import resolve_sinex_file
+
+    work_root = Path(work_root_path)
+    igs_filename = work_root / 'IGSNetwork.csv'
+    sinex_root_path = Path(data_root_path, 'snx')
+    site_list_file = work_root / 'sitelst' / f"site_list_init_{year:04d}{doy_start:03d}"
+    eval_path = work_root / 'sta_eval'
+    rank_file = eval_path / f"sta_rank_evaluation_{year:04d}_{doy_start:03d}_{doy_end:03d}.csv"
+    name_tag = f"{chosen_num}_{year:04d}_{doy_start:03d}_{doy_end:03d}"
+    doys = range(doy_start, doy_end + 1)
+
+    def site_list():
+        from site_list import read_list
+        return read_list(site_list_file)
+
+    def sinex_files():
+        from gene_initial_4sys_sitelist import generate_sinex_week_file_list
+        # a missing file is fingerprinted as missing under its plain name
+        return [resolve_sinex_file(f) or f for f in generate_sinex_week_file_list(sinex_root_path, year, doy_start, doy_end)]
+
+    def obs_files(doy_list):
+        files = []
+        for site in site_list():
+            for doy in doy_list:
+                rinex_o_file, _ = gene_rinex_code(site, year, doy, data_root_path)
+                files.append(rinex_o_file)
+        return files
+
+    def nav_files(doy_list):
+        return [gene_rinex_code('brdm', year, doy, data_root_path)[1] for doy in doy_list]
+
+    def anubis_out_path(doy):
+        return work_root / f"work{year:04d}{doy:03d}" / 'anubis' / 'out'
+
+    def run_download():
+        from gene_initial_4sys_sitelist import download_metadata, download_sinex_products
+        os.makedirs(work_root, exist_ok=True)
+        download_metadata(str(igs_filename), metadata_url)
+        if sinex_base_url is not None:
+            download_sinex_products(str(sinex_root_path), year, doy_start, doy_end, sinex_base_url)
+
+    def run_site_list():
+        from gene_initial_4sys_sitelist import this_file_main
+        os.makedirs(site_list_file.parent, exist_ok=True)
+        this_file_main(str(sinex_root_path), year, doy_start, doy_end, str(site_list_file),
+                       igs_filename=str(igs_filename), download=False)
+
+    stages = [
+        Stage('download', run_download, outputs=[igs_filename], always=True),
+        Stage('site_list', run_site_list,
+              inputs=lambda: [igs_filename] + sinex_files(),
+              outputs=[site_list_file, f"{site_list_file}_CLKTYPE"],
+              params={'year': year, 'doy_start': doy_start, 'doy_end': doy_end},
+              code=['gene_initial_4sys_sitelist', 'igs_metadata', 'sinex', 'site_list', 'time_convert'],
+              deps=['download']),
+    ]
+
+    for doy in doys:
+        anubis_deps = ['site_list']
+        if url_template is not None:
+            def run_fetch(doy=doy):
+                from fetch_obs import prefetch_obs
+                prefetch_obs(site_list(), year, doy, doy, data_root_path, url_template, n_jobs=fetch_jobs)
+            stages.append(Stage(f"fetch_obs_{doy:03d}", run_fetch, deps=['site_list'], always=True))
+            anubis_deps.append(f"fetch_obs_{doy:03d}")
+
+        def run_anubis(doy=doy):
+            from anibus_ana import exec_anibus_multi_sites
+            exec_anibus_multi_sites(xml_file, anubis_bin, site_list(), year, doy, data_root_path, work_root_path)
+        stages.append(Stage(f"anubis_{doy:03d}", run_anubis,
+                            inputs=lambda doy=doy: [xml_file, site_list_file] + nav_files([doy]) + obs_files([doy]),
+                            outputs=[anubis_out_path(doy)],
+                            params={'anubis_bin': anubis_bin},
+                            code=['anibus_ana'],
+                            deps=anubis_deps))
+
+    def run_station_eval():
+        from station_eval import station_eval_main
+        station_eval_main(str(site_list_file), year, doy_start, doy_end, work_root_path, str(eval_path), 'M')
+
+    def run_choose_sta():
+        from choose_sta import choose_sta_main
+        choose_sta_main(chosen_num, year, doy_start, doy_end, work_root_path, data_root_path,
+                        str(site_list_file), out_path, quality_threshold,
+                        selection_method=selection_method,
+                        coord_cache_file=str(work_root / 'coord_cache.json'),
+                        igs_filename=str(igs_filename), rank_file=str(rank_file))
+
+    stages += [
+        Stage('station_eval', run_station_eval,
+              inputs=lambda: [site_list_file] + [anubis_out_path(doy) for doy in doys],
+              outputs=[rank_file],
+              code=['station_eval', 'extract_qc', 'site_list'],
+              deps=[f"anubis_{doy:03d}" for doy in doys]),
+        Stage('choose_sta', run_choose_sta,
+              # the coordinates come from the sinex files, IGSNetwork.csv and the RINEX headers
+              inputs=lambda: [rank_file, site_list_file, igs_filename] + sinex_files() + obs_files(doys),
+              outputs=[Path(out_path, f"selected_stations_{name_tag}.txt"),
+                       Path(out_path, f"selected_stations_coord_{name_tag}.txt")],
+              params={'chosen_num': chosen_num, 'quality_threshold': quality_threshold,
+                      'selection_method': selection_method},
+              code=['choose_sta', 'station_coord', 'sinex', 'site_list', 'igs_metadata', 'selection_cache'],
+              deps=['station_eval']),
+    ]
+    return stages
+
+def pipeline_main(year: int, doy_start: int, doy_end: int, work_root_path: str, data_root_path: str,
+                  out_path: str, xml_file: str, anubis_bin: str, chosen_num: int,
+                  quality_threshold: float = 0.8, selection_method: str = 'kmeans',
+                  url_template: str = None, metadata_url: str = None, sinex_base_url: str = None,
+                  n_jobs: int = 4, fetch_jobs: int = 8, force=(), dry_run: bool = False) -> dict:
+    """
+    Run the whole station selection of a period, skipping the stages that are current
+
+    Parameters:
+    - year, doy_start, doy_end: the period
+    - work_root_path, data_root_path: the directories of the README
+    - out_path: directory of the selected station lists
+    - xml_file, anubis_bin: anubis configuration template and executable
+    - chosen_num, quality_threshold, selection_method: see choose_sta
+    - url_template: if given, the observation files are downloaded first, see fetch_obs
+    - metadata_url, sinex_base_url: see gene_initial_4sys_sitelist
+    - n_jobs: number of stages running at the same time (e.g. anubis days)
+    - fetch_jobs: number of parallel downloads of the observation files of a day
+    - force: names of the stages to run even if they are current, 'all' for every stage
+    - dry_run: only report the stages to run
+
+    Returns:
+    - status of every stage
+    """
+    stages = build_stages(year, doy_start, doy_end, work_root_path, data_root_path, out_path,
+                          xml_file, anubis_bin, chosen_num, quality_threshold, selection_method,
+                          url_template, metadata_url, sinex_base_url, fetch_jobs=fetch_jobs)
+    os.makedirs(work_root_path, exist_ok=True)
+    pipeline = Pipeline(stages, str(Path(work_root_path, 'pipeline_state.json')), n_jobs=n_jobs)
+    status = pipeline.run(force=force, dry_run=dry_run)
+    print(' '.join(f"{name}: {s}" for name, s in status.items()))
+    return status
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--year', type=int, help='year')
+    parser.add_argument('--doy_start', type=int, help='start of DOY')
+    parser.add_argument('--doy_end', type=int, help='end of DOY')
+    parser.add_argument('--work_root_path', help='Working root directory path')
+    parser.add_argument('--data_root_path', help='Data root directory path')
+    parser.add_argument('--out_path', help='Output path of the selected station lists')
+    parser.add_argument('--xml_file', help='Anubis XML configuration template')
+    parser.add_argument('--anubis_bin', help='Path of the anubis executable program')
+    parser.add_argument('--chosen_num', type=int, help='The number of selected stations')
+    parser.add_argument('--quality_threshold', type=float, default=0.8, help='Minimum TOPSIS score of the candidates')
+    parser.add_argument('--selection_method', default='kmeans', help='Selection method, see choose_sta')
+    parser.add_argument('--url_template', help='Download the observation files first, see fetch_obs')
+    parser.add_argument('--metadata_url', help='URL of IGSNetwork.csv (default: files.igs.org)')
+    parser.add_argument('--sinex_base_url', help='Download the sinex weekly solutions from {sinex_base_url}/{gpsweek}/ first')
+    parser.add_argument('--n_jobs', type=int, default=4, help='Number of stages running at the same time')
+    parser.add_argument('--fetch_jobs', type=int, default=8, help='Number of parallel downloads of the observation files')
+    parser.add_argument('--force', default='', help='Comma separated stages to run even if current, or all')
+    parser.add_argument('--dry_run', action='store_true', help='Only report the stages to run')
+    metrics.add_cli_arguments(parser)
+    # ===========================
+
+    args = parser.parse_args()
+    with metrics.cli_session(args, 'pipeline'):
+        status = pipeline_main(args.year, args.doy_start, args.doy_end, args.work_root_path, args.data_root_path,
+                               args.out_path, args.xml_file, args.anubis_bin, args.chosen_num,
+                               args.quality_threshold, args.selection_method,
+                               args.url_template, args.metadata_url, args.sinex_base_url,
+                               n_jobs=args.n_jobs, fetch_jobs=args.fetch_jobs,
+                               force=[s for s in args.force.split(',') if s],
+                               dry_run=args.dry_run)
+    sys.exit(1 if any(s in ('failed', 'blocked') for s in status.values()) else 0)
@@ -0,0 +1,97 @@
+'''
+Content-addressed on-disk cache of station selection results
+'''
+import hashlib
+import os
+import pickle
+from pathlib import Path
+
+
+def hash_content(*parts) -> str:
+    """
+    SHA-256 hex digest of a sequence of parts (bytes, str, numbers or numpy arrays)
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        if hasattr(part, 'tobytes'):
+            # numpy arrays: the dtype and shape are part of the content
+            h.update(f"{part.dtype}{part.shape}".encode())
+            part = part.tobytes()
+        elif not isinstance(part, bytes):
+            part = repr(part).encode()
+        # length prefix, so that the boundaries between parts are unambiguous
+        h.update(len(part).to_bytes(8, 'little'))
+        h.update(part)
+    return h.hexdigest()
+
+
+class SelectionCache:
+    """
+    Size-bounded store of pickled results, one file per key.
+    The modification time of a file is its last use: hits refresh it and
+    the least recently used entries are evicted when the store is too big.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 256 * 1024 * 1024):
+        """
+        Parameters:
+        - cache_dir: directory of the cache files, created if missing
+        - max_bytes: maximum total size of the cache files
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.pkl"
+
+    def get(self, key: str):
+        """
+        Return the stored value of key, or None on a miss
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as inp:
+                value = pickle.load(inp)
+        except FileNotFoundError:
+            return None
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            # truncated or outdated entry: drop it
+            path.unlink(missing_ok=True)
+            return None
+
+        os.utime(path)
+        return value
+
+    def put(self, key: str, value) -> None:
+        """
+        Store value under key and evict the least recently used entries
+        """
+        path = self._path(key)
+        tmp_path = path.with_suffix(f".tmp{os.getpid()}")
+        with open(tmp_path, 'wb') as outp:
+            pickle.dump(value, outp, protocol=pickle.HIGHEST_PROTOCOL)
+        # atomic, concurrent invocations never see a partial entry
+        os.replace(tmp_path, path)
+        self.evict(keep=path)
+
+    def evict(self, keep: Path = None) -> None:
+        """
+        Remove the least recently used entries until the cache fits in max_bytes
+        """
+        entries = []
+        for path in self.cache_dir.glob('*.pkl'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
@@ -0,0 +1,211 @@
+'''
+Reading of the IGS weekly solution (SINEX) files
+
+The files may be plain, gzip (.gz) or Unix compress (.Z) files. The compressed
+files are decompressed while they are read, so reading stops as early as for the plain files.
+'''
+import gzip
+import io
+from pathlib import Path
+import metrics
+
+COORD_TYPES = ('STAX', 'STAY', 'STAZ')
+COMPRESSED_SUFFIXES = ('.Z', '.gz')
+
+
+def _iter_unlzw(raw, groups_per_read: int = 512):
+    """
+    Decompress a Unix compress (.Z, LZW) stream
+
+    Parameters:
+    - raw: binary file object positioned at the start of the .Z file
+    - groups_per_read: number of code groups decoded per yielded chunk
+
+    Yields:
+    - chunks of decompressed bytes
+    """
+    header = raw.read(3)
+    if len(header) < 3 or header[0:2] != b'\x1f\x9d':
+        raise ValueError('not a Unix compress (.Z) file')
+    max_bits = header[2] & 0x1f
+    block_mode = bool(header[2] & 0x80)
+    if not 9 <= max_bits <= 16:
+        raise ValueError(f'unsupported .Z code width {max_bits}')
+    max_entries = 1 << max_bits
+
+    # the table holds the whole string of every code; 256 is CLEAR in block mode
+    table = [bytes([i]) for i in range(256)]
+    if block_mode:
+        table.append(b'')
+    n_bits = 9
+    prev = None
+    buffer = b''
+    eof = False
+
+    while not eof or buffer:
+        # the codes are written in groups of n_bits bytes (8 codes); a change of
+        # the code width or a CLEAR discards the rest of the current group
+        want = n_bits * groups_per_read
+        if not eof and len(buffer) < want:
+            data = raw.read(want - len(buffer))
+            eof = len(data) < want - len(buffer)
+            buffer += data
+        if not buffer:
+            break
+
+        out = []
+        pos = 0
+        while pos < len(buffer):
+            group = buffer[pos:pos + n_bits]
+            if len(group) < n_bits and not eof:
+                break
+            pos += n_bits
+            bits = int.from_bytes(group, 'little')
+            mask = (1 << n_bits) - 1
+            for i in range(len(group) * 8 // n_bits):
+                code = (bits >> (i * n_bits)) & mask
+                if code == 256 and block_mode:
+                    del table[256:]
+                    n_bits = 9
+                    break
+                if code < len(table):
+                    entry = table[code]
+                elif code == len(table) and prev is not None:
+                    entry = prev + prev[0:1]
+                else:
+                    raise ValueError('corrupt .Z data')
+                out.append(entry)
+                if prev is not None and len(table) < max_entries:
+                    table.append(prev + entry[0:1])
+                prev = entry
+                if len(table) > mask and n_bits < max_bits:
+                    n_bits += 1
+                    break
+        buffer = buffer[pos:]
+        if out:
+            yield b''.join(out)
+
+
+class LZWReader(io.RawIOBase):
+    """
+    Binary file object of the decompressed content of a .Z file
+    """
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self._chunks = _iter_unlzw(fileobj)
+        self._chunk = memoryview(b'')
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not len(self._chunk):
+            try:
+                self._chunk = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._chunk))
+        b[:n] = self._chunk[:n]
+        self._chunk = self._chunk[n:]
+        return n
+
+    def close(self) -> None:
+        if not self.closed:
+            self._fileobj.close()
+        super().close()
+
+
+def resolve_sinex_file(sinex_file: str):
+    """
+    Path of the SINEX file, or of its compressed (.Z/.gz) copy if only that one exists; None if neither exists
+    """
+    sinex_file = Path(sinex_file)
+    if sinex_file.exists():
+        return sinex_file
+    for suffix in COMPRESSED_SUFFIXES:
+        compressed = sinex_file.with_name(sinex_file.name + suffix)
+        if compressed.exists():
+            return compressed
+    return None
+
+def open_sinex(sinex_file: str):
+    """
+    Open a SINEX file for reading text lines, decompressing .gz and .Z files on the fly.
+    A missing plain file is replaced by its compressed copy (name + .Z/.gz).
+    """
+    path = resolve_sinex_file(sinex_file)
+    if path is None:
+        raise FileNotFoundError(f"SINEX file {sinex_file} not found")
+    if path.suffix == '.gz':
+        return gzip.open(path, 'rt', errors='replace')
+    if path.suffix == '.Z':
+        raw = LZWReader(open(path, 'rb'))
+        return io.TextIOWrapper(io.BufferedReader(raw), errors='replace')
+    return open(path, 'r', errors='replace')
+
+def iter_sinex_estimates(sinex_file: str, param_types: tuple[str] = COORD_TYPES):
+    """
+    Stream the SOLUTION/ESTIMATE block of a SINEX file.
+    Reading stops at -SOLUTION/ESTIMATE, the matrices after it are never read.
+
+    Parameters:
+    - sinex_file: path of the SINEX file
+    - param_types: parameter types to keep (None: all)
+
+    Yields:
+    - (site_code, param_type, ref_epoch, value), e.g. ('ABMF', 'STAX', '22:092:43200', 2919785.698)
+    """
+    in_block = False
+    n_estimates = 0
+    with open_sinex(sinex_file) as inp:
+        metrics.count('files_opened')
+        for line in inp:
+            if not in_block:
+                in_block = line.startswith('+SOLUTION/ESTIMATE')
+                continue
+            if line.startswith('-SOLUTION/ESTIMATE'):
+                break
+            if line.startswith('*'):
+                continue
+            # *INDEX TYPE__ CODE PT SOLN _REF_EPOCH__ UNIT S __ESTIMATED VALUE____ _STD_DEV___
+            fields = line.split()
+            if len(fields) < 9:
+                continue
+            if param_types is not None and fields[1] not in param_types:
+                continue
+            n_estimates += 1
+            yield fields[2].upper(), fields[1], fields[5], float(fields[8])
+    metrics.count('sinex_estimates', n_estimates)
+
+def read_sinex_coords(sinex_file: str) -> dict:
+    """
+    Station coordinates of a SINEX file.
+    A station with several solutions gets the one with the latest reference epoch.
+
+    Returns:
+    - dict site_code -> (x, y, z, ref_epoch) of the stations with all three components
+    """
+    # (site, ref_epoch) -> {param_type: value}
+    estimates = {}
+    for site, param_type, ref_epoch, value in iter_sinex_estimates(sinex_file):
+        estimates.setdefault((site, ref_epoch), {})[param_type] = value
+
+    coords = {}
+    for (site, ref_epoch), values in estimates.items():
+        if len(values) < len(COORD_TYPES):
+            continue
+        # YY:DDD:SSSSS, two-digit years of the same century compare as strings
+        if site in coords and coords[site][3] >= ref_epoch:
+            continue
+        coords[site] = (values['STAX'], values['STAY'], values['STAZ'], ref_epoch)
+    return coords
+
+def read_sinex_sites(sinex_file: str) -> set[str]:
+    """
+    Site codes with all of STAX, STAY and STAZ in the SOLUTION/ESTIMATE block of a SINEX file
+    """
+    components = {}
+    for site, param_type, _, _ in iter_sinex_estimates(sinex_file):
+        components.setdefault(site, set()).add(param_type)
+    return {site for site, types in components.items() if len(types) == len(COORD_TYPES)}
@@ -0,0 +1,155 @@
+'''
+Persistent index of the station presence in the SINEX weekly solution archive
+
+Every site code maps to a bitset of GPS weeks (bit w set: the site has
+STAX/STAY/STAZ estimates in the weekly solution of week w), so the check
+"present in every week of the analysis period" is a bitwise AND.
+'''
+import json
+import os
+import re
+from pathlib import Path
+from time_convert import doy_mjd, mjd_gpswk
+
+INDEX_VERSION = 1
+
+# igs22P2237.snx, igs22P2237.snx.Z
+OLD_NAME = re.compile(r'^igs(\d{2})P(\d{4})\.snx(\.Z|\.gz)?$', re.IGNORECASE)
+# IGS0OPSSNX_20230010000_07D_07D_SOL.SNX, IGS0OPSSNX_20230010000_07D_07D_SOL.SNX.gz
+NEW_NAME = re.compile(r'^IGS0OPSSNX_(\d{4})(\d{3})0000_07D_07D_SOL\.SNX(\.Z|\.gz)?$', re.IGNORECASE)
+
+
+def sinex_file_week(sinex_file_name: str):
+    """
+    GPS week of a weekly solution file name in either naming scheme, None for other files
+    """
+    match = OLD_NAME.match(sinex_file_name)
+    if match:
+        return int(match.group(2))
+    match = NEW_NAME.match(sinex_file_name)
+    if match:
+        gpsweek, _ = mjd_gpswk(doy_mjd(int(match.group(1)), int(match.group(2))))
+        return gpsweek
+    return None
+
+def period_gps_weeks(year: int, doy_start: int, doy_end: int) -> list[int]:
+    """
+    GPS weeks covering doy_start..doy_end of year
+    """
+    first_week, _ = mjd_gpswk(doy_mjd(year, doy_start))
+    last_week, _ = mjd_gpswk(doy_mjd(year, doy_end))
+    return list(range(first_week, last_week + 1))
+
+
+class SinexPresenceIndex:
+    """
+    site code -> bitset of GPS weeks over all the weekly solutions of a directory.
+    update() parses only the files that are new or changed since the last update.
+    """
+
+    def __init__(self, sinex_root_path: str, index_file: str = None):
+        """
+        Parameters:
+        - sinex_root_path: directory of the SINEX weekly solution files
+        - index_file: JSON file of the persistent index (None: in memory only)
+        """
+        self.sinex_root_path = Path(sinex_root_path)
+        self.index_file = index_file
+        # file name -> (GPS week, mtime)
+        self.files = {}
+        # site code -> bitset of GPS weeks
+        self.sites = {}
+        self.weeks = 0
+        self._load()
+
+    def _load(self) -> None:
+        if self.index_file is None or not os.path.exists(self.index_file):
+            return
+        try:
+            with open(self.index_file, 'r') as inp:
+                index = json.load(inp)
+        except (OSError, ValueError):
+            print(f"Warning: the SINEX index {self.index_file} is unreadable, it will be rebuilt")
+            return
+        if index.get('version') != INDEX_VERSION:
+            return
+        self.files = {name: tuple(entry) for name, entry in index['files'].items()}
+        self.sites = {site: int(bits, 16) for site, bits in index['sites'].items()}
+        self.weeks = int(index['weeks'], 16)
+
+    def save(self) -> None:
+        """
+        Write the index file
+        """
+        if self.index_file is None:
+            return
+        index = {
+            'version': INDEX_VERSION,
+            'files': self.files,
+            'weeks': f"{self.weeks:x}",
+            'sites': {site: f"{bits:x}" for site, bits in self.sites.items()},
+        }
+        tmp_file = f"{self.index_file}.tmp{os.getpid()}"
+        with open(tmp_file, 'w') as outp:
+            json.dump(index, outp)
+        os.replace(tmp_file, self.index_file)
+
+    def update(self) -> int:
+        """
+        Index the new and changed weekly solution files of the directory
+
+        Returns:
+        - number of files parsed
+        """
+        from sinex import read_sinex_sites
+
+        on_disk = {}
+        for path in self.sinex_root_path.iterdir():
+            gpsweek = sinex_file_week(path.name)
+            if gpsweek is not None:
+                on_disk[path.name] = (gpsweek, path.stat().st_mtime)
+
+        changed_weeks = {entry[0] for name, entry in on_disk.items() if self.files.get(name) != entry}
+        # deleted files
+        changed_weeks |= {entry[0] for name, entry in self.files.items() if name not in on_disk}
+        if not changed_weeks:
+            return 0
+
+        # a week is rebuilt from all its files (both naming schemes may exist for a week)
+        clear_mask = ~sum(1 << gpsweek for gpsweek in changed_weeks)
+        self.sites = {site: bits & clear_mask for site, bits in self.sites.items()}
+        self.weeks &= clear_mask
+
+        n_parsed = 0
+        for name, (gpsweek, _) in sorted(on_disk.items()):
+            if gpsweek not in changed_weeks:
+                continue
+            week_bit = 1 << gpsweek
+            for site in read_sinex_sites(self.sinex_root_path / name):
+                self.sites[site] = self.sites.get(site, 0) | week_bit
+            self.weeks |= week_bit
+            n_parsed += 1
+
+        self.sites = {site: bits for site, bits in self.sites.items() if bits}
+        self.files = on_disk
+        self.save()
+        return n_parsed
+
+    def sites_in_all_weeks(self, weeks: list[int]) -> set[str]:
+        """
+        Site codes with estimates in every one of the GPS weeks
+        """
+        mask = sum(1 << gpsweek for gpsweek in set(weeks))
+        missing_weeks = mask & ~self.weeks
+        if missing_weeks:
+            missing = [gpsweek for gpsweek in weeks if missing_weeks >> gpsweek & 1]
+            print(f"Warning: no SINEX file for GPS weeks {missing}\n")
+            return set()
+        return {site for site, bits in self.sites.items() if bits & mask == mask}
+
+    def filter_sites(self, site_list: list[str], year: int, doy_start: int, doy_end: int) -> list[str]:
+        """
+        The stations of site_list with estimates in every weekly solution of the period, in the order of site_list
+        """
+        present = self.sites_in_all_weeks(period_gps_weeks(year, doy_start, doy_end))
+        return [site for site in site_list if site.upper() in present]
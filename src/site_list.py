@@ -1,9 +1,13 @@
 '''
 Functions related to the site list
 '''
-import pandas as pd
+from __future__ import annotations
 from pathlib import Path
-import numpy as np
+from typing import TYPE_CHECKING
+import metrics
+# pandas is imported where it is used, reading site lists does not need it
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 def read_list(site_list_file: str) -> list[str]:
@@ -17,36 +21,133 @@ def read_list(site_list_file: str) -> list[str]:
 
     return site_list
 
-def read_coord_from_rinexo(oFile:str)->list[float]:
+def read_rinexo_header(oFile:str)->dict:
     """
-    Read approximate coordinate information from the RINEXO file
+    Read the header of a RINEX observation file (version 2 or 3).
+    The lines are streamed and reading stops at END OF HEADER,
+    so the observation records are never read.
+    
+    Returns:
+    - dict with
+      version: RINEX version (float)
+      sat_system: satellite system of the file (G, R, E, C, M, ...)
+      marker_name, receiver_type, receiver_version, antenna_type: str
+      approx_xyz: [x, y, z] approximate position, None if missing
+      interval: observation interval in seconds, None if missing
+      obs_types: {system: [observation codes]}; the RINEX 2 list is stored
+                 under the satellite system of the file
     """
-    with open(oFile, 'r') as inp:
-        all_data = inp.readlines()
+    header = {'version': None, 'sat_system': None, 'marker_name': '',
+              'receiver_type': '', 'receiver_version': '', 'antenna_type': '',
+              'approx_xyz': None, 'interval': None, 'obs_types': {}}
+    obs_sys = None
+    n_bytes = 0
     
-    for data in all_data:
-        if len(data) < 60:
-            continue
-        elif data[60:80].strip().upper() == 'APPROX POSITION XYZ':
-            coord = data[0:60].split()
-            coord = [float(x) for x in coord]
-            return coord
+    # binary read: bytes_read counts the bytes of the header, not its characters
+    with open(oFile, 'rb') as inp:
+        for raw_line in inp:
+            n_bytes += len(raw_line)
+            line = raw_line.decode(errors='replace')
+            label = line[60:80].strip().upper()
+            if label == 'END OF HEADER':
+                break
+            elif label == 'RINEX VERSION / TYPE':
+                header['version'] = float(line[0:9])
+                header['sat_system'] = line[40:41].strip() or 'G'
+            elif label == 'MARKER NAME':
+                header['marker_name'] = line[0:60].strip()
+            elif label == 'REC # / TYPE / VERS':
+                header['receiver_type'] = line[20:40].strip()
+                header['receiver_version'] = line[40:60].strip()
+            elif label == 'ANT # / TYPE':
+                header['antenna_type'] = line[20:40].strip()
+            elif label == 'APPROX POSITION XYZ':
+                coord = line[0:60].split()
+                header['approx_xyz'] = [float(x) for x in coord]
+            elif label == 'INTERVAL':
+                header['interval'] = float(line[0:10])
+            elif label == 'SYS / # / OBS TYPES':
+                # RINEX 3: continuation lines leave the system blank
+                if line[0:1].strip():
+                    obs_sys = line[0]
+                    header['obs_types'][obs_sys] = []
+                elif obs_sys is None:
+                    # continuation line without a system before it: malformed, ignored
+                    continue
+                header['obs_types'][obs_sys].extend(line[7:60].split())
+            elif label == '# / TYPES OF OBSERV':
+                # RINEX 2: one list for all the systems
+                obs_sys = header['sat_system'] or 'G'
+                header['obs_types'].setdefault(obs_sys, []).extend(line[6:60].split())
+    metrics.count('files_opened')
+    metrics.count('bytes_read', n_bytes)
+    
+    return header
 
-def scan_rinexo_coord(data_root_path: str, site_list: list[str], year: int, doy: int)->pd.DataFrame:
-    yy = str(year)[2:]
-    doy_str = str(doy).zfill(3)
+def read_coord_from_rinexo(oFile:str)->list[float]:
+    """
+    Read approximate coordinate information from the RINEXO file
+    """
+    return read_rinexo_header(oFile)['approx_xyz']
 
-    df = pd.DataFrame(columns=['site_name', 'x', 'y', 'z'])
-    for site in site_list:
-        oFileName = f"{site.lower()}{doy_str}0.{yy}o"
-        oFile = Path(data_root_path,'obs','daily',str(year),doy_str,oFileName)
-        if not oFile.exists():
-            continue
+def _read_site_coord(oFile: Path):
+    """
+    Approximate coordinate of a RINEXO file, None if the file or the position is missing or malformed
+    """
+    try:
         coord = read_coord_from_rinexo(oFile)
-        new_row = pd.DataFrame([{'site_name': site, 'x': coord[0], 'y': coord[1], 'z': coord[2]}])
-        df = pd.concat([df, new_row], ignore_index=True)
+    except (OSError, ValueError, UnicodeDecodeError, KeyError, IndexError):
+        return None
+    if coord is None or len(coord) != 3:
+        return None
+    return coord
 
+def scan_rinexo_coord(data_root_path: str, site_list: list[str], year: int, doy: int,
+                      n_jobs: int = 16, return_missing: bool = False):
+    """
+    Read the approximate coordinates of the stations from the headers of the RINEXO files of a day.
+    The headers are read concurrently by a bounded thread pool (the reads are
+    latency bound on network filesystems) and the frame is built in one step.
+    
+    Parameters:
+    - data_root_path: Data Directory, the files are in obs/daily/{year}/{doy}
+    - site_list: station names
+    - year, doy: the day
+    - n_jobs: maximum number of concurrent header reads
+    - return_missing: also return the stations without a file or with a missing/malformed position
+    
+    Returns:
+    - pandas DataFrame with site_name (categorical) and float64 x, y, z
+    - missing: list of the station names left out (only with return_missing=True)
+    """
+    import numpy as np
+    import pandas as pd
+    from concurrent.futures import ThreadPoolExecutor
+    
+    yy = str(year)[2:]
+    doy_str = str(doy).zfill(3)
+    oFiles = [Path(data_root_path, 'obs', 'daily', str(year), doy_str, f"{site.lower()}{doy_str}0.{yy}o")
+              for site in site_list]
+    
+    n_jobs = max(1, min(n_jobs, len(oFiles)))
+    with metrics.timer('scan_rinexo_coord'), ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        coords = list(executor.map(_read_site_coord, oFiles))
+    
+    found = [i for i, coord in enumerate(coords) if coord is not None]
+    metrics.count('stations_parsed', len(found))
+    missing = [site_list[i] for i, coord in enumerate(coords) if coord is None]
+    xyz = np.array([coords[i] for i in found], dtype=np.float64).reshape(-1, 3)
+    
+    df = pd.DataFrame({
+        'site_name': pd.Categorical([site_list[i] for i in found]),
+        'x': xyz[:, 0],
+        'y': xyz[:, 1],
+        'z': xyz[:, 2],
+    })
+    
     # df.set_index('site_name', inplace=True)
+    if return_missing:
+        return df, missing
     return df
 
 def write_site_list(site_list: list[str], out_path: str) -> None:
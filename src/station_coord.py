@@ -0,0 +1,191 @@
+'''
+Station coordinates from a cascade of sources with a persistent cache
+
+The sources are tried in the order
+- the STAX/STAY/STAZ estimates of the IGS weekly solution (SINEX) files of the period
+- the X/Y/Z columns of IGSNetwork.csv
+- the approximate position in the RINEX observation headers of the period
+'''
+from __future__ import annotations
+import json
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING
+import metrics
+if TYPE_CHECKING:
+    import pandas as pd
+
+CACHE_VERSION = 1
+
+
+def read_igs_network_coords(igs_filename: str) -> dict:
+    """
+    Station coordinates of IGSNetwork.csv
+
+    Returns:
+    - dict 4-char site code -> (x, y, z)
+    """
+    from igs_metadata import load_igs_metadata
+
+    meta = load_igs_metadata(igs_filename)
+    meta = meta.dropna(subset=['x', 'y', 'z'])
+    return dict(zip(meta.index, zip(meta['x'], meta['y'], meta['z'])))
+
+
+class StationCoordProvider:
+    """
+    Coordinates of the stations of a period (year, doy_start..doy_end).
+
+    The cache maps site -> {source epoch: [x, y, z]}, where the source epoch is
+    'sinex:<SINEX file name>', 'igsnet:<file name>' or 'rinex:<yyyyddd>'.
+    A SINEX or IGSNetwork.csv file is parsed once for all its stations and
+    again only when its modification time changes; a RINEX header is read
+    once per site and day.
+    """
+
+    def __init__(self, data_root_path: str, year: int, doy_start: int, doy_end: int,
+                 sinex_root_path: str = None, igs_filename: str = 'IGSNetwork.csv',
+                 cache_file: str = None):
+        """
+        Parameters:
+        - data_root_path: Data Directory (obs/daily/{year}/{doy} for the RINEX headers)
+        - year, doy_start, doy_end: the period
+        - sinex_root_path: directory of the SINEX weekly solutions (default: data_root_path/snx)
+        - igs_filename: path of IGSNetwork.csv (None: not used)
+        - cache_file: JSON file of the persistent cache (None: no persistence)
+        """
+        self.data_root_path = data_root_path
+        self.year = year
+        self.doy_start = doy_start
+        self.doy_end = doy_end
+        self.sinex_root_path = sinex_root_path if sinex_root_path is not None else Path(data_root_path, 'snx')
+        self.igs_filename = igs_filename
+        self.cache_file = cache_file
+        self.coords = {}
+        self.sources = {}
+        self.dirty = False
+        self._load_cache()
+
+    def _load_cache(self) -> None:
+        if self.cache_file is None or not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, 'r') as inp:
+                cache = json.load(inp)
+        except (OSError, ValueError):
+            print(f"Warning: the coordinate cache {self.cache_file} is unreadable, it will be rebuilt")
+            return
+        if cache.get('version') != CACHE_VERSION:
+            return
+        self.coords = cache['coords']
+        self.sources = cache['sources']
+
+    def save_cache(self) -> None:
+        """
+        Write the cache file if it changed
+        """
+        if self.cache_file is None or not self.dirty:
+            return
+        cache = {'version': CACHE_VERSION, 'sources': self.sources, 'coords': self.coords}
+        tmp_file = f"{self.cache_file}.tmp{os.getpid()}"
+        with open(tmp_file, 'w') as outp:
+            json.dump(cache, outp)
+        # atomic, concurrent runs never see a partial cache
+        os.replace(tmp_file, self.cache_file)
+        self.dirty = False
+
+    def _store(self, site: str, source_epoch: str, xyz) -> None:
+        self.coords.setdefault(site, {})[source_epoch] = [float(value) for value in xyz]
+        self.dirty = True
+
+    def _refresh_source(self, source_epoch: str, path: Path, reader) -> None:
+        """
+        Parse a whole-network source file if it is not in the cache or changed since
+        """
+        try:
+            mtime = os.stat(path).st_mtime
+        except (FileNotFoundError, TypeError):
+            # the cached coordinates, if any, stay usable
+            return
+        if self.sources.get(source_epoch) == mtime:
+            return
+        for site, coord in reader(path).items():
+            self._store(site, source_epoch, coord[0:3])
+        self.sources[source_epoch] = mtime
+        self.dirty = True
+
+    def _whole_network_sources(self) -> list[tuple]:
+        """
+        (source epoch, path, reader) of the SINEX files of the period and of IGSNetwork.csv, in cascade order
+        """
+        from gene_initial_4sys_sitelist import generate_sinex_week_file_list
+        from sinex import read_sinex_coords, resolve_sinex_file
+
+        sources = []
+        for sinex_file in generate_sinex_week_file_list(self.sinex_root_path, self.year, self.doy_start, self.doy_end):
+            # a compressed copy (.Z/.gz) is read if the plain file is missing
+            sources.append((f"sinex:{sinex_file.name}", resolve_sinex_file(sinex_file), read_sinex_coords))
+        if self.igs_filename is not None:
+            sources.append((f"igsnet:{Path(self.igs_filename).name}", self.igs_filename, read_igs_network_coords))
+        return sources
+
+    @metrics.timed('station_coords')
+    def get_coords(self, site_list: list[str]) -> pd.DataFrame:
+        """
+        Coordinates of the stations
+
+        Parameters:
+        - site_list: station names (the first four characters are the site code)
+
+        Returns:
+        - pandas DataFrame with site_name, x, y, z, coord_source of the stations found
+        """
+        import pandas as pd
+
+        found = {}
+        codes = {site: site[0:4].upper() for site in site_list}
+
+        for source_epoch, path, reader in self._whole_network_sources():
+            missing = [site for site in site_list if site not in found]
+            if not missing:
+                break
+            self._refresh_source(source_epoch, path, reader)
+            for site in missing:
+                xyz = self.coords.get(codes[site], {}).get(source_epoch)
+                if xyz is not None:
+                    found[site] = (xyz, source_epoch)
+
+        from site_list import scan_rinexo_coord
+        for doy in range(self.doy_start, self.doy_end + 1):
+            source_epoch = f"rinex:{self.year:04d}{doy:03d}"
+            to_read = []
+            for site in site_list:
+                if site in found:
+                    continue
+                xyz = self.coords.get(codes[site], {}).get(source_epoch)
+                if xyz is None:
+                    to_read.append(site)
+                else:
+                    found[site] = (xyz, source_epoch)
+            if not to_read:
+                continue
+            # the headers of the day are read concurrently
+            rinex_df = scan_rinexo_coord(self.data_root_path, to_read, self.year, doy)
+            for site, x, y, z in zip(rinex_df['site_name'].astype(str), rinex_df['x'], rinex_df['y'], rinex_df['z']):
+                self._store(codes[site], source_epoch, (x, y, z))
+                found[site] = (self.coords[codes[site]][source_epoch], source_epoch)
+
+        self.save_cache()
+
+        missing = [site for site in site_list if site not in found]
+        if missing:
+            print(f"Warning: no coordinates for {len(missing)} stations: {' '.join(missing)}")
+
+        sites = [site for site in site_list if site in found]
+        return pd.DataFrame({
+            'site_name': sites,
+            'x': [found[site][0][0] for site in sites],
+            'y': [found[site][0][1] for site in sites],
+            'z': [found[site][0][2] for site in sites],
+            'coord_source': [found[site][1].split(':')[0] for site in sites],
+        })
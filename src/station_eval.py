@@ -7,13 +7,20 @@
 where M stands for multi-day and S stands for single-day
 '''
 
+from __future__ import annotations
 import numpy as np
-import pandas as pd
 from pathlib import Path
 import os
+from typing import TYPE_CHECKING
+import metrics
+# pandas is imported by the functions that build DataFrames
+if TYPE_CHECKING:
+    import pandas as pd
 
 def directional_norm(df, direction):
     """Direction normalization"""
+    import pandas as pd
+    
     x = df.values.copy().astype(float)
     for j, d in enumerate(direction):
         col_data = x[:, j]
@@ -71,6 +78,7 @@ def get_quality_level(score: float) -> str:
     else:
         return 'Poor'
 
+@metrics.timed('topsis')
 def gnss_topsis_evaluation(stations: pd.DataFrame, w_sys: dict=None, show_details:bool=True)->pd.DataFrame:
     """
     Main function for quality evaluation of GNSS station data
@@ -83,6 +91,7 @@ def gnss_topsis_evaluation(stations: pd.DataFrame, w_sys: dict=None, show_detail
     Returns:
     - DataFrame: Evaluation results, including TOPSIS scores and quality grades
     """
+    import pandas as pd
     
     # Default system weight
     if w_sys is None:
@@ -184,6 +193,25 @@ def gnss_topsis_evaluation(stations: pd.DataFrame, w_sys: dict=None, show_detail
     
     return result_df
 
+def station_eval_period(site_list: list[str], year: int, doy_start: int, doy_end: int,
+                        work_root_path: str, show_details: bool = True) -> pd.DataFrame:
+    """
+    Quality evaluation of the stations over a period, in memory
+    - site_list: station names
+    - year, doy_start, doy_end: the period, the anubis results of all its days are evaluated together
+    - work_root_path: working directory (anubis results)
+    - show_details: print the statistics of the evaluation
+
+    Returns:
+    - pandas DataFrame indexed by site_name with topsis_score and quality_level, best first
+    """
+    from extract_qc import extract_qc_multiple_days
+
+    stations_data = extract_qc_multiple_days(site_list, year, doy_start, doy_end, work_root_path)
+    stations_data.set_index('site_name', inplace=True)
+    results = gnss_topsis_evaluation(stations_data, show_details=show_details)
+    return results[['topsis_score', 'quality_level']]
+
 def station_eval_main(site_list_file: str, year: int, 
                     doy_start: int, doy_end: int, 
                     work_root_path: str, out_path: str,
@@ -201,27 +229,22 @@ def station_eval_main(site_list_file: str, year: int,
                 When S is selected, doy_end can also be bigger than doy_start,
                 and the files will be output on a daily basis.
     """
-    from extract_qc import extract_qc_single_day,extract_qc_multiple_days
     from site_list import read_list
 
     site_list = read_list(site_list_file)
     if not os.path.exists(out_path):
         os.mkdir(out_path)
 
-    if args.mode_flag.upper() == 'S':
+    if mode_flag.upper() == 'S':
         for doy in range(doy_start, doy_end+1):
-            stations_data = extract_qc_single_day(site_list, year, doy, work_root_path)
-            stations_data.set_index('site_name', inplace=True)
-            results = gnss_topsis_evaluation(stations_data)
-            result_file_name = Path(args.out_path, f'sta_rank_evaluation_{year:04d}_{doy:03d}_{doy:03d}.csv')
-            results[['topsis_score', 'quality_level']].to_csv(result_file_name)
-
-    elif args.mode_flag.upper() == 'M':
-        stations_data = extract_qc_multiple_days(site_list, year, doy_start, doy_end, work_root_path)
-        stations_data.set_index('site_name', inplace=True)
-        results = gnss_topsis_evaluation(stations_data)
-        result_file_name = Path(args.out_path, f'sta_rank_evaluation_{year:04d}_{doy_start:03d}_{doy_end:03d}.csv')
-        results[['topsis_score', 'quality_level']].to_csv(result_file_name)
+            results = station_eval_period(site_list, year, doy, doy, work_root_path)
+            result_file_name = Path(out_path, f'sta_rank_evaluation_{year:04d}_{doy:03d}_{doy:03d}.csv')
+            results.to_csv(result_file_name)
+
+    elif mode_flag.upper() == 'M':
+        results = station_eval_period(site_list, year, doy_start, doy_end, work_root_path)
+        result_file_name = Path(out_path, f'sta_rank_evaluation_{year:04d}_{doy_start:03d}_{doy_end:03d}.csv')
+        results.to_csv(result_file_name)
 
     else:
         print('the mode_flag is not correct, please input S or M')
@@ -239,12 +262,14 @@ if __name__ == "__main__":
     parser.add_argument('--work_root_path', help='Working root directory path')
     parser.add_argument('--out_path', help='Output path of the station scoring file')
     parser.add_argument('--mode_flag', help='Multi-day or single-day mode: M represents multi-day mode, and S represents single-day mode.')
+    metrics.add_cli_arguments(parser)
     # ===========================
 
     args = parser.parse_args()
-    station_eval_main(args.site_list_file, 
-        args.year, args.doy_start, args.doy_end, 
-        args.work_root_path, args.out_path, 
-        args.mode_flag)
+    with metrics.cli_session(args, 'station_eval'):
+        station_eval_main(args.site_list_file, 
+            args.year, args.doy_start, args.doy_end, 
+            args.work_root_path, args.out_path, 
+            args.mode_flag)
 
     
\ No newline at end of file
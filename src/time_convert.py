@@ -4,7 +4,6 @@
  This py module is used for converting different time
 '''
 
-import numpy as np
 from math import *
 import sys
 import os
@@ -14,6 +13,76 @@ Month = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
 Doys = [366, 365, 365, 365]
 Jdst = 34012
 Yearst = 1952
+# MJD of the GPS time origin, 1980-01-06
+Mjd_gpst0 = 44244
+
+# The conversions below are closed-form integer arithmetic on the proleptic
+# Gregorian calendar. They take Python integers or integer numpy arrays
+# (e.g. numpy.arange(mjd_start, mjd_end)), element-wise, without loops.
+
+def mjd_year_start(year):
+	'''
+	MJD of January 1 of year
+	'''
+	y = year - 1
+	return 365 * y + y // 4 - y // 100 + y // 400 - 678575
+
+def is_leap_year(year):
+	'''
+	Gregorian leap year rule
+	'''
+	return (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+
+def ymd_to_mjd(year, month, day):
+	'''
+	Year, month, day to MJD
+	'''
+	# the year starts in March, so that February 29 is its last day
+	y = year - (month <= 2)
+	mp = (month + 9) % 12
+	return 365 * y + y // 4 - y // 100 + y // 400 + (153 * mp + 2) // 5 + day - 678882
+
+def mjd_to_ymd(mjd):
+	'''
+	MJD to (year, month, day)
+	'''
+	# days since 0000-03-01 in 400-year eras of 146097 days
+	z = mjd + 678881
+	era = z // 146097
+	doe = z - era * 146097
+	yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+	doy_mar = doe - (365 * yoe + yoe // 4 - yoe // 100)
+	mp = (5 * doy_mar + 2) // 153
+	day = doy_mar - (153 * mp + 2) // 5 + 1
+	month = mp + 3 - 12 * (mp >= 10)
+	year = yoe + era * 400 + (month <= 2)
+	return year, month, day
+
+def doy_to_mjd(year, doy):
+	'''
+	Year, day of year to MJD
+	'''
+	return mjd_year_start(year) + doy - 1
+
+def mjd_to_doy(mjd):
+	'''
+	MJD to (year, day of year)
+	'''
+	year = mjd_to_ymd(mjd)[0]
+	return year, mjd - mjd_year_start(year) + 1
+
+def mjd_to_gpsweek(mjd):
+	'''
+	MJD to (GPS week, day of week)
+	'''
+	week = (mjd - Mjd_gpst0) // 7
+	return week, mjd - Mjd_gpst0 - week * 7
+
+def gpsweek_to_mjd(week, dow):
+	'''
+	GPS week, day of week to MJD
+	'''
+	return week * 7 + Mjd_gpst0 + dow
 
 def doy_ymd(*timeinp):
 	'''
@@ -23,19 +92,10 @@ def doy_ymd(*timeinp):
 	ninp = len(timeinp)
 	if ninp == 3:
 		year, mm, dd = timeinp
-		doy = Month_doy[mm - 1] + dd
-		doy = doy + 1 if (year - 1988) % 4 == 0 and mm > 2 else doy
-		return year, doy
+		return year, ymd_to_mjd(year, mm, dd) - mjd_year_start(year) + 1
 	elif ninp == 2:
 		year, doy = timeinp
-		month = Month[:]
-		month[1] = month[1] + 1 if (year - 1988) % 4 == 0 else month[1]
-		for imon in range(len(month)):
-			if doy > month[imon]:
-				doy = doy - month[imon]
-			else:
-				break
-		return year, imon + 1, doy
+		return mjd_to_ymd(doy_to_mjd(year, doy))
 	else:
 		print('Wrong input time: ' + str(timeinp))
 		sys.exit()
@@ -47,24 +107,11 @@ def doy_mjd(*timeinp):
 	timeinp: arg of time(mjd/year doy)
 	'''
 	ninp = len(timeinp)
-	iy = 1
 	if ninp == 1:
-		mjd = timeinp[0]
-		year, doy = Yearst, mjd + 1 - Jdst
-		while doy > Doys[iy - 1]:
-			doy = doy - Doys[iy - 1]
-			year = year + 1
-			iy = year % 4 + 1
-		return year, doy
+		return mjd_to_doy(timeinp[0])
 	elif ninp == 2:
 		year, doy = timeinp
-		nyear = year - Yearst
-		leap = floor((nyear + 3) / 4)
-		dd = nyear * 365
-		leapy = year % 4 + 1
-		mjd = Jdst - 1 + dd + leap + doy
-		mjd = mjd - 1 if dd < 29 and leapy == 1 and nyear > 0 else mjd
-		return mjd
+		return doy_to_mjd(year, doy)
 	else:
 		print('Wrong input time: ' + str(timeinp))
 
@@ -77,13 +124,12 @@ def mjd_gpswk(*timeinp):
 	ninp = len(timeinp)
 	if ninp == 1:
 		mjd = timeinp[0]
-		nwk = int((mjd - 44244) / 7)
-		nwkd = mjd - nwk * 7 - 44244
+		nwk = int((mjd - Mjd_gpst0) // 7)
+		nwkd = mjd - nwk * 7 - Mjd_gpst0
 		return nwk, nwkd
 	elif ninp == 2:
 		nwk, nwkd = timeinp
-		mjd = nwk * 7 + 44244 + nwkd
-		return mjd
+		return gpsweek_to_mjd(nwk, nwkd)
 	else:
 		print('Wrong input time: ' + str(timeinp))
 		sys.exit()
@@ -198,6 +244,7 @@ def calGMST(D):
 	D: Julian day
 	return: GMST
 	'''
+    import numpy as np
     T = D / 36525.0
     GMST = 6.697374558 + 2400.051336*T + 0.000025862*T*T
     GMST = np.mod(GMST, 24)
@@ -210,6 +257,7 @@ def calGAST(MJD):
 	D: modified Julian day
 	return: GAST
 	'''
+    import numpy as np
     fjd = MJD + 2400000.5
     TJD = fjd - 2451545.0 # Julian day of 2000-1-1.5 
     T0 = TJD / 36525.0